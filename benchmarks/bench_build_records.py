@@ -0,0 +1,84 @@
+"""
+Micro-benchmark: build_records_from_df (iterrows + dict/dòng) so với
+build_frame_from_df (columnar) cho dữ liệu nến 5 phút của nhiều ticker.
+
+Chạy: python -m benchmarks.bench_build_records --tickers 200 --bars 2000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.extract_util import build_frame_from_df, build_records_from_df
+
+
+def make_indicator_frame(bars: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2025-01-02 14:30", periods=bars, freq="5min", tz="UTC")
+    close = 100 + rng.standard_normal(bars).cumsum()
+    result = pd.DataFrame(
+        {
+            "Close": close,
+            "Volume": rng.integers(1_000, 1_000_000, bars).astype(float),
+        },
+        index=index,
+    )
+    result["Diff"] = result["Close"].diff()
+    result["PercentChangeClose"] = result["Close"].pct_change() * 100
+    return result
+
+
+def run_legacy(inputs):
+    all_rows = []
+    for ticker, indicators in inputs:
+        all_rows.extend(build_records_from_df(ticker, indicators))
+    return pd.DataFrame(all_rows).round(4)
+
+
+def run_columnar(inputs):
+    frames = [build_frame_from_df(ticker, indicators) for ticker, indicators in inputs]
+    return pd.concat(frames, ignore_index=True).round(4)
+
+
+def timed(fn, inputs, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(inputs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--bars", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    inputs = [
+        (f"T{i:04d}", make_indicator_frame(args.bars, seed=i))
+        for i in range(args.tickers)
+    ]
+    rows = args.tickers * args.bars
+
+    legacy_time, legacy_df = timed(run_legacy, inputs, args.repeat)
+    columnar_time, columnar_df = timed(run_columnar, inputs, args.repeat)
+
+    # Hai cách phải cho ra cùng dữ liệu (trừ extracted_at)
+    cols = [c for c in legacy_df.columns if c != "extracted_at"]
+    pd.testing.assert_frame_equal(
+        legacy_df[cols], columnar_df[cols], check_dtype=False
+    )
+
+    print(f"Rows: {rows:,} ({args.tickers} tickers x {args.bars} bars)")
+    print(f"build_records_from_df : {legacy_time:8.3f}s ({rows / legacy_time:,.0f} rows/s)")
+    print(f"build_frame_from_df   : {columnar_time:8.3f}s ({rows / columnar_time:,.0f} rows/s)")
+    print(f"Speedup               : {legacy_time / columnar_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
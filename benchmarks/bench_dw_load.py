@@ -0,0 +1,164 @@
+"""
+So sánh procedure nạp fact của DW (đọc DB_* từ .env):
+sp_load_stock_files_from_tmp (LEFT JOIN anti-join, chỉ insert dòng mới) với
+sp_upsert_stock_files_from_tmp (INSERT ... ON CONFLICT trên uq_fact_stock_date,
+chỉ cập nhật dòng có row_hash đổi).
+
+    python -m benchmarks.bench_dw_load --fact-rows 10000000 --new-days 1 --revised-days 5
+
+fact_stock_indicators được nạp sẵn --fact-rows dòng (stock x ngày của dim_date), sau đó
+tmp_fact_stock chứa --new-days ngày mới và --revised-days ngày gần nhất đã có với giá
+sửa lại. Tất cả nằm trong một transaction được ROLLBACK, dữ liệu DB không đổi.
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from db.dw_db import DWDatabase
+
+PROCEDURES = ["sp_load_stock_files_from_tmp", "sp_upsert_stock_files_from_tmp"]
+
+
+def create_partitions(cursor, days: int):
+    """Partition tháng cho days ngày đầu của dim_date (fact được partition theo date_sk)"""
+    cursor.execute(
+        """
+        SELECT MIN(full_date), MAX(full_date)
+        FROM (SELECT full_date FROM dim_date ORDER BY full_date LIMIT %s) d
+        """,
+        (days,),
+    )
+    cursor.execute("CALL sp_create_fact_partitions(%s, %s)", cursor.fetchone())
+
+
+def prefill_fact(cursor, fact_rows: int, days: int):
+    """Nạp fact_rows dòng giả: stocks = fact_rows / days ticker, mỗi ticker days ngày liên tiếp"""
+    stocks = max(1, fact_rows // days)
+    cursor.execute(
+        """
+        INSERT INTO dim_stock (ticker)
+        SELECT 'BENCH' || i FROM generate_series(1, %s) i
+        ON CONFLICT (ticker) DO NOTHING
+        """,
+        (stocks,),
+    )
+    cursor.execute(
+        """
+        INSERT INTO fact_stock_indicators (
+            stock_sk, date_sk, close, volume, diff, percent_change_close,
+            rsi, roc, bb_upper, bb_lower, created_at, row_hash
+        )
+        SELECT s.stock_sk, d.date_sk, v.close, 1000, 0.5, 0.1,
+               50, 1, v.close + 2, v.close - 2, LOCALTIMESTAMP,
+               fn_fact_row_hash(v.close, 1000, 0.5, 0.1, 50, 1, v.close + 2, v.close - 2)
+        FROM dim_stock s
+        CROSS JOIN (
+            SELECT date_sk FROM dim_date ORDER BY full_date LIMIT %s
+        ) d
+        CROSS JOIN LATERAL (SELECT (100 + d.date_sk %% 50)::NUMERIC(12, 4) AS close) v
+        WHERE s.ticker LIKE 'BENCH%%'
+        """,
+        (days,),
+    )
+    cursor.execute("ANALYZE fact_stock_indicators")
+    return stocks
+
+
+def build_tmp_fact(cursor, days: int, new_days: int, revised_days: int):
+    """tmp_fact_stock: revised_days ngày cuối đã có (close +1) và new_days ngày kế tiếp"""
+    cursor.execute("DROP TABLE IF EXISTS tmp_dim_stock")
+    cursor.execute("CREATE TEMP TABLE tmp_dim_stock (stock_sk INT, ticker VARCHAR(20))")
+    cursor.execute(
+        """
+        INSERT INTO tmp_dim_stock
+        SELECT stock_sk, ticker FROM dim_stock WHERE ticker LIKE 'BENCH%%'
+        """
+    )
+    cursor.execute("DROP TABLE IF EXISTS tmp_fact_stock")
+    cursor.execute(
+        """
+        CREATE TEMP TABLE tmp_fact_stock (
+            record_sk INT, stock_sk INT, datetime_utc TIMESTAMPTZ,
+            close NUMERIC(12,4), volume BIGINT, diff NUMERIC(12,4),
+            percent_change_close NUMERIC(12,6), rsi NUMERIC(8,4), roc NUMERIC(8,4),
+            bb_upper NUMERIC(12,4), bb_lower NUMERIC(12,4), created_at TIMESTAMP
+        )
+        """
+    )
+    cursor.execute(
+        """
+        INSERT INTO tmp_fact_stock
+        SELECT NULL, s.stock_sk, d.full_date + TIME '20:55', v.close, 1000, 0.5, 0.1,
+               50, 1, v.close + 2, v.close - 2, LOCALTIMESTAMP
+        FROM dim_stock s
+        CROSS JOIN (
+            SELECT date_sk, full_date FROM dim_date ORDER BY full_date
+            OFFSET %s LIMIT %s
+        ) d
+        CROSS JOIN LATERAL (SELECT (101 + d.date_sk %% 50)::NUMERIC(12, 4) AS close) v
+        WHERE s.ticker LIKE 'BENCH%%'
+        """,
+        (max(0, days - revised_days), revised_days + new_days),
+    )
+    cursor.execute("ANALYZE tmp_fact_stock")
+    cursor.execute("SELECT COUNT(*) FROM tmp_fact_stock")
+    return cursor.fetchone()[0]
+
+
+def run_case(cursor, procedure: str) -> float:
+    cursor.execute("SAVEPOINT bench_case")
+    try:
+        start = time.perf_counter()
+        cursor.execute(f"CALL {procedure}()")
+        return time.perf_counter() - start
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT bench_case")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fact-rows", type=int, default=10_000_000)
+    parser.add_argument("--days", type=int, default=2_500, help="số ngày mỗi ticker")
+    parser.add_argument("--new-days", type=int, default=1)
+    parser.add_argument("--revised-days", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    dw_db = DWDatabase(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME_DW", "dw"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    try:
+        with dw_db.conn.cursor() as cursor:
+            cursor.execute("BEGIN")
+            try:
+                start = time.perf_counter()
+                create_partitions(cursor, args.days + args.new_days)
+                stocks = prefill_fact(cursor, args.fact_rows, args.days)
+                tmp_rows = build_tmp_fact(
+                    cursor, args.days, args.new_days, args.revised_days
+                )
+                elapsed = time.perf_counter() - start
+                print(
+                    f"Fact: {stocks * args.days:,} dòng ({stocks} stocks x {args.days} ngày), "
+                    f"tmp_fact_stock: {tmp_rows:,} dòng, chuẩn bị {elapsed:.1f}s"
+                )
+                timings = {name: run_case(cursor, name) for name in PROCEDURES}
+            finally:
+                cursor.execute("ROLLBACK")
+    finally:
+        dw_db.close()
+
+    baseline = timings[PROCEDURES[0]]
+    for name, elapsed in timings.items():
+        print(f"{name:35s}: {elapsed:8.3f}s ({baseline / elapsed:6.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
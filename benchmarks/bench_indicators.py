@@ -0,0 +1,241 @@
+"""
+Benchmark + kiểm tra parity: engine NumPy (utils.indicator_util) so với
+sp_transform_market_prices cho RSI/ROC/Bollinger Bands.
+
+Chạy offline (so với bản tham chiếu pandas groupby/rolling, kèm kiểm tra chế độ
+incremental nối tiếp cửa sổ từ fact của batch trước):
+    python -m benchmarks.bench_indicators --tickers 500 --bars 2000
+
+Chạy với PostgreSQL staging (đọc DB_* từ .env). Toàn bộ thao tác nằm trong một
+transaction và được ROLLBACK, stg_market_prices/fact_stock_indicators không đổi:
+    python -m benchmarks.bench_indicators --tickers 500 --bars 2000 --sql
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.indicator_util import (
+    FACT_INDICATOR_COLUMNS,
+    build_fact_indicators,
+    lookback_bars,
+)
+
+INDICATORS = ["rsi", "roc", "bb_upper", "bb_lower"]
+
+
+def make_prices(tickers: int, bars: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2025-01-02 14:30", periods=bars, freq="5min", tz="UTC")
+    frames = []
+    for i in range(tickers):
+        close = np.round(100 + rng.standard_normal(bars).cumsum(), 4)
+        close = np.maximum(close, 1.0)
+        frame = pd.DataFrame(
+            {
+                "ticker": f"T{i:04d}",
+                "stock_sk": i + 1,
+                "datetime_utc": index,
+                "close": close,
+                "volume": rng.integers(1_000, 1_000_000, bars).astype(float),
+            }
+        )
+        frame["diff"] = frame["close"].diff().round(4)
+        frame["percent_change_close"] = (frame["close"].pct_change() * 100).round(4)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def reference_indicators(prices, rsi_window, roc_window, bb_window) -> pd.DataFrame:
+    """Bản tham chiếu viết thẳng theo từng CTE của procedure, dùng pandas groupby/rolling"""
+    df = prices.sort_values(["ticker", "datetime_utc"]).reset_index(drop=True)
+    grouped = df.groupby("ticker")["close"]
+    close_n = grouped.shift(roc_window)
+    df["roc"] = (df["close"] - close_n) / close_n * 100
+    df["ma"] = grouped.transform(lambda s: s.rolling(bb_window, min_periods=1).mean())
+    df["std"] = grouped.transform(lambda s: s.rolling(bb_window, min_periods=2).std())
+    df["bb_upper"] = df["ma"] + 2 * df["std"]
+    df["bb_lower"] = df["ma"] - 2 * df["std"]
+    change = grouped.diff().fillna(0)
+    gain = change.clip(lower=0).groupby(df["ticker"])
+    loss = (-change).clip(lower=0).groupby(df["ticker"])
+    gain_sum = gain.transform(lambda s: s.rolling(rsi_window, min_periods=1).sum())
+    loss_sum = loss.transform(lambda s: s.rolling(rsi_window, min_periods=1).sum())
+    df["rsi"] = np.where(loss_sum == 0, 100.0, 100 - 100 / (1 + gain_sum / loss_sum))
+    df = df.dropna(subset=INDICATORS)
+    return df[["stock_sk", "datetime_utc"] + INDICATORS].reset_index(drop=True)
+
+
+def assert_parity(expected: pd.DataFrame, actual: pd.DataFrame, atol: float):
+    keys = ["stock_sk", "datetime_utc"]
+    expected = expected.sort_values(keys).reset_index(drop=True)
+    actual = actual.sort_values(keys).reset_index(drop=True)
+    if len(expected) != len(actual):
+        raise AssertionError(f"Số dòng khác nhau: {len(expected)} != {len(actual)}")
+    pd.testing.assert_frame_equal(
+        expected[keys].astype({"stock_sk": "int64"}),
+        actual[keys].astype({"stock_sk": "int64"}),
+        check_dtype=False,
+    )
+    for column in INDICATORS:
+        diff = np.abs(
+            expected[column].astype(float).to_numpy()
+            - actual[column].astype(float).to_numpy()
+        )
+        if diff.max(initial=0) > atol:
+            raise AssertionError(f"{column} lệch tối đa {diff.max():.6f} > {atol}")
+
+
+def check_incremental(prices, full_fact, args, overlap_bars: int = 2):
+    """
+    Chia dữ liệu thành hai batch (batch sau tải lại overlap_bars bar) và tính batch sau
+    với lịch sử lấy từ fact của batch trước: kết quả phải trùng với tính một lần.
+    """
+    times = np.sort(prices["datetime_utc"].unique())
+    cut = times[len(times) // 2]
+    first = prices[prices["datetime_utc"] < cut]
+    second = prices[prices["datetime_utc"] >= times[len(times) // 2 - overlap_bars]]
+    first_fact = build_fact_indicators(first, args.rsi, args.roc, args.bb)
+    history = (
+        first_fact.merge(prices[["ticker", "stock_sk"]].drop_duplicates(), on="stock_sk")
+        .sort_values("datetime_utc")
+        .groupby("ticker")
+        .tail(lookback_bars(args.rsi, args.roc, args.bb))
+    )
+    start = time.perf_counter()
+    second_fact = build_fact_indicators(
+        second, args.rsi, args.roc, args.bb, history=history
+    )
+    elapsed = time.perf_counter() - start
+    expected = full_fact[full_fact["datetime_utc"] >= cut]
+    assert_parity(
+        expected[["stock_sk", "datetime_utc"] + INDICATORS],
+        second_fact[["stock_sk", "datetime_utc"] + INDICATORS],
+        atol=1e-9,
+    )
+    return len(second_fact), elapsed
+
+
+def run_sql(prices, args):
+    from db.staging_db import StagingDatabase
+
+    staging_db = StagingDatabase(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME_STAGING", "staging"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    stg_columns = [
+        "ticker",
+        "datetime_utc",
+        "close",
+        "volume",
+        "diff",
+        "percent_change_close",
+    ]
+    try:
+        with staging_db.conn.cursor() as cursor:
+            cursor.execute("BEGIN")
+            try:
+                cursor.execute("TRUNCATE TABLE stg_market_prices")
+                staging_db.copy_dataframe(cursor, prices, "stg_market_prices", stg_columns)
+
+                # Engine NumPy: đọc staging -> tính -> COPY vào fact (không truncate)
+                start = time.perf_counter()
+                cursor.execute(
+                    """
+                    INSERT INTO dim_stock (ticker)
+                    SELECT DISTINCT ticker FROM stg_market_prices
+                    ON CONFLICT (ticker) DO NOTHING;
+                    """
+                )
+                db_prices = staging_db.read_prices_for_transform(cursor, "stg_market_prices")
+                fact = build_fact_indicators(db_prices, args.rsi, args.roc, args.bb)
+                staging_db.copy_dataframe(
+                    cursor, fact, "fact_stock_indicators", FACT_INDICATOR_COLUMNS
+                )
+                numpy_time = time.perf_counter() - start
+                # Dòng NumPy và procedure cùng created_at (CURRENT_TIMESTAMP của transaction)
+                # -> xóa dòng NumPy trước khi chạy procedure
+                cursor.execute(
+                    "DELETE FROM fact_stock_indicators "
+                    "WHERE created_at = CURRENT_TIMESTAMP::TIMESTAMP"
+                )
+
+                start = time.perf_counter()
+                cursor.execute(
+                    "CALL sp_transform_market_prices(%s, %s, %s);",
+                    (args.rsi, args.roc, args.bb),
+                )
+                sql_time = time.perf_counter() - start
+
+                # created_at của procedure = CURRENT_TIMESTAMP của transaction này
+                cursor.execute(
+                    """
+                    SELECT f.stock_sk, f.datetime_utc, f.rsi, f.roc, f.bb_upper, f.bb_lower
+                    FROM fact_stock_indicators f
+                    WHERE f.created_at = CURRENT_TIMESTAMP::TIMESTAMP
+                    """
+                )
+                sql_fact = pd.DataFrame(
+                    cursor.fetchall(), columns=["stock_sk", "datetime_utc"] + INDICATORS
+                )
+            finally:
+                cursor.execute("ROLLBACK")
+    finally:
+        staging_db.close()
+
+    sql_fact["datetime_utc"] = pd.to_datetime(sql_fact["datetime_utc"], utc=True)
+    # stock_sk trong DB khác stock_sk giả lập -> so theo stock_sk của fact NumPy đọc từ DB
+    assert_parity(sql_fact, fact[["stock_sk", "datetime_utc"] + INDICATORS], atol=1e-3)
+    return numpy_time, sql_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--bars", type=int, default=2000)
+    parser.add_argument("--rsi", type=int, default=14)
+    parser.add_argument("--roc", type=int, default=10)
+    parser.add_argument("--bb", type=int, default=20)
+    parser.add_argument("--sql", action="store_true", help="so sánh với procedure trên DB staging")
+    args = parser.parse_args()
+
+    prices = make_prices(args.tickers, args.bars)
+    rows = len(prices)
+
+    start = time.perf_counter()
+    fact = build_fact_indicators(prices, args.rsi, args.roc, args.bb)
+    numpy_compute = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = reference_indicators(prices, args.rsi, args.roc, args.bb)
+    reference_time = time.perf_counter() - start
+    # fact lưu chỉ báo với 4 chữ số thập phân; rolling().std() của pandas tích lũy sai số
+    # khi giá đi ngang nên so ở độ chính xác lưu trữ
+    assert_parity(expected, fact[["stock_sk", "datetime_utc"] + INDICATORS], atol=1e-4)
+
+    print(f"Rows: {rows:,} ({args.tickers} tickers x {args.bars} bars)")
+    print(f"NumPy engine (compute)  : {numpy_compute:8.3f}s ({rows / numpy_compute:,.0f} rows/s)")
+    print(f"pandas reference        : {reference_time:8.3f}s (parity OK)")
+    new_rows, incremental_time = check_incremental(prices, fact, args)
+    print(
+        f"Incremental (batch 2)   : {incremental_time:8.3f}s ({new_rows:,} bar mới, parity OK)"
+    )
+
+    if args.sql:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        numpy_time, sql_time = run_sql(prices, args)
+        print(f"NumPy engine (DB E2E)   : {numpy_time:8.3f}s")
+        print(f"sp_transform_market_prices: {sql_time:6.3f}s (parity OK)")
+        print(f"Speedup                 : {sql_time / numpy_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+So sánh các procedure transform SQL trên DB staging (đọc DB_* từ .env):
+sp_transform_market_prices (chuỗi CTE, mỗi CTE một cửa sổ) với
+sp_transform_market_prices_single_pass (named window dùng chung, đọc theo index),
+có/không kèm chỉ báo mở rộng EMA/MACD/ATR.
+
+    python -m benchmarks.bench_transform_sql --tickers 500 --bars 2000
+
+Mỗi lần chạy nằm trong SAVEPOINT và được ROLLBACK, dữ liệu DB không đổi.
+Nếu nạp được auto_explain (cần quyền), plan EXPLAIN ANALYZE của câu INSERT bên trong
+procedure được in ra cùng thời gian chạy.
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from benchmarks.bench_indicators import make_prices
+from db.staging_db import StagingDatabase
+
+# batch_id giả cho dữ liệu benchmark (không trùng batch thật)
+BENCH_BATCH_ID = -1
+
+STG_COLUMNS = [
+    "ticker",
+    "datetime_utc",
+    "close",
+    "volume",
+    "diff",
+    "percent_change_close",
+    "batch_id",
+]
+
+
+def enable_auto_explain(cursor) -> bool:
+    try:
+        cursor.execute("SAVEPOINT auto_explain")
+        cursor.execute("LOAD 'auto_explain'")
+        cursor.execute("SET LOCAL auto_explain.log_min_duration = 0")
+        cursor.execute("SET LOCAL auto_explain.log_analyze = on")
+        cursor.execute("SET LOCAL auto_explain.log_buffers = on")
+        cursor.execute("SET LOCAL auto_explain.log_nested_statements = on")
+        cursor.execute("SET LOCAL auto_explain.log_level = notice")
+        cursor.execute("RELEASE SAVEPOINT auto_explain")
+        return True
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT auto_explain")
+        print(f"Không bật được auto_explain ({e}); chỉ so sánh thời gian.")
+        return False
+
+
+def run_case(staging_db, cursor, name, call, params, explain):
+    cursor.execute("SAVEPOINT bench_case")
+    try:
+        del staging_db.conn.notices[:]
+        start = time.perf_counter()
+        cursor.execute(call, params)
+        elapsed = time.perf_counter() - start
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM fact_stock_indicators
+            WHERE created_at = CURRENT_TIMESTAMP::TIMESTAMP
+            """
+        )
+        rows = cursor.fetchone()[0]
+        print(f"{name:45s}: {elapsed:8.3f}s ({rows:,} dòng fact)")
+        if explain:
+            # Plan dài nhất là câu INSERT ... WITH chính của procedure
+            plans = [n for n in staging_db.conn.notices if "Query Text" in n]
+            if plans:
+                print(max(plans, key=len))
+        return elapsed
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT bench_case")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=500)
+    parser.add_argument("--bars", type=int, default=2000)
+    parser.add_argument("--rsi", type=int, default=14)
+    parser.add_argument("--roc", type=int, default=10)
+    parser.add_argument("--bb", type=int, default=20)
+    parser.add_argument("--no-explain", action="store_true", help="chỉ đo thời gian")
+    args = parser.parse_args()
+
+    load_dotenv()
+    prices = make_prices(args.tickers, args.bars)
+    prices["batch_id"] = BENCH_BATCH_ID
+    staging_db = StagingDatabase(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME_STAGING", "staging"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    windows = (args.rsi, args.roc, args.bb, BENCH_BATCH_ID)
+    cases = [
+        (
+            "sp_transform_market_prices",
+            "CALL sp_transform_market_prices(%s, %s, %s, %s)",
+            windows,
+        ),
+        (
+            "sp_transform_market_prices_single_pass",
+            "CALL sp_transform_market_prices_single_pass(%s, %s, %s, %s)",
+            windows,
+        ),
+        (
+            "sp_transform_market_prices_single_pass + ema,macd,atr",
+            "CALL sp_transform_market_prices_single_pass(%s, %s, %s, %s, p_extra => %s)",
+            windows + ("ema,macd,atr",),
+        ),
+    ]
+    try:
+        with staging_db.conn.cursor() as cursor:
+            cursor.execute("BEGIN")
+            try:
+                staging_db.copy_dataframe(cursor, prices, "stg_market_prices", STG_COLUMNS)
+                cursor.execute("ANALYZE stg_market_prices")
+                explain = not args.no_explain and enable_auto_explain(cursor)
+                print(f"Rows: {len(prices):,} ({args.tickers} tickers x {args.bars} bars)")
+                timings = {
+                    name: run_case(staging_db, cursor, name, call, params, explain)
+                    for name, call, params in cases
+                }
+            finally:
+                cursor.execute("ROLLBACK")
+    finally:
+        staging_db.close()
+
+    baseline = timings["sp_transform_market_prices"]
+    for name, elapsed in timings.items():
+        print(f"{name:45s}: {baseline / elapsed:6.2f}x so với bản CTE")
+
+
+if __name__ == "__main__":
+    main()
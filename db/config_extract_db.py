@@ -12,7 +12,10 @@ class ConfigExtractDatabase(BaseDatabase):
 
     def get_active_configs(self) -> List[Dict[str, Any]]:
         query = """
-        SELECT id, tickers, is_active, output_path,emails, period, interval, retry_count
+        SELECT id, tickers, is_active, output_path,emails, period, interval, retry_count,
+               batch_size, max_workers, rate_limit_per_sec, incremental, overlap_bars,
+               cache_dir, cache_ttl_seconds, cache_max_mb, replay_only, output_format,
+               partition_mode, rows_per_part, retry_backoff_sec
         FROM config_extract
         WHERE is_active = true;
         """
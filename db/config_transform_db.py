@@ -21,8 +21,10 @@ class ConfigTransformDatabase(BaseDatabase):
         """Lấy cấu hình transform active mới nhất, bao gồm đường dẫn export"""
         query = """
         SELECT rsi_window, roc_window, bb_window,
-               dim_path, fact_path,
-               source_table, procedure_transform, emails
+               dim_path, fact_path, export_mode,
+               source_table, procedure_transform, emails,
+               extra_indicators, ema_window, atr_window,
+               macd_fast, macd_slow, macd_signal
         FROM config_transform
         WHERE is_active = TRUE
         ORDER BY id DESC
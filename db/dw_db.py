@@ -1,8 +1,15 @@
 from sqlalchemy import create_engine
+import gzip
 import pandas as pd
 import logging
 
 from db.base_db import BaseDatabase  # giả sử BaseDatabase quản lý psycopg2 connection
+from utils.copy_util import csv_stream
+from utils.file_util import read_csv_header
+
+# Số dòng render mỗi khối khi COPY DataFrame, và kích thước mỗi lần copy_expert đọc
+COPY_CHUNK_ROWS = 50_000
+COPY_BUFFER_SIZE = 1 << 20
 
 
 class DWDatabase(BaseDatabase):
@@ -31,3 +38,32 @@ class DWDatabase(BaseDatabase):
         except Exception as e:
             logging.error(f" Error executing procedure {procedure_name}: {e}")
             raise
+
+    def bulk_load(
+        self, cursor, table_name: str, source, columns=None, chunk_rows=COPY_CHUNK_ROWS
+    ) -> int:
+        """
+        COPY dữ liệu vào table_name (thường là bảng tạm tmp_*) trên cursor của transaction
+        đang mở, thay cho DataFrame.to_sql(method="multi").
+        - source là DataFrame: render CSV theo từng khối chunk_rows dòng rồi stream vào COPY
+          (columns mặc định là các cột của DataFrame).
+        - source là đường dẫn file CSV có header (đuôi .gz được giải nén): stream thẳng file
+          vào COPY, không parse qua pandas (columns mặc định lấy theo header của file).
+        Trả về số dòng đã COPY.
+        """
+        if isinstance(source, pd.DataFrame):
+            columns = list(columns or source.columns)
+            stream = csv_stream(source, columns, chunk_rows)
+            sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH CSV"
+            cursor.copy_expert(sql, stream, size=COPY_BUFFER_SIZE)
+        else:
+            columns = list(columns or read_csv_header(source))
+            sql = (
+                f"COPY {table_name} ({', '.join(columns)}) "
+                "FROM STDIN WITH (FORMAT csv, HEADER true)"
+            )
+            opener = gzip.open if source.endswith(".gz") else open
+            with opener(source, "rb") as f:
+                cursor.copy_expert(sql, f, size=COPY_BUFFER_SIZE)
+        logging.info(f"Đã COPY {cursor.rowcount} bản ghi vào {table_name}.")
+        return cursor.rowcount
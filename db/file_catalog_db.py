@@ -0,0 +1,133 @@
+import logging
+from typing import Any, Dict, List, Optional
+from db.base_db import BaseDatabase
+
+PENDING = "PENDING"
+LOADED = "LOADED"
+FAILED = "FAILED"
+DUPLICATE = "DUPLICATE"
+# File đã vào danh mục nhưng không còn trên đĩa (bị xóa trước khi load)
+MISSING = "MISSING"
+
+
+class FileCatalogDatabase(BaseDatabase):
+    """
+    Quản lý bảng inbound_file: danh mục file nguồn của LOAD_STAGING
+    (đường dẫn, kích thước, mtime, sha256, trạng thái load) theo từng config.
+    Mỗi file được load đúng một lần; file trùng nội dung (cùng hash) bị đánh dấu DUPLICATE,
+    file bị xóa trước khi kịp load bị đánh dấu MISSING.
+    """
+
+    def get_scan_mark(self, config_id) -> Optional[float]:
+        """mtime lớn nhất đã vào danh mục: lần quét sau chỉ xét file có mtime >= mốc này"""
+        rows = self.execute_query(
+            "SELECT MAX(file_mtime) AS mark FROM inbound_file WHERE config_id = %s;",
+            (config_id,),
+        )
+        return rows[0]["mark"] if rows else None
+
+    def get_entries(self, config_id, file_paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Trả về {file_path: dòng inbound_file} của các file đã có trong danh mục"""
+        if not file_paths:
+            return {}
+        rows = self.execute_query(
+            """
+            SELECT id, file_path, file_size, file_mtime, content_hash, status
+            FROM inbound_file
+            WHERE config_id = %s AND file_path = ANY(%s);
+            """,
+            (config_id, list(file_paths)),
+        )
+        return {row["file_path"]: row for row in rows}
+
+    def register(self, config_id, file_path, file_size, file_mtime, content_hash) -> str:
+        """
+        Thêm (hoặc cập nhật khi file bị ghi đè) một file vào danh mục.
+        Nội dung đã có ở file khác đang chờ/đã load -> DUPLICATE, ngược lại PENDING.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT 1 FROM inbound_file
+                WHERE config_id = %s AND content_hash = %s AND file_path <> %s
+                  AND status IN (%s, %s, %s)
+                LIMIT 1;
+                """,
+                (config_id, content_hash, file_path, PENDING, LOADED, FAILED),
+            )
+            status = DUPLICATE if cur.fetchone() else PENDING
+            cur.execute(
+                """
+                INSERT INTO inbound_file
+                    (config_id, file_path, file_size, file_mtime, content_hash, status)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (config_id, file_path) DO UPDATE
+                SET file_size = EXCLUDED.file_size,
+                    file_mtime = EXCLUDED.file_mtime,
+                    content_hash = EXCLUDED.content_hash,
+                    status = EXCLUDED.status,
+                    row_count = NULL,
+                    error_message = NULL,
+                    discovered_at = NOW(),
+                    loaded_at = NULL;
+                """,
+                (config_id, file_path, file_size, file_mtime, content_hash, status),
+            )
+        return status
+
+    def get_pending(self, config_id) -> List[Dict[str, Any]]:
+        """File chưa load (PENDING, hoặc FAILED ở lần trước), theo thứ tự mtime"""
+        return self.execute_query(
+            """
+            SELECT id, file_path, file_size, file_mtime, content_hash, status
+            FROM inbound_file
+            WHERE config_id = %s AND status IN (%s, %s)
+            ORDER BY file_mtime, id;
+            """,
+            (config_id, PENDING, FAILED),
+        )
+
+    def mark_loaded(self, file_id, row_count: int):
+        self.execute_non_query(
+            """
+            UPDATE inbound_file
+            SET status = %s, row_count = %s, error_message = NULL, loaded_at = NOW()
+            WHERE id = %s;
+            """,
+            (LOADED, row_count, file_id),
+        )
+        logging.info(f"inbound_file {file_id}: đã load {row_count} bản ghi.")
+
+    def current_time(self):
+        """Thời điểm hiện tại theo DB (mốc cho requeue_loaded_since)"""
+        return self.execute_query("SELECT NOW() AS now;")[0]["now"]
+
+    def requeue_loaded_since(self, config_id, since) -> int:
+        """Đưa các file đã LOADED từ mốc since về PENDING (dữ liệu load bị bỏ, ví dụ swap lỗi)"""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE inbound_file
+                SET status = %s, row_count = NULL, loaded_at = NULL
+                WHERE config_id = %s AND status = %s AND loaded_at >= %s;
+                """,
+                (PENDING, config_id, LOADED, since),
+            )
+            return cur.rowcount
+
+    def mark_missing(self, file_ids: List[int]):
+        """Đánh dấu MISSING các file không còn trên đĩa để không bị load lại mãi"""
+        self.execute_non_query(
+            """
+            UPDATE inbound_file
+            SET status = %s, error_message = 'File không còn tồn tại.'
+            WHERE id = ANY(%s);
+            """,
+            (MISSING, list(file_ids)),
+        )
+
+    def mark_failed(self, file_id, error: str):
+        self.execute_non_query(
+            "UPDATE inbound_file SET status = %s, error_message = %s WHERE id = %s;",
+            (FAILED, str(error)[:255], file_id),
+        )
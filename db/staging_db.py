@@ -1,16 +1,32 @@
+import gzip
 import io
 import logging
+import os
+import queue
+from contextlib import contextmanager
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from typing import Any, List, Dict
 import pandas as pd
 from sqlalchemy import create_engine
 from db.base_db import BaseDatabase
+from utils.copy_util import COPY_MODES, binary_stream, csv_stream, pipe_copy
+
+# Số dòng render mỗi khối khi stream COPY, và kích thước mỗi lần copy_expert đọc
+COPY_CHUNK_ROWS = 50_000
+COPY_BUFFER_SIZE = 1 << 20
+# load_mode = 'swap': load vào {table}__shadow rồi đổi tên vào chỗ bảng chính
+SHADOW_SUFFIX = "__shadow"
+# Batch còn chờ/đang TRANSFORM: truncate/swap không được bỏ các dòng của chúng
+ACTIVE_BATCH_STATUSES = ("LOADED", "TRANSFORMING")
+# Mức nén khi export ra file .gz (9 chậm hơn nhiều mà file nhỏ hơn không đáng kể)
+EXPORT_GZIP_LEVEL = 6
 
 
 class StagingDatabase(BaseDatabase):
     def __init__(self, host, dbname, user, password, port=5432):
         super().__init__(host, dbname, user, password, port)
+        self._column_type_cache = {}
         self.engine = create_engine(
             f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
         )
@@ -24,31 +40,242 @@ class StagingDatabase(BaseDatabase):
             logging.error(f"Error reading data from {table_name}: {e}")
             raise
 
-    def copy_from_dataframe(self, df, table_name):
-
-        buffer = io.StringIO()
-        df.to_csv(buffer, index=False, header=True)
-        buffer.seek(0)
-
+    @contextmanager
+    def transaction(self):
+        """Mở transaction tường minh trên kết nối autocommit, lỗi thì rollback"""
         with self.conn.cursor() as cursor:
-            cursor.copy_expert(
-                f"""
-                COPY {table_name} (
-                    ticker,
-                    datetime_utc,
-                    close,
-                    volume,
-                    diff,
-                    percent_change_close,
-                    extracted_at
-                )
-                FROM STDIN WITH CSV HEADER DELIMITER ','
+            cursor.execute("BEGIN")
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def _column_types(self, cursor, table_name: str) -> Dict[str, tuple]:
+        """
+        Kiểu PostgreSQL của từng cột trong table_name: {cột: (typname, scale)}.
+        scale chỉ có với NUMERIC(p, s), dùng cho COPY binary. Kết quả được cache theo bảng.
+        """
+        if table_name not in self._column_type_cache:
+            cursor.execute(
+                """
+                SELECT a.attname, t.typname,
+                       CASE WHEN t.typname = 'numeric' AND a.atttypmod >= 4
+                            THEN (a.atttypmod - 4) & 65535 END AS scale
+                FROM pg_attribute a
+                JOIN pg_type t ON t.oid = a.atttypid
+                WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
                 """,
-                buffer,
+                (table_name,),
             )
+            self._column_type_cache[table_name] = {
+                name: (typname, scale) for name, typname, scale in cursor.fetchall()
+            }
+        return self._column_type_cache[table_name]
+
+    def _positional_columns(self, cursor, table_name: str, count: int) -> List[str]:
+        """
+        count cột đầu của table_name theo thứ tự khai báo, bỏ cột tự sinh (SERIAL/IDENTITY)
+        và batch_id: tên cột cho file không header khi config không khai báo column_names.
+        """
+        cursor.execute(
+            """
+            SELECT a.attname
+            FROM pg_attribute a
+            LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+              AND a.attidentity = ''
+              AND COALESCE(pg_get_expr(d.adbin, d.adrelid), '') NOT LIKE 'nextval(%%'
+              AND a.attname <> 'batch_id'
+            ORDER BY a.attnum
+            """,
+            (table_name,),
+        )
+        columns = [name for (name,) in cursor.fetchall()]
+        if count > len(columns):
+            raise ValueError(
+                f"File có {count} cột nhưng bảng {table_name} chỉ có {len(columns)} cột nạp được."
+            )
+        return columns[:count]
+
+    def _copy_frame(
+        self, cursor, df, table_name, columns=None, copy_mode="csv", batch_id=None
+    ):
+        """
+        COPY df vào table_name theo từng khối COPY_CHUNK_ROWS dòng (không dựng cả CSV
+        trong bộ nhớ). columns mặc định là các cột của df, theo đúng thứ tự; df không
+        header (cột là số thứ tự) thì columns là tên theo vị trí, mặc định theo bảng.
+        copy_mode: csv (text) | binary (mã hóa sẵn theo kiểu cột, server không phải parse).
+        batch_id: gắn vào cột batch_id của mọi dòng.
+        """
+        if not all(isinstance(col, str) for col in df.columns):
+            # File không header: cột là số thứ tự -> đặt tên theo columns hoặc theo bảng
+            columns = list(
+                columns or self._positional_columns(cursor, table_name, len(df.columns))
+            )
+            if len(columns) != len(df.columns):
+                raise ValueError(
+                    f"File có {len(df.columns)} cột nhưng khai báo {len(columns)} cột: {columns}"
+                )
+            df = df.set_axis(columns, axis=1)
+        columns = list(columns or df.columns)
+        if batch_id is not None:
+            df = df.assign(batch_id=batch_id)
+            columns = [col for col in columns if col != "batch_id"] + ["batch_id"]
+        copy_mode = (copy_mode or "csv").lower()
+        column_list = ", ".join(columns)
+        if copy_mode == "binary":
+            column_types = self._column_types(cursor, table_name)
+            missing = [col for col in columns if col not in column_types]
+            if missing:
+                raise ValueError(f"Bảng {table_name} không có cột: {missing}")
+            stream = binary_stream(df, columns, column_types, COPY_CHUNK_ROWS)
+            sql = f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT binary)"
+        elif copy_mode == "csv":
+            stream = csv_stream(df, columns, COPY_CHUNK_ROWS)
+            sql = f"COPY {table_name} ({column_list}) FROM STDIN WITH CSV"
+        else:
+            raise ValueError(f"copy_mode không được hỗ trợ: {copy_mode} ({COPY_MODES})")
+        cursor.copy_expert(sql, stream, size=COPY_BUFFER_SIZE)
+
+    def copy_from_dataframe(
+        self, df, table_name, columns=None, copy_mode="csv", batch_id=None
+    ):
+
+        with self.conn.cursor() as cursor:
+            self._copy_frame(cursor, df, table_name, columns, copy_mode, batch_id)
 
         self.conn.commit()
 
+    def table_columns(self, table_name: str) -> List[str]:
+        """Danh sách cột của table_name (theo catalog)"""
+        with self.conn.cursor() as cursor:
+            return list(self._column_types(cursor, table_name))
+
+    def copy_from_files(
+        self, file_paths, table_name: str, columns, delimiter: str = ",", batch_id=None
+    ) -> int:
+        """
+        Stream thẳng các file CSV (có header, đúng cột columns) vào COPY ... FROM STDIN,
+        không parse qua pandas. Tất cả file nạp trong một transaction.
+        batch_id được gắn qua default của cột batch_id (biến etl.batch_id của transaction).
+        Trả về tổng số dòng theo row count của chính lệnh COPY.
+        """
+        column_list = ", ".join(columns)
+        total = 0
+        with self.transaction() as cursor:
+            if batch_id is not None:
+                cursor.execute(
+                    "SELECT set_config('etl.batch_id', %s, true)", (str(batch_id),)
+                )
+            options = cursor.mogrify(
+                "FORMAT csv, HEADER true, DELIMITER %s", (delimiter,)
+            ).decode()
+            for file_path in file_paths:
+                with open(file_path, "rb") as f:
+                    cursor.copy_expert(
+                        f"COPY {table_name} ({column_list}) FROM STDIN WITH ({options})",
+                        f,
+                        size=COPY_BUFFER_SIZE,
+                    )
+                if cursor.rowcount <= 0:
+                    raise ValueError(f"File {file_path} rỗng, không có dữ liệu để load.")
+                total += cursor.rowcount
+        logging.info(f"Đã COPY {total} bản ghi vào {table_name} (file -> COPY trực tiếp)")
+        return total
+
+    def copy_from_dataframes(
+        self, frames, table_name, columns=None, copy_mode="csv", batch_id=None
+    ) -> int:
+        """
+        COPY lần lượt nhiều DataFrame (ví dụ các part của manifest) trong một transaction.
+        frames có thể là generator -> mỗi lúc chỉ giữ một part trong bộ nhớ.
+        Lỗi giữa chừng thì rollback toàn bộ, tránh nạp trùng khi retry.
+        """
+        total = 0
+        with self.transaction() as cursor:
+            for df in frames:
+                self._copy_frame(
+                    cursor, df, table_name, columns, copy_mode, batch_id
+                )
+                total += len(df)
+        logging.info(f"Đã COPY {total} bản ghi vào {table_name}")
+        return total
+
+    def read_prices_for_transform(
+        self, cursor, source_table: str, batch_id=None
+    ) -> pd.DataFrame:
+        """
+        Đọc giá staging kèm stock_sk, sắp theo (ticker, datetime_utc), bằng COPY TO
+        (một lượt text thay vì fetchall từng tuple). batch_id: chỉ đọc dòng của batch đó.
+        """
+        batch_filter = ""
+        if batch_id is not None:
+            batch_filter = f"WHERE s.batch_id = {int(batch_id)}"
+        buffer = io.StringIO()
+        cursor.copy_expert(
+            f"""
+            COPY (
+                SELECT s.ticker, ds.stock_sk, s.datetime_utc, s.close, s.volume,
+                       s.diff, s.percent_change_close
+                FROM {source_table} s
+                JOIN dim_stock ds ON ds.ticker = s.ticker
+                {batch_filter}
+                ORDER BY s.ticker, s.datetime_utc
+            ) TO STDOUT WITH CSV HEADER
+            """,
+            buffer,
+        )
+        buffer.seek(0)
+        df = pd.read_csv(buffer)
+        df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True)
+        return df
+
+    def read_indicator_history(
+        self, cursor, source_table: str, lookback: int, batch_id=None
+    ) -> pd.DataFrame:
+        """
+        lookback bar gần nhất trong fact_stock_indicators của mỗi ticker có trong batch,
+        để nối tiếp cửa sổ RSI/ROC/BB (LATERAL + index (stock_sk, datetime_utc)).
+        """
+        batch_filter = ""
+        if batch_id is not None:
+            batch_filter = f"WHERE s.batch_id = {int(batch_id)}"
+        buffer = io.StringIO()
+        cursor.copy_expert(
+            f"""
+            COPY (
+                SELECT st.ticker, st.stock_sk, h.datetime_utc, h.close, h.volume,
+                       h.diff, h.percent_change_close
+                FROM (
+                    SELECT DISTINCT s.ticker, ds.stock_sk
+                    FROM {source_table} s
+                    JOIN dim_stock ds ON ds.ticker = s.ticker
+                    {batch_filter}
+                ) st
+                CROSS JOIN LATERAL (
+                    SELECT f.datetime_utc, f.close, f.volume, f.diff, f.percent_change_close
+                    FROM fact_stock_indicators f
+                    WHERE f.stock_sk = st.stock_sk
+                    ORDER BY f.datetime_utc DESC
+                    LIMIT {int(lookback)}
+                ) h
+            ) TO STDOUT WITH CSV HEADER
+            """,
+            buffer,
+        )
+        buffer.seek(0)
+        df = pd.read_csv(buffer)
+        df["datetime_utc"] = pd.to_datetime(df["datetime_utc"], utc=True)
+        return df
+
+    def copy_dataframe(
+        self, cursor, df: pd.DataFrame, table_name: str, columns, copy_mode="csv"
+    ):
+        """COPY DataFrame (đúng thứ tự columns) vào table_name"""
+        self._copy_frame(cursor, df, table_name, columns, copy_mode)
+
     def insert_records(self, table_name: str, records: List[Dict[str, Any]]):
         """
         Insert list dict (records) vào bảng staging.
@@ -76,6 +303,400 @@ class StagingDatabase(BaseDatabase):
             self.conn.rollback()
             raise
 
+    def begin_batch(self) -> int:
+        """Tạo batch mới (LOADING) cho một lần LOAD_STAGING, trả về batch_id"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO stg_batch (status) VALUES ('LOADING') RETURNING batch_id"
+            )
+            return cursor.fetchone()[0]
+
+    def set_batch_status(self, batch_id: int, status: str):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE stg_batch SET status = %s, updated_at = NOW()
+                WHERE batch_id = %s
+                """,
+                (status, batch_id),
+            )
+
+    def claim_batch(self):
+        """
+        Nhận batch LOADED cũ nhất để TRANSFORM (chuyển sang TRANSFORMING).
+        SKIP LOCKED: các tiến trình TRANSFORM chạy song song nhận các batch khác nhau.
+        Trả về batch_id hoặc None nếu không còn batch nào.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE stg_batch SET status = 'TRANSFORMING', updated_at = NOW()
+                WHERE batch_id = (
+                    SELECT batch_id FROM stg_batch
+                    WHERE status = 'LOADED'
+                    ORDER BY batch_id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING batch_id
+                """
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _table_batches(
+        self, cursor, table_name: str, statuses, exclude=()
+    ) -> List[int]:
+        """batch_id (trạng thái thuộc statuses, ngoài exclude) còn dòng trong table_name"""
+        if "batch_id" not in self._column_types(cursor, table_name):
+            return []
+        cursor.execute(
+            f"""
+            SELECT b.batch_id FROM stg_batch b
+            WHERE b.status = ANY(%s) AND NOT (b.batch_id = ANY(%s))
+              AND EXISTS (SELECT 1 FROM {table_name} t WHERE t.batch_id = b.batch_id)
+            ORDER BY b.batch_id
+            """,
+            (list(statuses), [batch for batch in exclude if batch is not None]),
+        )
+        return [batch_id for (batch_id,) in cursor.fetchall()]
+
+    def _mark_batches_deleted(self, cursor, table_name: str, keep=()) -> List[int]:
+        """Đánh dấu DELETED các batch (ngoài keep) có dòng trong table_name sắp bị bỏ"""
+        if "batch_id" not in self._column_types(cursor, table_name):
+            return []
+        cursor.execute(
+            f"""
+            UPDATE stg_batch b SET status = 'DELETED', updated_at = NOW()
+            WHERE b.status <> 'DELETED' AND NOT (b.batch_id = ANY(%s))
+              AND EXISTS (SELECT 1 FROM {table_name} t WHERE t.batch_id = b.batch_id)
+            RETURNING b.batch_id
+            """,
+            ([batch for batch in keep if batch is not None],),
+        )
+        return [batch_id for (batch_id,) in cursor.fetchall()]
+
+    def truncate_batch_table(self, table_name: str, keep_batch_id=None) -> List[int]:
+        """
+        TRUNCATE table_name khi không còn batch LOADED/TRANSFORMING nào (ngoài keep_batch_id)
+        có dòng trong bảng; các batch có dòng bị bỏ được đánh dấu DELETED.
+        Trả về các batch đang chờ TRANSFORM (khác rỗng: không truncate).
+        """
+        with self.transaction() as cursor:
+            # Chặn COPY/TRANSFORM khác tới khi truncate xong
+            cursor.execute(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE")
+            active = self._table_batches(
+                cursor, table_name, ACTIVE_BATCH_STATUSES, [keep_batch_id]
+            )
+            if active:
+                return active
+            deleted = self._mark_batches_deleted(cursor, table_name, [keep_batch_id])
+            cursor.execute(f"TRUNCATE TABLE {table_name}")
+        logging.info(f"Đã truncate {table_name}, batch bị bỏ: {deleted}.")
+        return []
+
+    def delete_batch(self, table_name: str, batch_id: int) -> int:
+        """Xóa các dòng của một batch khỏi table_name (không đụng batch khác)"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table_name} WHERE batch_id = %s", (batch_id,))
+            return cursor.rowcount
+
+    def get_export_watermark(self, table_name: str):
+        """created_at mốc đã được bên nhận xác nhận (None: chưa xác nhận lần nào)"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT last_created_at FROM export_watermark WHERE table_name = %s",
+                (table_name,),
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def export_upper_bound(self):
+        """
+        Mốc trên (không gồm) cho lần export delta: created_at của dòng do transaction đang
+        chạy ghi luôn >= thời điểm bắt đầu transaction đó, nên lấy min(xact_start) của các
+        phiên khác (hoặc hiện tại nếu không có) để không bỏ sót dòng commit sau lần export.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT LEAST(LOCALTIMESTAMP, MIN(xact_start)::TIMESTAMP)
+                FROM pg_stat_activity
+                WHERE datname = current_database()
+                  AND xact_start IS NOT NULL
+                  AND pid <> pg_backend_pid()
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def set_export_watermark(
+        self, table_name: str, last_created_at, row_count: int, file_path: str
+    ):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO export_watermark
+                    (table_name, last_created_at, row_count, file_path, updated_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (table_name) DO UPDATE
+                SET last_created_at = EXCLUDED.last_created_at,
+                    row_count = EXCLUDED.row_count,
+                    file_path = EXCLUDED.file_path,
+                    updated_at = NOW()
+                """,
+                (table_name, last_created_at, row_count, file_path),
+            )
+
+    def set_export_pending(
+        self, table_name: str, pending_created_at, row_count: int, file_path: str
+    ):
+        """Ghi mốc trên của file vừa export, chờ LOAD_DW xác nhận (acknowledge_export)"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO export_watermark
+                    (table_name, pending_created_at, row_count, file_path, updated_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (table_name) DO UPDATE
+                SET pending_created_at = EXCLUDED.pending_created_at,
+                    row_count = EXCLUDED.row_count,
+                    file_path = EXCLUDED.file_path,
+                    updated_at = NOW()
+                """,
+                (table_name, pending_created_at, row_count, file_path),
+            )
+
+    def get_export_pending(self, table_name: str):
+        """(pending_created_at, file_path) của file export chờ xác nhận, None nếu không có"""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT pending_created_at, file_path FROM export_watermark
+                WHERE table_name = %s AND pending_created_at IS NOT NULL
+                """,
+                (table_name,),
+            )
+            return cursor.fetchone()
+
+    def acknowledge_export(self, table_name: str, pending_created_at) -> bool:
+        """
+        Bên nhận đã nạp và commit file export có mốc pending_created_at: tiến
+        last_created_at tới mốc đó. File đã bị export lại (mốc khác) thì không tiến,
+        lần export sau vẫn chứa các dòng này. Trả về True nếu đã tiến watermark.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE export_watermark
+                SET last_created_at = pending_created_at, updated_at = NOW()
+                WHERE table_name = %s AND pending_created_at = %s
+                """,
+                (table_name, pending_created_at),
+            )
+            return cursor.rowcount > 0
+
+    @staticmethod
+    def _export_query(
+        cursor, table_name: str, columns=None, since=None, until=None
+    ) -> str:
+        """SELECT columns FROM table_name, lọc created_at trong [since, until) nếu có mốc"""
+        conditions = []
+        if since is not None:
+            conditions.append("created_at >= %(since)s")
+        if until is not None:
+            conditions.append("created_at < %(until)s")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        select = ", ".join(columns) if columns else "*"
+        return cursor.mogrify(
+            f"SELECT {select} FROM {table_name} {where}",
+            {"since": since, "until": until},
+        ).decode()
+
+    def export_table(
+        self, table_name: str, file_path: str, since=None, until=None
+    ) -> int:
+        """
+        COPY (SELECT * FROM table_name) TO STDOUT dạng CSV có header, stream thẳng xuống
+        file_path (đuôi .gz: nén gzip), không fetch vào Python. since/until: chỉ lấy dòng
+        có created_at trong [since, until). Ghi ra file .part rồi đổi tên, file cũ chỉ bị
+        thay khi export xong. Trả về số dòng đã export.
+        """
+        tmp_path = f"{file_path}.part"
+        try:
+            if file_path.endswith(".gz"):
+                out = gzip.open(tmp_path, "wb", compresslevel=EXPORT_GZIP_LEVEL)
+            else:
+                out = open(tmp_path, "wb")
+            with out, self.conn.cursor() as cursor:
+                query = self._export_query(cursor, table_name, since=since, until=until)
+                cursor.copy_expert(
+                    f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                    out,
+                    size=COPY_BUFFER_SIZE,
+                )
+                row_count = cursor.rowcount
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        logging.info(f"Đã export {row_count} dòng từ {table_name} ra {file_path}.")
+        return row_count
+
+    def transfer_table(
+        self,
+        target_cursor,
+        table_name: str,
+        target_table: str,
+        columns,
+        since=None,
+        until=None,
+    ) -> int:
+        """
+        Chuyển thẳng các dòng của table_name sang target_table trên kết nối khác
+        (target_cursor, ví dụ bảng tạm của DW) bằng COPY TO -> pipe -> COPY FROM,
+        không qua file CSV. Dùng COPY binary nên kiểu các cột phải trùng nhau.
+        since/until như export_table. Trả về số dòng đã chuyển.
+        """
+        with self.conn.cursor() as cursor:
+            query = self._export_query(cursor, table_name, columns, since, until)
+            row_count = pipe_copy(
+                cursor,
+                f"COPY ({query}) TO STDOUT WITH (FORMAT binary)",
+                target_cursor,
+                f"COPY {target_table} ({', '.join(columns)}) "
+                "FROM STDIN WITH (FORMAT binary)",
+                size=COPY_BUFFER_SIZE,
+            )
+        logging.info(f"Đã chuyển {row_count} dòng từ {table_name} sang {target_table}.")
+        return row_count
+
+    @staticmethod
+    def shadow_table_name(table_name: str) -> str:
+        return f"{table_name}{SHADOW_SUFFIX}"
+
+    def create_shadow_table(self, table_name: str) -> str:
+        """
+        Tạo bảng UNLOGGED {table_name}__shadow cùng cột/default với table_name nhưng
+        chưa có index/constraint (load nhanh, không ghi WAL). Trả về tên bảng shadow.
+        """
+        shadow = self.shadow_table_name(table_name)
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {shadow}")
+            cursor.execute(
+                f"""
+                CREATE UNLOGGED TABLE {shadow}
+                (LIKE {table_name} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED)
+                """
+            )
+        self._column_type_cache.pop(shadow, None)
+        logging.info(f"Đã tạo bảng shadow {shadow} cho {table_name}.")
+        return shadow
+
+    def swap_shadow_table(self, table_name: str, keep_batch_id=None) -> List[int]:
+        """
+        Dựng index/constraint của table_name trên bảng shadow (sau khi đã load), rồi
+        đổi tên shadow thành table_name trong một transaction. Người đọc chỉ bị chặn
+        trong lúc đổi tên, bảng cũ bị drop cùng transaction.
+        Dòng của các batch LOADED/TRANSFORMING khác được chép sang shadow trước khi đổi
+        tên; các batch khác còn dòng trong bảng cũ được đánh dấu DELETED.
+        Trả về các batch đã chép sang.
+        """
+        shadow = self.shadow_table_name(table_name)
+        old = f"{table_name}__old"
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.conname, pg_get_constraintdef(c.oid)
+                FROM pg_constraint c
+                WHERE c.conrelid = %s::regclass AND c.contype IN ('p', 'u', 'c', 'x')
+                """,
+                (table_name,),
+            )
+            constraints = cursor.fetchall()
+            # Ghép CREATE INDEX từ pg_index/pg_am (tên qua format('%I')) thay vì sửa chuỗi
+            # pg_get_indexdef: tên index/biểu thức chứa tên bảng không bị thay nhầm
+            cursor.execute(
+                """
+                SELECT i.relname, format(
+                    'CREATE %%sINDEX %%I ON %%I USING %%s (%%s)%%s%%s',
+                    CASE WHEN x.indisunique THEN 'UNIQUE ' ELSE '' END,
+                    i.relname || %s, %s, am.amname,
+                    (SELECT string_agg(
+                                CASE WHEN x.indkey[k - 1] = 0
+                                     THEN '(' || pg_get_indexdef(x.indexrelid, k, true) || ')'
+                                     ELSE pg_get_indexdef(x.indexrelid, k, true) END
+                                || CASE WHEN x.indoption[k - 1] & 1 = 1 THEN ' DESC' ELSE '' END
+                                || CASE x.indoption[k - 1] & 3
+                                       WHEN 2 THEN ' NULLS FIRST'
+                                       WHEN 1 THEN ' NULLS LAST'
+                                       ELSE '' END,
+                                ', ' ORDER BY k)
+                     FROM generate_series(1, x.indnkeyatts) AS k),
+                    (SELECT ' INCLUDE (' || string_agg(
+                                pg_get_indexdef(x.indexrelid, k, true), ', ' ORDER BY k) || ')'
+                     FROM generate_series(x.indnkeyatts + 1, x.indnatts) AS k),
+                    ' WHERE ' || pg_get_expr(x.indpred, x.indrelid, true)
+                )
+                FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                JOIN pg_am am ON am.oid = i.relam
+                WHERE x.indrelid = %s::regclass
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+                """,
+                (SHADOW_SUFFIX, shadow, table_name),
+            )
+            indexes = cursor.fetchall()
+            cursor.execute(
+                """
+                SELECT s.relname, a.attname
+                FROM pg_depend d
+                JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+                JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+                WHERE d.refobjid = %s::regclass AND d.deptype = 'a'
+                """,
+                (table_name,),
+            )
+            owned_sequences = cursor.fetchall()
+
+            # Dựng index sau khi load (một lượt sort thay vì cập nhật index từng dòng)
+            for name, definition in constraints:
+                cursor.execute(
+                    f"ALTER TABLE {shadow} ADD CONSTRAINT {name}{SHADOW_SUFFIX} {definition}"
+                )
+            for _, definition in indexes:
+                cursor.execute(definition)
+            cursor.execute(f"ANALYZE {shadow}")
+
+        with self.transaction() as cursor:
+            # Khóa trước khi đọc batch: không batch nào đổi dòng giữa lúc chép và đổi tên
+            cursor.execute(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE")
+            carried = self._table_batches(
+                cursor, table_name, ACTIVE_BATCH_STATUSES, [keep_batch_id]
+            )
+            if carried:
+                cursor.execute(
+                    f"INSERT INTO {shadow} SELECT * FROM {table_name} WHERE batch_id = ANY(%s)",
+                    (carried,),
+                )
+            self._mark_batches_deleted(cursor, table_name, [keep_batch_id, *carried])
+            cursor.execute(f"ALTER TABLE {table_name} RENAME TO {old}")
+            cursor.execute(f"ALTER TABLE {shadow} RENAME TO {table_name}")
+            # Sequence của cột SERIAL thuộc bảng cũ -> chuyển sang bảng mới trước khi drop
+            for sequence, column in owned_sequences:
+                cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table_name}.{column}")
+            cursor.execute(f"DROP TABLE {old}")
+            for name, _ in constraints:
+                cursor.execute(
+                    f"ALTER TABLE {table_name} RENAME CONSTRAINT {name}{SHADOW_SUFFIX} TO {name}"
+                )
+            for name, _ in indexes:
+                cursor.execute(f"ALTER INDEX {name}{SHADOW_SUFFIX} RENAME TO {name}")
+        self._column_type_cache.pop(table_name, None)
+        self._column_type_cache.pop(shadow, None)
+        logging.info(f"Đã swap {shadow} vào {table_name}, giữ lại batch {carried}.")
+        return carried
+
     def truncate_table(self, table_name: str):
         """Truncates a table in the staging database."""
         try:
@@ -105,3 +726,31 @@ class StagingDatabase(BaseDatabase):
         if self.engine:
             self.engine.dispose()
             logging.info("Closed Staging DB engine")
+
+
+class StagingDatabasePool:
+    """
+    Nhóm cố định `size` kết nối StagingDatabase cho các worker load song song.
+    connection() mượn một kết nối (chờ nếu đang dùng hết) và trả lại khi xong.
+    """
+
+    def __init__(self, size: int, host, dbname, user, password, port=5432):
+        self._idle = queue.Queue()
+        self._all = []
+        for _ in range(max(1, size)):
+            db = StagingDatabase(host, dbname, user, password, port)
+            self._all.append(db)
+            self._idle.put(db)
+
+    @contextmanager
+    def connection(self):
+        db = self._idle.get()
+        try:
+            yield db
+        finally:
+            self._idle.put(db)
+
+    def close(self):
+        for db in self._all:
+            db.close()
+        self._all = []
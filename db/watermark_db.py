@@ -0,0 +1,78 @@
+import logging
+from typing import Any, Dict, List
+from db.base_db import BaseDatabase
+
+
+class WatermarkDatabase(BaseDatabase):
+    """
+    Quản lý bảng extract_watermark (datetime_utc cuối cùng theo ticker/interval).
+    - pending_datetime_utc: EXTRACT đã ghi file (sha256 pending_content_hash), chờ LOAD_STAGING
+    - last_datetime_utc: chỉ tiến lên khi chính file đó đã LOADED trong inbound_file
+    """
+
+    def get_watermarks(self, interval: str, tickers: List[str]) -> Dict[str, Any]:
+        """Trả về {ticker: last_datetime_utc} của các ticker đã có watermark"""
+        query = """
+        SELECT ticker, last_datetime_utc
+        FROM extract_watermark
+        WHERE interval = %s AND ticker = ANY(%s) AND last_datetime_utc IS NOT NULL;
+        """
+        rows = self.execute_query(query, (interval, list(tickers)))
+        return {row["ticker"]: row["last_datetime_utc"] for row in rows}
+
+    def set_pending(
+        self,
+        interval: str,
+        tickers: List[str],
+        max_datetimes: Dict[str, Any],
+        content_hash: str,
+    ):
+        """
+        Ghi watermark chờ cho các ticker của lần EXTRACT vừa ghi file (sha256 content_hash
+        của file/manifest kết quả). Ticker không có trong max_datetimes (extract lỗi) bị xóa
+        pending để LOAD_STAGING không tiến watermark cho dữ liệu không có trong file.
+        """
+        if not tickers:
+            return
+        query = """
+        INSERT INTO extract_watermark
+            (ticker, interval, pending_datetime_utc, pending_content_hash, updated_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON CONFLICT (ticker, interval) DO UPDATE
+        SET pending_datetime_utc = EXCLUDED.pending_datetime_utc,
+            pending_content_hash = EXCLUDED.pending_content_hash,
+            updated_at = NOW();
+        """
+        with self.conn.cursor() as cur:
+            cur.executemany(
+                query,
+                [
+                    (ticker, interval, max_datetimes.get(ticker), content_hash)
+                    for ticker in tickers
+                ],
+            )
+        logging.info(f"Đã ghi watermark chờ cho {len(max_datetimes)} ticker.")
+
+    def commit_pending(self) -> int:
+        """
+        Tiến watermark lên pending_datetime_utc cho các ticker có file pending đã được
+        LOAD_STAGING nạp (inbound_file cùng sha256 ở trạng thái LOADED). File chưa load,
+        lỗi hoặc đã bị xóa thì watermark giữ nguyên, EXTRACT sau tải lại các bar đó.
+        """
+        query = """
+        UPDATE extract_watermark w
+        SET last_datetime_utc = GREATEST(w.last_datetime_utc, w.pending_datetime_utc),
+            pending_datetime_utc = NULL,
+            pending_content_hash = NULL,
+            updated_at = NOW()
+        WHERE w.pending_datetime_utc IS NOT NULL
+          AND EXISTS (
+              SELECT 1 FROM inbound_file f
+              WHERE f.content_hash = w.pending_content_hash AND f.status = 'LOADED'
+          );
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(query)
+            count = cur.rowcount
+        logging.info(f"Đã tiến watermark cho {count} ticker.")
+        return count
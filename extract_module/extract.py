@@ -1,26 +1,43 @@
 import os
-import shutil
-from datetime import datetime
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 
-import pandas as pd
 from dotenv import load_dotenv
 
 from db.config_extract_db import ConfigExtractDatabase
 from db.log_db import LogDatabase
+from db.watermark_db import WatermarkDatabase
 from email_service.email_service import EmailService
 from utils.extract_util import (
-    build_records_from_df,
+    build_frame_from_df,
+    chunk_tickers,
     compute_stock_indicators,
+    fetch_yfinance_batch,
     fetch_yfinance_data,
+    incremental_start,
     parse_tickers,
+    trim_to_watermark,
 )
+from utils.extract_writer import open_extract_writer
+from utils.file_util import file_checksum
 from utils.logger_util import log_message
+from utils.price_cache import PriceCache
+from utils.rate_limiter import TokenBucket
+from utils.retry_util import (
+    PERMANENT,
+    EmptyBatchError,
+    backoff_delay,
+    classify_error,
+)
 
 # 2.load_env() load các biến môi trường
 #    DB_HOST,DB_USER DB_PASSWORD,DB_PORT,DB_NAME_STAGING,
 #    DB_NAME_CONFIG,DB_NAME_STAGING,DB_NAME_DW,
 #    EMAIL_USERNAME,EMAIL_PASSWORD, EMAIL_SIMULATEEMAIL_ADMIN,
-#    DEFAULT_RETRY=3
+#    DEFAULT_RETRY=3,
+#    EXTRACT_MAX_PROCESSES (số worker process chạy song song các config, mặc định 1)
 load_dotenv()
 
 
@@ -35,6 +52,7 @@ def init_services():
 
     config_db = ConfigExtractDatabase(**db_params)
     log_db = LogDatabase(**db_params)
+    watermark_db = WatermarkDatabase(**db_params)
     email_service = EmailService(
         username=os.getenv("EMAIL_USERNAME"),
         password=os.getenv("EMAIL_PASSWORD"),
@@ -42,10 +60,34 @@ def init_services():
     )
 
     print("Đã khởi tạo thành công các service.")
-    return config_db, log_db, email_service
+    return config_db, log_db, watermark_db, email_service
+
+
+def build_price_cache(config):
+    """Tạo PriceCache theo cấu hình (cache_dir rỗng: không dùng cache)"""
+    cache_dir = config.get("cache_dir")
+    if not cache_dir:
+        return None
+    max_mb = config.get("cache_max_mb")
+    return PriceCache(
+        cache_dir,
+        ttl_seconds=config.get("cache_ttl_seconds") or 3600,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb else None,
+        replay_only=bool(config.get("replay_only")),
+    )
 
 
-def extract_ticker_data(ticker, period, interval, config_id, log_db):
+def extract_ticker_data(
+    ticker,
+    period,
+    interval,
+    config_id,
+    log_db,
+    rate_limiter=None,
+    start=None,
+    watermark=None,
+    cache=None,
+):
     # 10.8.7.1 Ghi log PROCESSING với message "Đang extract {ticker}..."."""
     log_message(
         log_db,
@@ -56,7 +98,14 @@ def extract_ticker_data(ticker, period, interval, config_id, log_db):
     )
     # 10.8.7.2 Gọi fetch_yfinance_data(ticker, period, interval) để lấy dữ liệu thô từ Yahoo Finance..
     #        Ghi log để thông báo đang lấy dữ liệu.  Gọi yf.download() để tải dữ liệu theo ticker, period, interval.  Nếu không có dữ liệu → trả về DataFrame rỗng.  Chuẩn hóa timezone của index về UTC (nếu chưa có timezone thì gán, nếu có thì chuyển về UTC).  Trả về DataFrame chứa dữ liệu giá đã chuẩn hóa.
-    data = fetch_yfinance_data(ticker, period, interval)
+    def load():
+        if rate_limiter:
+            rate_limiter.acquire()
+        return fetch_yfinance_data(ticker, period, interval, start=start)
+
+    # cache != None: đọc từ PriceCache trước, miss mới gọi Yahoo Finance
+    window = start if start is not None else period
+    data = cache.fetch(ticker, window, interval, load) if cache else load()
     # 10.8.7.3 Kiểm tra dữ liệu trả về có rỗng không?
     if data.empty:
         # 10.8.7.4 Ném ra ValueError.
@@ -65,10 +114,12 @@ def extract_ticker_data(ticker, period, interval, config_id, log_db):
     # 10.8.7.5  Gọi compute_stock_indicators(data, ticker) để tính các chỉ báo kỹ thuật.
     #        Lấy cột Close và Volume tương ứng với mã cổ phiếu.  Tính Diff: mức chênh lệch giá đóng cửa so với ngày trước đó.  Tính PercentChangeClose: phần trăm thay đổi giá đóng cửa so với ngày trước đó.  Trả về một DataFrame mới chứa các chỉ số trên.
     indicators = compute_stock_indicators(data, ticker)
+    # Incremental: bỏ các bar overlap nằm trước watermark (đã có ở downstream)
+    indicators = trim_to_watermark(indicators, watermark)
 
-    # 10.8.7.6  Gọi build_records_from_df(ticker, indicators) để chuyển đổi DataFrame thành danh sách các bản ghi.
-    #        Lặp qua từng dòng trong DataFrame.  Với mỗi dòng, tạo một dict gồm:  ticker: mã cổ phiếu  datetime_utc: thời điểm của dòng dữ liệu (index của DataFrame)  close, volume, diff, percent_change_close: các giá trị tương ứng trong dòng  extracted_at: thời điểm trích xuất (thời gian hiện tại UTC)  Trả về một danh sách các dict.
-    records = build_records_from_df(ticker, indicators)
+    # 10.8.7.6  Gọi build_frame_from_df(ticker, indicators) để chuyển đổi sang DataFrame theo schema staging.
+    #        Gán theo cột (không lặp từng dòng):  ticker: mã cổ phiếu  datetime_utc: index của DataFrame  close, volume, diff, percent_change_close: các cột tương ứng  extracted_at: thời điểm trích xuất (lấy một lần, UTC)  Trả về một DataFrame.
+    frame = build_frame_from_df(ticker, indicators)
 
     # 10.8.7.7 Ghi log PROCESSING với message "Extract {ticker} thành công.".
     log_message(
@@ -78,14 +129,131 @@ def extract_ticker_data(ticker, period, interval, config_id, log_db):
         "PROCESSING",
         message=f"Extract {ticker} thành công.",
     )
-    # 10.8.7.8 Trả về danh sách các bản ghi.
-    return records
+    # 10.8.7.8 Trả về DataFrame của ticker.
+    return frame
+
+
+def extract_batch_data(
+    tickers,
+    period,
+    interval,
+    config_id,
+    log_db,
+    rate_limiter=None,
+    start=None,
+    watermarks=None,
+    cache=None,
+):
+    """Tải một batch ticker bằng một lần gọi yf.download, trả về {ticker: DataFrame | Exception}"""
+    watermarks = watermarks or {}
+    log_message(
+        log_db,
+        "EXTRACT",
+        config_id,
+        "PROCESSING",
+        message=f"Đang extract batch {', '.join(tickers)}...",
+    )
+
+    def load():
+        if rate_limiter:
+            rate_limiter.acquire()
+        return fetch_yfinance_batch(tickers, period, interval, start=start)
+
+    window = start if start is not None else period
+    try:
+        if cache:
+            data = cache.fetch(",".join(tickers), window, interval, load)
+        else:
+            data = load()
+        if data.empty:
+            raise EmptyBatchError("Yahoo Finance trả về batch rỗng.")
+    except Exception as e:
+        return {ticker: e for ticker in tickers}
+
+    outcomes = {}
+    extracted_at = datetime.now(timezone.utc)
+    for ticker in tickers:
+        try:
+            indicators = compute_stock_indicators(data, ticker)
+            indicators = trim_to_watermark(indicators, watermarks.get(ticker))
+            outcomes[ticker] = build_frame_from_df(ticker, indicators, extracted_at)
+            log_message(
+                log_db,
+                "EXTRACT",
+                config_id,
+                "PROCESSING",
+                message=f"Extract {ticker} thành công.",
+            )
+        except Exception as e:
+            outcomes[ticker] = e
+    return outcomes
+
+
+def extract_unit_data(
+    unit,
+    period,
+    interval,
+    config_id,
+    log_db,
+    batched,
+    rate_limiter=None,
+    watermarks=None,
+    overlap_bars=0,
+    cache=None,
+):
+    """
+    Extract một đơn vị công việc (một ticker hoặc một batch), trả về {ticker: DataFrame | Exception}.
+    watermarks (incremental): chỉ tải từ watermark lùi overlap_bars bar; ticker chưa có
+    watermark thì tải đủ period.
+    """
+    watermarks = watermarks or {}
+    starts = [
+        incremental_start(watermarks[ticker], interval, overlap_bars)
+        for ticker in unit
+        if ticker in watermarks
+    ]
+    # Batch dùng chung một cửa sổ tải: chỉ incremental khi mọi ticker đã có watermark
+    start = min(starts) if starts and len(starts) == len(unit) else None
+
+    if batched:
+        return extract_batch_data(
+            unit,
+            period,
+            interval,
+            config_id,
+            log_db,
+            rate_limiter,
+            start,
+            watermarks,
+            cache,
+        )
+
+    outcomes = {}
+    for ticker in unit:
+        # 10.8.6  Bắt đầu khối try...except để xử lý lỗi cho từng ticker.
+        try:
+            outcomes[ticker] = extract_ticker_data(
+                ticker,
+                period,
+                interval,
+                config_id,
+                log_db,
+                rate_limiter,
+                start,
+                watermarks.get(ticker),
+                cache,
+            )
+        except Exception as e:
+            outcomes[ticker] = e
+    return outcomes
 
 
 # 10.8.1 Bắt đầu hàm run_crawl_data_with_config
 
 
-def run_crawl_data_with_config(config, log_db, config_id):
+def run_crawl_data_with_config(
+    config, log_db, config_id, writer, watermark_db=None, cache=None
+):
     # 10.8.2 Lấy danh sách tickers, period, interval từ cấu hình.
     tickers = parse_tickers(config.get("tickers", []))
     period = config.get("period", "1mo")
@@ -98,58 +266,159 @@ def run_crawl_data_with_config(config, log_db, config_id):
         "PROCESSING",
         message=f"Bắt đầu crawl dữ liệu cho {len(tickers)} ticker.",
     )
-    # 10.8.4 Khởi tạo danh sách rỗng all_rows = [].
-    all_rows = []
-    # 10.8.5 Bắt đầu vòng lặp for qua từng ticker
-    for ticker in tickers:
-        # 10.8.6  Bắt đầu khối try...except để xử lý lỗi cho từng ticker.
-        try:
-            # 10.8.7 Gọi extract_ticker_data(ticker, ...) để lấy dữ liệu cho một mã cổ phiếu.
-            records = extract_ticker_data(ticker, period, interval, config_id, log_db)
-            # 10.8.8 Thêm các bản ghi (records) trả về vào all_rows(append)
-            all_rows.extend(records)
-        except Exception as e:
-            # 10.8.6.1 Ghi log FAILURE với message "Lỗi khi extract {ticker}: {lỗi}".
+    # batch_size > 0: tải theo nhóm N ticker mỗi lần gọi yf.download
+    batch_size = config.get("batch_size") or 0
+    # max_workers > 1: chạy song song các ticker/batch; rate_limit_per_sec giới hạn request tới Yahoo Finance
+    max_workers = config.get("max_workers") or 1
+    rate_limit = config.get("rate_limit_per_sec")
+    rate_limiter = TokenBucket(float(rate_limit)) if rate_limit else None
+    # incremental: chỉ tải các bar sau watermark (lùi overlap_bars bar) của từng ticker
+    watermarks = {}
+    overlap_bars = config.get("overlap_bars") or 0
+    if config.get("incremental") and watermark_db:
+        watermarks = watermark_db.get_watermarks(interval, tickers)
+        log_message(
+            log_db,
+            "EXTRACT",
+            config_id,
+            "PROCESSING",
+            message=f"Incremental: {len(watermarks)}/{len(tickers)} ticker đã có watermark.",
+        )
+    # Retry theo ticker: chỉ tải lại các ticker lỗi tạm thời, có backoff + jitter.
+    # retry_count = số lượt retry SAU lần tải đầu (tổng số lần tải = 1 + retry_count);
+    # 0 là không retry, chỉ NULL (chưa cấu hình) mới dùng mặc định 3
+    retry_count = config.get("retry_count")
+    max_retries = 3 if retry_count is None else max(int(retry_count), 0)
+    backoff_base = float(config.get("retry_backoff_sec") or 1.0)
+
+    def run_unit(unit):
+        # 10.8.7 Gọi extract_ticker_data(ticker, ...) để lấy dữ liệu cho một mã cổ phiếu.
+        return extract_unit_data(
+            unit,
+            period,
+            interval,
+            config_id,
+            log_db,
+            batch_size > 0,
+            rate_limiter,
+            watermarks,
+            overlap_bars,
+            cache,
+        )
+
+    succeeded = []
+    permanent = {}
+    pending = list(tickers)
+    last_errors = {}
+    attempt = 0
+    # 10.8.4 DataFrame của từng ticker được đẩy thẳng vào writer, không gom trong bộ nhớ.
+    # attempt 0 là lần tải đầu, attempt 1..max_retries là các lượt retry
+    while pending and attempt <= max_retries:
+        if attempt > 0:
+            delay = backoff_delay(attempt, backoff_base)
             log_message(
                 log_db,
                 "EXTRACT",
                 config_id,
-                "FAILURE",
-                message=f"Lỗi khi extract {ticker}: {e}",
+                "PROCESSING",
+                message=f"Retry lần {attempt}/{max_retries} cho {len(pending)} ticker sau {delay:.1f}s: {', '.join(pending)}",
             )
-    # 10.8.9 Kiểm tra all_rows có rỗng không?
-    if not all_rows:
-        # 10.8.10 Nếu rỗng (không lấy được dữ liệu của ticker nào): Ném ra RuntimeError để hàm process_config bắt được và thực hiện retry.
-        raise RuntimeError("Không có dữ liệu hợp lệ cho bất kỳ ticker nào.")
-
-    # 10.8.11 Tạo DataFrame df từ all_rows
-    df = pd.DataFrame(all_rows).round(4)
-    # 10.8.12 Ghi log PROCESSING với message "Crawl thành công {len(df)} bản ghi.".
+            time.sleep(delay)
+        if batch_size > 0:
+            units = chunk_tickers(pending, batch_size)
+        else:
+            units = [[ticker] for ticker in pending]
+
+        failed = {}
+
+        def handle_result(result):
+            # Ghi kết quả của một ticker/batch ngay khi có (theo thứ tự tickers trong config)
+            for ticker in (t for t in pending if t in result):
+                outcome = result[ticker]
+                if isinstance(outcome, Exception):
+                    kind = classify_error(outcome)
+                    # 10.8.6.1 Ghi log FAILURE với message "Lỗi khi extract {ticker}: {lỗi}".
+                    log_message(
+                        log_db,
+                        "EXTRACT",
+                        config_id,
+                        "FAILURE",
+                        message=f"Lỗi khi extract {ticker} ({kind}): {outcome}",
+                    )
+                    if kind == PERMANENT:
+                        # Lỗi vĩnh viễn (mã không tồn tại...) không tốn lượt retry
+                        permanent[ticker] = outcome
+                    else:
+                        failed[ticker] = outcome
+                else:
+                    # 10.8.8 Đẩy DataFrame trả về vào writer
+                    writer.write(outcome)
+                    succeeded.append(ticker)
+
+        # 10.8.5 Bắt đầu vòng lặp qua từng ticker (hoặc batch), tuần tự hoặc qua worker pool
+        if max_workers > 1 and len(units) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(units))
+            ) as executor:
+                for result in executor.map(run_unit, units):
+                    handle_result(result)
+        else:
+            for unit in units:
+                handle_result(run_unit(unit))
+
+        pending = [ticker for ticker in pending if ticker in failed]
+        last_errors = failed
+        attempt += 1
+
+    report = {
+        "succeeded": succeeded,
+        "permanent": {t: str(e) for t, e in permanent.items()},
+        "transient": {t: str(last_errors[t]) for t in pending},
+        "row_count": writer.row_count,
+    }
+
+    # 10.8.9 Kiểm tra writer có nhận được bản ghi nào không?
+    if writer.row_count == 0:
+        # 10.8.10 Nếu rỗng (không lấy được dữ liệu của ticker nào): Ném ra RuntimeError để process_config ghi nhận thất bại.
+        raise RuntimeError(
+            f"Không có dữ liệu hợp lệ cho bất kỳ ticker nào.\n\n{format_crawl_report(report)}"
+        )
+
+    # 10.8.12 Ghi log PROCESSING với message "Crawl thành công {row_count} bản ghi.".
     log_message(
         log_db,
         "EXTRACT",
         config_id,
         "PROCESSING",
-        message=f"Crawl thành công {len(df)} bản ghi.",
+        message=f"Crawl thành công {writer.row_count} bản ghi ({len(succeeded)}/{len(tickers)} ticker).",
     )
-    # 10.8.13 Trả về DataFrame df.
-    return df
+    # 10.8.13 Trả về báo cáo kết quả theo ticker.
+    return report
 
 
-# 10.9.1 Bắt đầu hàm save_extract_result
+def format_crawl_report(report):
+    """Báo cáo partial-success: ticker thành công, lỗi vĩnh viễn, lỗi tạm thời sau khi hết retry"""
+    lines = [
+        f"Thành công: {len(report['succeeded'])} ticker, {report['row_count']} bản ghi."
+    ]
+    for title, key in (
+        ("Lỗi vĩnh viễn (không retry)", "permanent"),
+        ("Lỗi tạm thời (hết lượt retry)", "transient"),
+    ):
+        if report[key]:
+            lines.append(f"{title}:")
+            lines.extend(f"  - {t}: {msg}" for t, msg in report[key].items())
+    return "\n".join(lines)
 
 
-def save_extract_result(df, config, config_id, log_db):
-    # 10.9.2 Tạo thư mục output_path nếu nó chưa tồn tại.
-    raw_path = os.path.join(config["output_path"], "")
-    os.makedirs(raw_path, exist_ok=True)
+# 10.9.1 Bắt đầu hàm save_extract_result
 
-    # 10.9.3 Tạo tên file duy nhất dựa trên config_id và timestamp hiện tại (ví dụ: 123_20231027_103000.csv).
-    file_name = f"{config_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    file_path = os.path.join(raw_path, file_name)
 
-    # 10.9.4 Ghi DataFrame df ra file CSV tại đường dẫn đã tạo.
-    df.round(4).to_csv(file_path, index=False)
+def save_extract_result(writer, config_id, log_db):
+    # 10.9.2 Đóng writer: một file duy nhất (partition_mode none) hoặc
+    #        đánh dấu manifest hoàn tất (các part đã được ghi trong lúc crawl).
+    #        Tên file/thư mục duy nhất theo config_id và timestamp (ví dụ: 123_20231027_103000.csv).
+    file_path = writer.close()
 
     # 10.9.5 Ghi log SUCCESS với message "Đã ghi file kết quả: {file_path}".
     log_message(
@@ -167,66 +436,89 @@ def save_extract_result(df, config, config_id, log_db):
 # 10.1 Bắt đầu hàm process_config
 
 
-def process_config(config, log_db, email_service):
+def process_config(config, log_db, email_service, watermark_db=None):
     # 10.2Lấy config_id từ cấu hình.Ghi log READY với message "Bắt đầu xử lý config.".
     config_id = config["id"]
     log_message(log_db, "EXTRACT", config_id, "READY", message="Bắt đầu xử lý config.")
 
-    # 10.3.Lấy output_path từ cấu hình.
-    output_path = config.get("output_path")
+    # 10.3-10.4 Không xóa output_path: mỗi lần chạy ghi file/thư mục riêng
+    #      ({config_id}_{timestamp}), các file của lần trước có thể chưa được LOAD_STAGING
+    #      load. Lần chạy lỗi chỉ dọn kết quả của chính nó (writer.abort()).
+
+    # 10.5 Khởi tạo craw_success = False. Retry được thực hiện theo ticker trong
+    #      run_crawl_data_with_config (retry_count lượt, exponential backoff + jitter).
+    craw_success = False
+    report = None
+    # Cache dùng chung cho mọi lượt retry: ticker đã tải thành công không bị tải lại
+    cache = build_price_cache(config)
+    emails = config.get("emails")
+    if not emails:
+        emails = []
+
+    # 10.7.Bắt đầu khối try...except.
+    try:
+        # 10.8.Gọi run_crawl_data_with_config(config, ...) để crawl dữ liệu.
+        # Writer theo partition_mode: ghi dần từng ticker xuống đĩa hoặc gom một file
+        writer = open_extract_writer(config, config_id)
+        try:
+            report = run_crawl_data_with_config(
+                config, log_db, config_id, writer, watermark_db, cache
+            )
 
-    # 10.4 output_path có tồn tại không?
-    if output_path and os.path.exists(output_path):
-        shutil.rmtree(output_path)
+            # 10.9. Gọi save_extract_result(writer, ...) để hoàn tất kết quả.
+            file_path = save_extract_result(writer, config_id, log_db)
+        except Exception:
+            writer.abort()
+            raise
+        # Incremental: ghi watermark chờ gắn với sha256 của file kết quả, chỉ tiến lên
+        # khi LOAD_STAGING đã nạp đúng file đó (inbound_file LOADED)
+        if config.get("incremental") and watermark_db:
+            watermark_db.set_pending(
+                config.get("interval", "1d"),
+                parse_tickers(config.get("tickers", [])),
+                writer.max_datetimes,
+                file_checksum(file_path),
+            )
+        # 10.10.Đặt craw_success = True
+        craw_success = True
+    except Exception as e:
+        # 10.7.1 Ghi log FAILURE với message "Lỗi: {lỗi}". Gửi email cho admin một lần.
+        log_message(
+            log_db,
+            "EXTRACT",
+            config_id,
+            "FAILURE",
+            message=f"Lỗi: {e}",
+        )
+        email_service.send_email(
+            to_addrs=emails,
+            subject=f"[ETL Extract] Lỗi Config ID={config.get('id')}",
+            body=f"Lỗi tổng thể trong process_config:\n\n{e}",
+        )
 
-        # 10.4.1.Xóa toàn bộ thư mục và nội dung bên trong (shutil.rmtree).
-        #            Ghi log PROCESSING với message "Đã xóa thư mục output: {output_path}".
+    # Partial success: ghi log và gửi một email báo cáo các ticker lỗi
+    if report and (report["permanent"] or report["transient"]):
         log_message(
             log_db,
             "EXTRACT",
             config_id,
             "PROCESSING",
-            message=f"Đã xóa thư mục output: {output_path}",
+            message=format_crawl_report(report),
+        )
+        email_service.send_email(
+            to_addrs=emails,
+            subject=f"[ETL Extract] Partial success Config ID={config.get('id')}",
+            body=format_crawl_report(report),
+        )
+    # 10.11 Ghi thống kê cache
+    if cache:
+        log_message(
+            log_db,
+            "EXTRACT",
+            config_id,
+            "PROCESSING",
+            message=cache.stats_message(),
         )
-
-    # 10.5 Khởi tạo craw_success = False, retry_count = 0.Lấy số lần thử lại tối đa max_retries từ cấu hình (mặc định là 3).
-    craw_success = False
-    retry_count = 0
-    max_retries = config.get("retry_count", 3) or 3
-
-    # 10.6.Bắt đầu vòng lặp while để thử lại khi thất bại (while not craw_success and retry_count < max_retries)
-    while not craw_success and retry_count < max_retries:
-        # 10.7.Bắt đầu khối try...except cho mỗi lần thử.
-        try:
-            # 10.8.Gọi run_crawl_data_with_config(config, ...) để crawl dữ liệu.
-            df = run_crawl_data_with_config(config, log_db, config_id)
-
-            # 10.9. Gọi save_extract_result(df, ...) để lưu kết quả trả về từ bước trên.
-
-            save_extract_result(df, config, config_id, log_db)
-            # 10.10.Đặt craw_success = True để thoát khỏi vòng lặp while
-            craw_success = True
-        except Exception as e:
-            # 10.7.1 Tăng retry_count lên 1.
-            #            Ghi log FAILURE với message "Lỗi lần {retry_count}/{max_retries}: {lỗi}".
-            #            Gửi email cho admin thông báo về lỗi lần thử này.
-            retry_count += 1
-            log_message(
-                log_db,
-                "EXTRACT",
-                config_id,
-                "FAILURE",
-                message=f"Lỗi lần {retry_count}/{max_retries}: {e}",
-            )
-            emails = config.get("emails")
-            if not emails:
-                emails = []
-            email_service.send_email(
-                to_addrs=emails,
-                subject=f"[ETL Extract] Lỗi Config ID={config.get('id')}",
-                body=f"Lỗi tổng thể trong process_config:\n\n{e}",
-            )
-    # 10.11 Kết thúc vòng while
     # 10.12 Kiểm tra craw_success.
 
     if craw_success:
@@ -249,6 +541,36 @@ def process_config(config, log_db, email_service):
         )
 
 
+def group_configs_by_output(configs):
+    """Gom các config dùng chung output_path vào cùng một nhóm (chạy tuần tự trong một process)"""
+    groups = {}
+    for config in configs:
+        key = os.path.abspath(config.get("output_path") or f"__config_{config['id']}")
+        groups.setdefault(key, []).append(dict(config))
+    return list(groups.values())
+
+
+def process_config_group(configs):
+    """
+    Chạy trong worker process: tự mở kết nối DB riêng, xử lý tuần tự các config của nhóm.
+    Trả về [(config_id, lỗi hoặc None)] để main() tổng hợp.
+    """
+    config_db, log_db, watermark_db, email_service = init_services()
+    results = []
+    try:
+        for config in configs:
+            try:
+                process_config(config, log_db, email_service, watermark_db)
+                results.append((config["id"], None))
+            except Exception as e:
+                results.append((config["id"], str(e)))
+    finally:
+        config_db.close()
+        log_db.close()
+        watermark_db.close()
+    return results
+
+
 # ==========================
 # 3️ MAIN
 # ==========================
@@ -262,13 +584,34 @@ def main():
     #        Thiết lập thông số kết nối cơ sở dữ liệu từ biến môi trường (host, dbname, user, password, port).
     #        Khởi tạo đối tượng ConfigExtractDatabase để tương tác với bảng cấu hình.
     #        Khởi tạo đối tượng LogDatabase để ghi log vào DB.
+    #        Khởi tạo đối tượng WatermarkDatabase để đọc/ghi watermark incremental.
     #        Khởi tạo đối tượng EmailService để gửi email thông báo.
     #        In ra màn hình thông báo Đã khởi tạo thành công các service.
-    #        Trả về các dịch vụ đã khởi tạo: config_db, log_db, email_service
-    config_db, log_db, email_service = init_services()
+    #        Trả về các dịch vụ đã khởi tạo: config_db, log_db, watermark_db, email_service
+    config_db, log_db, watermark_db, email_service = init_services()
 
     # 4.Khởi tạo biến success = 0 và fail = 0 để đếm số cấu hình xử lý thành công/thất bại.
     success, fail = 0, 0
+    # EXTRACT_MAX_PROCESSES > 1: chạy các config độc lập trên nhiều process (giới hạn chung)
+    max_processes = int(os.getenv("EXTRACT_MAX_PROCESSES", 1) or 1)
+
+    def record_failure(config, e):
+        # 11.2 Ghi log FAILURE .Gửi email cho admin.
+        log_message(
+            log_db,
+            "EXTRACT",
+            config.get("id"),
+            "FAILURE",
+            message=f"Lỗi xử lý config ID={config.get('id')}: {e}",
+        )
+        emails = config.get("emails")
+        if not emails:
+            emails = []
+        email_service.send_email(
+            to_addrs=emails,
+            subject=f"[ETL Extract] Lỗi Config ID={config.get('id')}",
+            body=f"Lỗi tổng thể trong process_config:\n\n{e}",
+        )
 
     # 5.Bắt đầu khối try...except...finally trong main để xử lý lỗi tổng thể.
     try:
@@ -287,35 +630,48 @@ def main():
             )
             return
 
-        # 8.Bắt đầu vòng lặp for qua từng config trong danh sách configs
-        for config in configs:
-            # 9.Bắt đầu khối try...except để xử lý lỗi cho từng config riêng lẻ.
-            try:
-                # 10.Gọi hàm process_config(config, log_db, email_service) để xử lý một cấu hình.
-                process_config(config, log_db, email_service)
-
-                # 11.1 Tăng biến success lên 1
-                success += 1
-
-                # 9.1Ghi Log FAILURE lỗi xử lý config gửi email
-            except Exception as e:
-                # 11.2 Tăng biến fail lên 1. Ghi log FAILURE .Gửi email cho admin.
-                fail += 1
-                log_message(
-                    log_db,
-                    "EXTRACT",
-                    config.get("id"),
-                    "FAILURE",
-                    message=f"Lỗi xử lý config ID={config.get('id')}: {e}",
-                )
-                emails = config.get("emails")
-                if not emails:
-                    emails = []
-                email_service.send_email(
-                    to_addrs=emails,
-                    subject=f"[ETL Extract] Lỗi Config ID={config.get('id')}",
-                    body=f"Lỗi tổng thể trong process_config:\n\n{e}",
-                )
+        groups = group_configs_by_output(configs)
+        if max_processes > 1 and len(groups) > 1:
+            # 8'. Chế độ song song: mỗi nhóm config chạy trong một worker process riêng.
+            #     Dùng "spawn" để process con không kế thừa kết nối psycopg2 của process cha.
+            configs_by_id = {config["id"]: config for config in configs}
+            with ProcessPoolExecutor(
+                max_workers=min(max_processes, len(groups)),
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = {
+                    executor.submit(process_config_group, group): group
+                    for group in groups
+                }
+                for future in as_completed(futures):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        # Worker process chết: cả nhóm tính là thất bại
+                        results = [(config["id"], str(e)) for config in futures[future]]
+                    # Tổng hợp kết quả của worker về success/fail
+                    for config_id, error in results:
+                        if error is None:
+                            success += 1
+                        else:
+                            fail += 1
+                            record_failure(configs_by_id[config_id], error)
+        else:
+            # 8.Bắt đầu vòng lặp for qua từng config trong danh sách configs
+            for config in configs:
+                # 9.Bắt đầu khối try...except để xử lý lỗi cho từng config riêng lẻ.
+                try:
+                    # 10.Gọi hàm process_config(config, log_db, email_service) để xử lý một cấu hình.
+                    process_config(config, log_db, email_service, watermark_db)
+
+                    # 11.1 Tăng biến success lên 1
+                    success += 1
+
+                    # 9.1Ghi Log FAILURE lỗi xử lý config gửi email
+                except Exception as e:
+                    # 11.2 Tăng biến fail lên 1.
+                    fail += 1
+                    record_failure(config, e)
 
         # 5.1 Ghi log lỗi tổng thể trong main
     except Exception as e:
@@ -333,6 +689,7 @@ def main():
         #        In ra màn hình "Kết thúc quá trình EXTRACT.".
         config_db.close()
         log_db.close()
+        watermark_db.close()
         log_message(
             None,
             "EXTRACT",
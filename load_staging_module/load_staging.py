@@ -1,20 +1,220 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from db.staging_db import StagingDatabasePool
+
+from db.file_catalog_db import DUPLICATE, MISSING
 from utils.service_util import init_services
-from utils.file_util import get_latest_csv_file, read_csv_file
+from utils.file_util import (
+    file_checksum,
+    get_latest_file,
+    get_latest_manifest,
+    read_csv_file,
+    read_csv_header,
+    read_manifest_parts,
+    read_parquet_file,
+    scan_inbound_files,
+)
 from utils.logger_util import log_message
 
 
-def load_csv_to_staging(config, staging_db, log_db):
-    """Load dữ liệu CSV vào bảng staging."""
+def direct_copy_columns(config, staging_db, file_paths):
+    """
+    Kiểm tra các file CSV có thể COPY thẳng (không qua pandas) vào target_table không:
+    có header, delimiter một ký tự, header giống nhau ở mọi file và đều là cột của bảng.
+    Trả về danh sách cột (theo header) hoặc None nếu phải đi đường pandas.
+    """
+    delimiter = config.get("delimiter") or ","
+    if not config.get("has_header", True) or len(delimiter) != 1:
+        return None
+    headers = {tuple(read_csv_header(path, delimiter)) for path in file_paths}
+    if len(headers) != 1:
+        return None
+    columns = list(headers.pop())
+    table_columns = set(staging_db.table_columns(config.get("target_table")))
+    if not columns or len(set(columns)) != len(columns):
+        return None
+    if not set(columns) <= table_columns:
+        return None
+    return columns
+
+
+def headerless_columns(config):
+    """
+    Tên cột theo thứ tự trong file khi has_header = FALSE (config column_names).
+    None: file có header, hoặc để staging_db lấy theo thứ tự cột của target_table.
+    """
+    if config.get("has_header", True) or not config.get("column_names"):
+        return None
+    return [col.strip() for col in config["column_names"].split(",") if col.strip()]
+
+
+def load_manifest_to_staging(config, staging_db, log_db, manifest_path=None):
+    """
+    Load các part liệt kê trong manifest của EXTRACT (partition) vào bảng staging.
+    manifest_path None: manifest hoàn tất mới nhất trong source_path (không dùng danh mục).
+    """
+    config_id = config["id"]
+    source_path = config.get("source_path")
+    target_table = config.get("target_table")
+    delimiter = config.get("delimiter", ",")
+    has_header = config.get("has_header", True)
+
+    if manifest_path is None:
+        manifest_path = get_latest_manifest(source_path, log_db, config_id)
+    parts = read_manifest_parts(manifest_path)
+    if not parts:
+        raise ValueError(f"Manifest {manifest_path} không có part nào để load.")
+    log_message(
+        log_db,
+        "LOAD_STAGING",
+        config_id,
+        "PROCESSING",
+        message=f"Đang load {len(parts)} part từ manifest: {manifest_path}",
+    )
+
+    # Part CSV khớp cột bảng: stream thẳng file vào COPY
+    if all(part_format == "csv" for _, part_format in parts):
+        part_paths = [part_path for part_path, _ in parts]
+        columns = direct_copy_columns(config, staging_db, part_paths)
+        if columns:
+            return staging_db.copy_from_files(
+                part_paths,
+                target_table,
+                columns,
+                delimiter or ",",
+                batch_id=config.get("batch_id"),
+            )
+
+    def read_parts():
+        # Đọc lần lượt từng part, mỗi lúc chỉ một part nằm trong bộ nhớ
+        for part_path, part_format in parts:
+            if part_format == "parquet":
+                yield read_parquet_file(part_path, log_db, config_id)
+            else:
+                yield read_csv_file(part_path, delimiter, has_header, log_db, config_id)
+
+    return staging_db.copy_from_dataframes(
+        read_parts(),
+        target_table,
+        columns=headerless_columns(config),
+        copy_mode=config.get("copy_mode"),
+        batch_id=config.get("batch_id"),
+    )
+
+
+def catalog_inbound_files(config, file_catalog_db, log_db):
+    """
+    Cập nhật danh mục inbound_file cho config rồi trả về các file chưa load (theo mtime).
+    Chỉ quét file có mtime >= mốc của lần trước; chỉ tính sha256 cho file mới/bị ghi đè.
+    File chờ load nhưng đã bị xóa khỏi đĩa được đánh dấu MISSING và bỏ qua.
+    """
+    config_id = config["id"]
+    file_type = (config.get("file_type") or "csv").lower()
+    since_mtime = file_catalog_db.get_scan_mark(config_id)
+    found = scan_inbound_files(config.get("source_path"), file_type, since_mtime)
+    known = file_catalog_db.get_entries(config_id, [path for path, _, _ in found])
+    duplicates = 0
+    for path, size, mtime in found:
+        entry = known.get(path)
+        if (
+            entry
+            and entry["status"] != MISSING
+            and entry["file_size"] == size
+            and entry["file_mtime"] == mtime
+        ):
+            continue
+        status = file_catalog_db.register(
+            config_id, path, size, mtime, file_checksum(path)
+        )
+        duplicates += status == DUPLICATE
+    if duplicates:
+        log_message(
+            log_db,
+            "LOAD_STAGING",
+            config_id,
+            "WARNING",
+            message=f"Bỏ qua {duplicates} file trùng nội dung (cùng sha256) với file đã có.",
+        )
+    pending = file_catalog_db.get_pending(config_id)
+    missing = [entry for entry in pending if not os.path.exists(entry["file_path"])]
+    if missing:
+        file_catalog_db.mark_missing([entry["id"] for entry in missing])
+        log_message(
+            log_db,
+            "LOAD_STAGING",
+            config_id,
+            "WARNING",
+            message=f"Bỏ qua {len(missing)} file trong danh mục không còn tồn tại trên đĩa.",
+        )
+    return [entry for entry in pending if entry not in missing]
+
+
+def load_file_to_staging(config, staging_db, log_db, file_path) -> int:
+    """Load một file CSV/Parquet (hoặc một manifest) vào bảng staging, trả về số bản ghi đã load."""
+    config_id = config["id"]
+    target_table = config.get("target_table")
+    delimiter = config.get("delimiter", ",")
+    has_header = config.get("has_header", True)
+    file_type = (config.get("file_type") or "csv").lower()
+# 7.3. Ghi log "Đang load file: {file_path}"
+    log_message(
+        log_db,
+        "LOAD_STAGING",
+        config_id,
+        "PROCESSING",
+        message=f"Đang load file: {file_path}",
+    )
+# file_type = manifest: file trong danh mục là _manifest.json, load các part của nó
+    if file_type == "manifest":
+        return load_manifest_to_staging(config, staging_db, log_db, file_path)
+# 7.4. File CSV khớp cột bảng staging -> COPY thẳng file (không parse qua pandas)
+# Số bản ghi lấy từ row count của lệnh COPY
+    if file_type == "csv":
+        columns = direct_copy_columns(config, staging_db, [file_path])
+        if columns:
+            return staging_db.copy_from_files(
+                [file_path],
+                target_table,
+                columns,
+                delimiter or ",",
+                batch_id=config.get("batch_id"),
+            )
+# Ngược lại (delimiter/header/cột cần xử lý): đọc file thành DataFrame
+# Parquet: đọc trực tiếp theo cột, giữ kiểu dữ liệu (không parse text)
+# CSV: read_csv_file(file_path, delimiter, has_header, log_db, config_id)
+    if file_type == "parquet":
+        df = read_parquet_file(file_path, log_db, config_id)
+    else:
+        df = read_csv_file(file_path, delimiter, has_header, log_db, config_id)
+    # 7.5 Kiểm tra File rỗng (df.empty) ?
+    if df.empty:
+        raise ValueError(f"File {file_path} rỗng, không có dữ liệu để load.")
+#7.5 (NO) 8. Gọi staging_db.copy_from_dataframe(df, target_table, copy_mode=...)
+# Nạp dữ liệu vào bảng staging tương ứng (COPY stream theo khối, csv hoặc binary)
+    staging_db.copy_from_dataframe(
+        df,
+        target_table,
+        columns=headerless_columns(config),
+        copy_mode=config.get("copy_mode"),
+        batch_id=config.get("batch_id"),
+    )
+    return len(df)
+
+
+def load_csv_to_staging(config, staging_db, log_db, file_catalog_db=None):
+    """
+    Load dữ liệu (CSV, Parquet hoặc manifest theo file_type) vào bảng staging.
+    Có file_catalog_db: load mọi file (hoặc manifest hoàn tất) chưa load trong danh mục
+    inbound_file, mỗi file đúng một lần; không có: chỉ load file mới nhất như trước.
+    """
     config_id = config["id"]
 
     try:
         source_path = config.get("source_path")
         target_table = config.get("target_table")
-        delimiter = config.get("delimiter", ",")
-        has_header = config.get("has_header", True)
+        file_type = (config.get("file_type") or "csv").lower()
 # 7.1. Ghi log "Đăng xử lý {target_table}..."
         log_message(
             log_db,
@@ -23,48 +223,254 @@ def load_csv_to_staging(config, staging_db, log_db):
             "PROCESSING",
             message=f"Đang xử lý {target_table}...",
         )
-# 7.2. Gọi hàm get_latest_csv_file(source_path, log_db, config_id)
-# Lấy file CSV mới nhất trong thư mục nguồn
-        latest_file = get_latest_csv_file(source_path, log_db, config_id)
-        # 7.3. Ghi log "Đang load file: {latest_file}"
+# file_type = manifest, không dùng danh mục: load manifest mới nhất
+# (có danh mục: manifest được quét/đăng ký như file, đi chung nhánh bên dưới)
+        if file_type == "manifest" and file_catalog_db is None:
+            row_count = load_manifest_to_staging(config, staging_db, log_db)
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "SUCCESS",
+                message=f"Load thành công {row_count} bản ghi vào {target_table}",
+            )
+            return True
+        if file_catalog_db is None:
+# 7.2. Gọi hàm get_latest_file(source_path, file_type, log_db, config_id)
+# Lấy file mới nhất (đúng định dạng file_type) trong thư mục nguồn
+            latest_file = get_latest_file(source_path, file_type, log_db, config_id)
+            row_count = load_file_to_staging(config, staging_db, log_db, latest_file)
+# 9. Ghi log "Load thành công {row_count} bản ghi vào {target_table}"
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "SUCCESS",
+                message=f"Load thành công {row_count} bản ghi vào {target_table}",
+            )
+            return True
+# 7.2. Cập nhật danh mục inbound_file, lấy các file chưa load theo thứ tự mtime
+        pending = catalog_inbound_files(config, file_catalog_db, log_db)
+        if not pending:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "WARNING",
+                message=f"Không có file mới nào trong {source_path}.",
+            )
+            return True
+        total = 0
+        for entry in pending:
+            try:
+                row_count = load_file_to_staging(
+                    config, staging_db, log_db, entry["file_path"]
+                )
+            except FileNotFoundError:
+                # File bị xóa sau lúc quét: bỏ qua thay vì FAILED và retry mãi
+                file_catalog_db.mark_missing([entry["id"]])
+                continue
+            except Exception as e:
+                file_catalog_db.mark_failed(entry["id"], e)
+                raise
+            file_catalog_db.mark_loaded(entry["id"], row_count)
+            total += row_count
+# 9. Ghi log "Load thành công {total} bản ghi vào {target_table}"
         log_message(
             log_db,
             "LOAD_STAGING",
             config_id,
-            "PROCESSING",
-            message=f"Đang load file: {latest_file}",
+            "SUCCESS",
+            message=f"Load thành công {total} bản ghi từ {len(pending)} file vào {target_table}",
         )
-# 7.4. Gọi hàm read_csv_file(latest_file, delimiter, has_header, log_db, config_id)
-# Đọc nội dung file CSV và chuyển thành DataFrame
-        df = read_csv_file(latest_file, delimiter, has_header, log_db, config_id)
-        # 7.5 Kiểm tra File rỗng (df.empty) ?
-        if df.empty:
-            raise ValueError(f"File {latest_file} rỗng, không có dữ liệu để load.")
-#7.5 (NO) 8. Gọi staging_db.copy_from_dataframe(df, target_table)
-# Nạp dữ liệu vào bảng staging tương ứng
-        staging_db.copy_from_dataframe(df, target_table)
-# 9. Ghi log "Load thành công {len(df)} bản ghi vào {target_table}"
+        return True
+
+    except Exception as e:
         log_message(
             log_db,
             "LOAD_STAGING",
             config_id,
-            "SUCCESS",
-            message=f"Load thành công {len(df)} bản ghi vào {target_table}",
+            "FAILURE",
+            message=f"Lỗi trong load_csv_to_staging(): {e}",
         )
+        raise
 
-        return True
 
-    except Exception as e:
+
+def _load_task(config, pool, log_db, file_catalog_db, entry):
+    """
+    Một đơn vị load song song: một file (hoặc manifest) trong danh mục (entry).
+    Retry tối đa retry_count lần, mỗi lần mượn một kết nối staging từ pool.
+    Trả về (thành công, số bản ghi, lỗi cuối).
+    """
+    config_id = config["id"]
+    max_retries = config.get("retry_count", 3) or 3
+    error = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            with pool.connection() as staging_db:
+                row_count = load_file_to_staging(
+                    config, staging_db, log_db, entry["file_path"]
+                )
+            file_catalog_db.mark_loaded(entry["id"], row_count)
+            return True, row_count, None
+        except FileNotFoundError:
+            # File bị xóa sau lúc quét: bỏ qua như catalog_inbound_files
+            file_catalog_db.mark_missing([entry["id"]])
+            return True, 0, None
+        except Exception as e:
+            error = e
+            file_catalog_db.mark_failed(entry["id"], e)
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "FAILURE",
+                message=f"Lỗi lần {attempt}: {e}",
+            )
+    return False, None, error
+
+
+def load_configs_parallel(configs, log_db, file_catalog_db, email_service, max_workers):
+    """
+    Load song song: mỗi file (hoặc manifest) chưa load là một task, chạy trên
+    max_workers kết nối staging riêng. Bảng staging đã được truncate một lần trước đó.
+    Ghi log SUCCESS/FAILURE cho từng config; trả về True nếu mọi config đều thành công.
+    """
+    tasks = []
+    for config in configs:
+        log_message(
+            log_db,
+            "LOAD_STAGING",
+            config["id"],
+            "READY",
+            message="Bắt đầu xử lý config load staging (song song).",
+        )
+        try:
+            pending = catalog_inbound_files(config, file_catalog_db, log_db)
+        except Exception as e:
+            tasks.append((config, e))
+            continue
+        if not pending:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config["id"],
+                "WARNING",
+                message=f"Không có file mới nào trong {config.get('source_path')}.",
+            )
+        tasks.extend((config, entry) for entry in pending)
+
+    pool = StagingDatabasePool(
+        min(max_workers, max(len(tasks), 1)),
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME_STAGING", "staging"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    results = {config["id"]: [] for config in configs}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for config, entry in tasks:
+                if isinstance(entry, Exception):
+                    results[config["id"]].append((False, None, entry))
+                    continue
+                futures.append(
+                    (
+                        config,
+                        executor.submit(
+                            _load_task, config, pool, log_db, file_catalog_db, entry
+                        ),
+                    )
+                )
+            for config, future in futures:
+                results[config["id"]].append(future.result())
+    finally:
+        pool.close()
+
+    failed_ids = set()
+    for config in configs:
+        config_id = config["id"]
+        outcome = results[config_id]
+        failed = [error for ok, _, error in outcome if not ok]
+        rows = sum(count or 0 for ok, count, _ in outcome if ok)
+        if not failed:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "SUCCESS",
+                message=f"Load thành công {rows} bản ghi từ {len(outcome)} task vào {config.get('target_table')}",
+            )
+            continue
+        failed_ids.add(config_id)
         log_message(
             log_db,
             "LOAD_STAGING",
             config_id,
             "FAILURE",
-            message=f"Lỗi trong load_csv_to_staging(): {e}",
+            message=f"Load staging thất bại {len(failed)}/{len(outcome)} task: {failed[0]}",
         )
-        raise
+        email_service.send_email(
+            to_addrs=config.get("emails") or [],
+            subject=f"[ETL Load Staging] Lỗi Config ID={config_id}",
+            body=f"Load staging thất bại {len(failed)}/{len(outcome)} task:\n\n{failed[0]}",
+        )
+    return failed_ids
 
 
+def finish_shadow_loads(
+    staging_db,
+    file_catalog_db,
+    log_db,
+    swap_config_ids,
+    failed_ids,
+    run_started,
+    batch_id=None,
+) -> bool:
+    """
+    load_mode = 'swap': với mỗi bảng, nếu mọi config của bảng load thành công thì dựng
+    index trên bảng shadow và swap vào chỗ bảng chính (giữ lại dòng của các batch
+    khác chưa TRANSFORM xong); ngược lại bỏ bảng shadow
+    (bảng chính giữ nguyên dữ liệu cũ) và đưa các file đã load lần này về PENDING.
+    Trả về True nếu mọi bảng đều swap thành công.
+    """
+    all_swapped = True
+    for table, config_ids in swap_config_ids.items():
+        error = None
+        if failed_ids & set(config_ids):
+            error = "có config load thất bại"
+        else:
+            try:
+                carried = staging_db.swap_shadow_table(table, batch_id)
+                log_message(
+                    log_db,
+                    "LOAD_STAGING",
+                    None,
+                    "SUCCESS",
+                    message=f"Đã swap bảng shadow vào {table}"
+                    + (f", giữ lại batch chờ TRANSFORM {carried}." if carried else "."),
+                )
+                continue
+            except Exception as e:
+                error = e
+        all_swapped = False
+        staging_db.drop_table(staging_db.shadow_table_name(table))
+        requeued = sum(
+            file_catalog_db.requeue_loaded_since(config_id, run_started)
+            for config_id in config_ids
+        )
+        log_message(
+            log_db,
+            "LOAD_STAGING",
+            None,
+            "FAILURE",
+            message=f"Không swap {table} ({error}), giữ nguyên dữ liệu cũ; đưa {requeued} file về PENDING.",
+        )
+    return all_swapped
+
 
 # 1. Gọi hàm main() bắt đầu chạy
 # In ra màn hình: "=== Bắt đầu quá trình LOAD STAGING ==="
@@ -73,16 +479,19 @@ def main():
 #  2. Gọi hàm init_services()
 # - Tự động load cấu hình trong file .env, cụ thể thể load các biến môi trường:  
 # DB_HOST, DB_USER, DB_PASSWORD, DB_PORT, DB_NAME_CONFIG, DB_NAME_STAGING, DB_NAME_DW, EMAIL_USERNAME, 
-# EMAIL_PASSWORD, EMAIL_SIMULATE, EMAIL_ADMIN, DEFAULT_RETRY
+# EMAIL_PASSWORD, EMAIL_SIMULATE, EMAIL_ADMIN, DEFAULT_RETRY,
+# LOAD_STAGING_MAX_WORKERS (số kết nối load song song, mặc định 1 = tuần tự)
 # - Khởi tạo lần lượt các  service theo danh sách truyển vào (config_load_staging, staging_db, log_db, email_service)
 # Với config_load_staging - đọc cấu hình cho LOAD_STAGING
 # Với staging_db - kết nối cơ dữ liệu staging để load dữ liệu tạm
 # Với log_db - kết nối cơ sở dữ liệu log, kiểm tra log EXTRACT và ghi load LOAD_STAGING
 # Với email_service - gửi thông báo khi có sự cố trong quá trình hoàn tất
-    services = init_services(['config_load_staging_db', 'staging_db', 'log_db', 'email_service'])
+    services = init_services(['config_load_staging_db', 'staging_db', 'log_db', 'watermark_db', 'file_catalog_db', 'email_service'])
     config_db = services['config_load_staging_db']
     staging_db = services['staging_db']
     log_db = services['log_db']
+    watermark_db = services['watermark_db']
+    file_catalog_db = services['file_catalog_db']
     email_service = services['email_service']
     
     try:
@@ -116,14 +525,54 @@ def main():
                 message="Không có config load staging nào đang active.",
             )
             return
+# load_mode = 'swap': load vào bảng shadow UNLOGGED (không truncate bảng chính),
+# swap vào chỗ bảng chính sau khi mọi config của bảng load thành công
+        swap_tables = {
+            cfg["target_table"]
+            for cfg in configs
+            if (cfg.get("load_mode") or "").lower() == "swap"
+        }
+        swap_config_ids = {
+            table: [cfg["id"] for cfg in configs if cfg["target_table"] == table]
+            for table in swap_tables
+        }
+        run_started = file_catalog_db.current_time()
+        shadow_tables = {
+            table: staging_db.create_shadow_table(table) for table in swap_config_ids
+        }
+        configs = [
+            {**cfg, "target_table": shadow_tables[cfg["target_table"]]}
+            if cfg["target_table"] in shadow_tables
+            else cfg
+            for cfg in configs
+        ]
+# Mỗi lần LOAD_STAGING là một batch: mọi dòng nạp lần này mang batch_id,
+# TRANSFORM chỉ xử lý/xóa dòng của batch nó nhận
+        batch_id = staging_db.begin_batch()
+        configs = [{**cfg, "batch_id": batch_id} for cfg in configs]
 #4.1 (YES) 5. Thực hiện Truncate bảng staging 
-# Lặp qua tất cả target_table từ các config active
-# Thực thi staging_db.truncate_table(table) 
-        staging_tables = {cfg["target_table"] for cfg in configs}
+# Lặp qua tất cả target_table từ các config active (trừ bảng load qua shadow
+# và bảng load_mode = 'batch' - giữ nguyên các batch khác đang chờ TRANSFORM)
+# Thực thi staging_db.truncate_batch_table(table, batch_id): không truncate khi bảng còn
+# batch LOADED/TRANSFORMING khác (load nối tiếp), batch có dòng bị bỏ -> DELETED
+        staging_tables = {
+            cfg["target_table"]
+            for cfg in configs
+            if (cfg.get("load_mode") or "").lower() != "batch"
+        } - set(shadow_tables.values())
         for table in staging_tables:
             # 5.1 Truncate thành công ?
             try:
-                staging_db.truncate_table(table)
+                pending_batches = staging_db.truncate_batch_table(table, batch_id)
+                if pending_batches:
+                    log_message(
+                        log_db,
+                        "LOAD_STAGING",
+                        None,
+                        "WARNING",
+                        message=f"Không truncate {table}: batch {pending_batches} chưa TRANSFORM xong, load nối tiếp.",
+                    )
+                    continue
                 #5.1 (YES) Ghi log "Đã truncate bảng {table} trước khi load."
                 log_message(
                     log_db,
@@ -141,11 +590,20 @@ def main():
                     "WARNING",
                     message=f"Không thể truncate bảng {table}: {e}",
                 )
+# LOAD_STAGING_MAX_WORKERS > 1: load song song các file/bảng trên nhiều kết nối
+        max_workers = int(os.getenv("LOAD_STAGING_MAX_WORKERS", 1) or 1)
+        failed_ids = set()
+        serial_configs = configs
+        if max_workers > 1:
+            failed_ids = load_configs_parallel(
+                configs, log_db, file_catalog_db, email_service, max_workers
+            )
+            serial_configs = []
 # Còn config khác không ? (YES) 6. Lặp qua từng config
 # Đối với mỗi config active:
 # Ghi log READY ("Bắt đầu xử lý config load staging.")
 # Đặt retry_count = 0, load_success = False
-        for config in configs:
+        for config in serial_configs:
             config_id = config["id"]
             log_message(
                 log_db,
@@ -162,9 +620,9 @@ def main():
 # retry_count < max_retries & load_success == False
             while not load_success and retry_count < max_retries:
                 try:
-#6.1 (YES) 7. Gọi hàm load_csv_to_staging(config, staging_db, log_db)
-# Hàm thực hiện đọc file CSV mới nhất từ thư mục gốc, kiểm tra dữ liệu, và nạp vào bảng staging 
-                    load_csv_to_staging(config, staging_db, log_db)
+#6.1 (YES) 7. Gọi hàm load_csv_to_staging(config, staging_db, log_db, file_catalog_db)
+# Hàm thực hiện đọc các file chưa load (danh mục inbound_file) từ thư mục gốc, kiểm tra dữ liệu, và nạp vào bảng staging 
+                    load_csv_to_staging(config, staging_db, log_db, file_catalog_db)
                     load_success = True
                     emails = config.get("emails")
                     print(config)
@@ -200,6 +658,7 @@ def main():
                     )
 # 10. Kiểm tra load_success == True ?
             if not load_success:
+                failed_ids.add(config_id)
                 # 10 (NO) Ghi log: "Load staging thất bại sau {max_retries} lần retry."
                 log_message(
                     log_db,
@@ -208,6 +667,39 @@ def main():
                     "FAILURE",
                     message=f"Load staging thất bại sau {max_retries} lần retry.",
                 )
+        all_loaded = not failed_ids
+        if swap_config_ids:
+            all_loaded = finish_shadow_loads(
+                staging_db,
+                file_catalog_db,
+                log_db,
+                swap_config_ids,
+                failed_ids,
+                run_started,
+                batch_id,
+            ) and all_loaded
+# Batch chỉ được TRANSFORM khi mọi config load thành công; lỗi thì xóa dòng của batch
+        if all_loaded:
+            staging_db.set_batch_status(batch_id, "LOADED")
+        else:
+            staging_db.set_batch_status(batch_id, "FAILED")
+            for cfg in configs:
+                if cfg["target_table"] in shadow_tables.values():
+                    continue
+                staging_db.delete_batch(cfg["target_table"], batch_id)
+                # File đã load vào batch bị xóa -> load lại ở lần chạy sau
+                file_catalog_db.requeue_loaded_since(cfg["id"], run_started)
+# Incremental extract: chỉ tiến watermark khi mọi config đã load thành công, và chỉ cho
+# các ticker có file pending đã LOADED trong inbound_file
+        if all_loaded:
+            count = watermark_db.commit_pending()
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                None,
+                "SUCCESS",
+                message=f"Đã tiến watermark extract cho {count} ticker.",
+            )
 
     except Exception as e:
         log_message(
@@ -220,6 +712,8 @@ def main():
         config_db.close()
         staging_db.close()
         log_db.close()
+        watermark_db.close()
+        file_catalog_db.close()
         print("Kết thúc quá trình LOAD STAGING.")
 
 
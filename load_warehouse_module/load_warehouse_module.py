@@ -1,4 +1,5 @@
 import os
+import time
 from dotenv import load_dotenv
 import pandas as pd
 from sqlalchemy import text
@@ -6,12 +7,50 @@ from sqlalchemy import text
 from db.config_dw_db import ConfigDWDatabase
 from db.dw_db import DWDatabase
 from db.log_db import LogDatabase
+from db.staging_db import StagingDatabase
 from email_service.email_service import EmailService
 from utils.logger_util import log_message
 # 1. import các thư viện cần thiết: os, dotenv, pandas, sqlalchemy.text 
 # và đọc biến môi trường load_dotenv()
 load_dotenv()
 
+# transfer_mode = 'stream': đọc thẳng từ staging qua COPY pipe thay cho file CSV
+STREAM_TRANSFER = "stream"
+# Khóa watermark (export_watermark bên staging) của các dòng fact đã chuyển sang DW bằng stream
+DW_STREAM_WATERMARK = "fact_stock_indicators@dw"
+# Khóa watermark export delta ra file của TRANSFORM (xác nhận sau khi LOAD_DW commit)
+FACT_EXPORT_WATERMARK = "fact_stock_indicators"
+TMP_DIM_COLUMNS = ["stock_sk", "ticker"]
+TMP_FACT_COLUMNS = [
+    "record_sk",
+    "stock_sk",
+    "datetime_utc",
+    "close",
+    "volume",
+    "diff",
+    "percent_change_close",
+    "rsi",
+    "roc",
+    "bb_upper",
+    "bb_lower",
+    "created_at",
+]
+# Kiểu cột khi đọc file fact theo khối (chunk_rows > 0): khai báo sẵn để pandas không
+# phải đoán kiểu; cột thời gian parse theo ISO 8601 (đúng định dạng COPY TO xuất ra)
+FACT_DTYPES = {
+    "record_sk": "Int64",
+    "stock_sk": "Int64",
+    "close": "float64",
+    "volume": "Int64",
+    "diff": "float64",
+    "percent_change_close": "float64",
+    "rsi": "float64",
+    "roc": "float64",
+    "bb_upper": "float64",
+    "bb_lower": "float64",
+}
+FACT_DATE_COLUMNS = {"datetime_utc": True, "created_at": False}  # cột: utc
+
 # 2. Khởi tạo các services: init_services()
 # - ConfigDWDatabase: lưu cấu hình
 # - DWDatabase: connection tới Data Warehouse 
@@ -47,12 +86,41 @@ def init_services():
     print("Đã khởi tạo thành công các service DW.")
     return config_db, dw_db, log_db, email_service
 
+
+def init_staging_db():
+    """Kết nối DB staging cho transfer_mode = 'stream' (cùng host/user với DW)"""
+    return StagingDatabase(
+        host=os.getenv("DB_HOST"),
+        dbname=os.getenv("DB_NAME_STAGING", "staging"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+
+def read_fact_chunks(fact_path: str, chunk_rows: int):
+    """
+    Đọc file fact theo từng khối chunk_rows dòng (bộ nhớ chỉ giữ một khối),
+    ép kiểu theo FACT_DTYPES và parse cột thời gian với định dạng tường minh.
+    """
+    reader = pd.read_csv(
+        fact_path,
+        usecols=TMP_FACT_COLUMNS,
+        dtype=FACT_DTYPES,
+        chunksize=chunk_rows,
+    )
+    for chunk in reader:
+        for column, utc in FACT_DATE_COLUMNS.items():
+            chunk[column] = pd.to_datetime(chunk[column], format="ISO8601", utc=utc)
+        yield chunk[TMP_FACT_COLUMNS]
+
 def process_dw_load(config, log_db, dw_db, email_service):  
     # 3.1. Lấy thông tin config: id / dim_path / fact_path / procedure_name
     config_id = config["id"]
     dim_path = config["dim_path"]
     fact_path = config["fact_path"]
     procedure_name = config.get("procedure", "sp_load_stock_files_from_tmp")
+    stream = (config.get("transfer_mode") or "file") == STREAM_TRANSFER
+    chunk_rows = config.get("chunk_rows") or 0
 
     # 3.2. Ghi log: bắt đầu (READY)
     log_message(
@@ -63,10 +131,18 @@ def process_dw_load(config, log_db, dw_db, email_service):
         message="Bắt đầu load files dim_stock, fact_stock",
     )
 
+    staging_db = None
     try:
         engine = dw_db.engine
-        dim_df = pd.read_csv(dim_path)
-        fact_df = pd.read_csv(fact_path, parse_dates=["datetime_utc"])
+        staging_db = init_staging_db()
+        if stream:
+# 3.3. transfer_mode = 'stream': lấy mốc các dòng fact chưa chuyển
+            since = staging_db.get_export_watermark(DW_STREAM_WATERMARK)
+            until = staging_db.export_upper_bound()
+        else:
+# 3.3. file: mốc chờ của file export delta (đọc trước khi đọc file -> nếu TRANSFORM
+# export lại giữa chừng thì chỉ xác nhận thiếu, không bao giờ bỏ sót dòng)
+            pending = staging_db.get_export_pending(FACT_EXPORT_WATERMARK)
 
 #     3.4. Mở transaction (engine.begin()):
         with engine.begin() as conn:
@@ -77,10 +153,6 @@ def process_dw_load(config, log_db, dw_db, email_service):
                     "CREATE TEMP TABLE tmp_dim_stock (stock_sk INT, ticker VARCHAR(20))"
                 )
             )
-# - Load dim_df vào tmp_dim_stock (to_sql hoặc COPY)
-            dim_df.to_sql(
-                "tmp_dim_stock", conn, if_exists="append", index=False, method="multi"
-            )
 
 # - Tạo TEMP TABLE tmp_fact_stock
             conn.execute(text("DROP TABLE IF EXISTS tmp_fact_stock"))
@@ -104,9 +176,56 @@ def process_dw_load(config, log_db, dw_db, email_service):
             """
                 )
             )
-# - Load fact_df vào tmp_fact_stock
-            fact_df.to_sql(
-                "tmp_fact_stock", conn, if_exists="append", index=False, method="multi"
+# - Load dữ liệu vào tmp_dim_stock, tmp_fact_stock bằng COPY
+# (cùng kết nối psycopg2 của transaction này)
+            start = time.perf_counter()
+            with conn.connection.cursor() as cursor:
+                if stream:
+# - stream: COPY thẳng dim_stock và các dòng fact mới từ staging vào bảng tạm
+                    dim_rows = staging_db.transfer_table(
+                        cursor, "dim_stock", "tmp_dim_stock", TMP_DIM_COLUMNS
+                    )
+                    fact_rows = staging_db.transfer_table(
+                        cursor,
+                        "fact_stock_indicators",
+                        "tmp_fact_stock",
+                        TMP_FACT_COLUMNS,
+                        since,
+                        until,
+                    )
+                else:
+# - file: stream file CSV TRANSFORM đã export vào COPY theo header của file
+                    dim_rows = dw_db.bulk_load(cursor, "tmp_dim_stock", dim_path)
+                    if chunk_rows > 0:
+# - chunk_rows > 0: đọc, ép kiểu và COPY file fact từng khối trong cùng transaction
+                        fact_rows = 0
+                        for chunk in read_fact_chunks(fact_path, chunk_rows):
+                            fact_rows += dw_db.bulk_load(
+                                cursor, "tmp_fact_stock", chunk
+                            )
+                    else:
+                        fact_rows = dw_db.bulk_load(cursor, "tmp_fact_stock", fact_path)
+            elapsed = time.perf_counter() - start
+            rows_per_sec = (dim_rows + fact_rows) / elapsed if elapsed > 0 else 0.0
+            log_message(
+                log_db,
+                "LOAD_DW",
+                config_id,
+                "PROCESSING",
+                message=(
+                    f"Đã COPY {dim_rows} dim, {fact_rows} fact vào bảng tạm "
+                    f"trong {elapsed:.2f}s ({rows_per_sec:,.0f} dòng/s)"
+                ),
+            )
+
+# - Bảo trì partition fact: tạo trước partition tháng (kể cả các ngày của batch này),
+# detach partition quá hạn giữ lại sang fact_archive
+            conn.execute(
+                text("CALL sp_maintain_fact_partitions(:months_ahead, :retention_months)"),
+                {
+                    "months_ahead": config.get("partition_months_ahead") or 3,
+                    "retention_months": config.get("partition_retention_months"),
+                },
             )
 
 #             3.5. Gọi stored procedure (CALL sp_load...):
@@ -114,15 +233,27 @@ def process_dw_load(config, log_db, dw_db, email_service):
             conn.execute(text(f"CALL {procedure_name}()"))
 
 # 3.6. Gọi sp_refresh_all_aggregates() để cập nhật dữ liệu tổng hợp
+# (chỉ tính lại các nhóm có khóa trong tmp_fact_touched do procedure upsert ghi)
             conn.execute(text("CALL sp_refresh_all_aggregates()"))
 # 3.7. Commit transaction (engine.begin() tự commit nếu không lỗi)
+# stream: tiến watermark sau khi DW đã commit (procedure bỏ qua dòng đã có nếu chạy lại)
+        if stream:
+            staging_db.set_export_watermark(
+                DW_STREAM_WATERMARK, until, fact_rows, STREAM_TRANSFER
+            )
+# file: xác nhận file export delta vừa nạp -> TRANSFORM export tiếp từ mốc này
+        elif pending and os.path.abspath(pending[1]) == os.path.abspath(fact_path):
+            staging_db.acknowledge_export(FACT_EXPORT_WATERMARK, pending[0])
 # 3.8. Ghi log SUCCESS hoặc nếu lỗi -> log FAILURE + gửi email
         log_message(
             log_db,
             "LOAD_DW",
             config_id,
             "SUCCESS",
-            message="Load thành công dim_stock, fact_stock",
+            message=(
+                f"Load thành công dim_stock, fact_stock ({fact_rows} bản ghi fact, "
+                f"{rows_per_sec:,.0f} dòng/s)"
+            ),
         )
     except Exception as e:
         log_message(
@@ -136,6 +267,9 @@ def process_dw_load(config, log_db, dw_db, email_service):
             subject=f"[ETL Extract] Lỗi Config ID={config.get('id')}",
             body=f"Lỗi tổng thể trong process_config:\n\n{e}",
         )
+    finally:
+        if staging_db is not None:
+            staging_db.close()
 
 def load_csv_to_tmp_tables(dim_path: str, fact_path: str, dw_db: DWDatabase):
     """
@@ -3,8 +3,10 @@
 ------------------------------------------------------------
 DROP TABLE IF EXISTS log CASCADE;
 DROP TABLE IF EXISTS config_extract CASCADE;
+DROP TABLE IF EXISTS extract_watermark CASCADE;
 DROP TABLE IF EXISTS config_transform CASCADE;
 DROP TABLE IF EXISTS config_load_staging CASCADE;
+DROP TABLE IF EXISTS inbound_file CASCADE;
 DROP TABLE IF EXISTS config_load_datawarehouse CASCADE;
 DROP TABLE IF EXISTS config_load_datamart CASCADE;
 
@@ -18,8 +20,21 @@ CREATE TABLE config_extract (
     period VARCHAR(50) NOT NULL,
     interval VARCHAR(50) NOT NULL,
     output_path VARCHAR(255) NOT NULL,
+    output_format VARCHAR(20) DEFAULT 'csv', -- csv | parquet (phải khớp config_load_staging.file_type)
+    partition_mode VARCHAR(20) DEFAULT 'none', -- none: một file | ticker/rows: ghi dần từng part + _manifest.json
+    rows_per_part INT, -- số dòng tối đa mỗi part khi partition_mode = 'rows'
     emails TEXT[],
-    retry_count INT DEFAULT 0,
+    retry_count INT DEFAULT 0, -- số lượt retry (sau lần tải đầu) cho các ticker lỗi tạm thời, 0: không retry
+    retry_backoff_sec NUMERIC(8,2) DEFAULT 1, -- backoff cơ sở (giây), tăng gấp đôi mỗi lượt, có jitter
+    batch_size INT DEFAULT 0, -- > 0: tải N ticker trong một lần yf.download
+    max_workers INT DEFAULT 1, -- số worker extract song song
+    rate_limit_per_sec NUMERIC(8,2), -- số request tối đa/giây tới Yahoo Finance (NULL: không giới hạn)
+    incremental BOOLEAN DEFAULT FALSE, -- TRUE: chỉ tải các bar sau watermark (extract_watermark)
+    overlap_bars INT DEFAULT 2, -- số bar tải lại trước watermark để tính diff/percent_change
+    cache_dir VARCHAR(255), -- thư mục cache dữ liệu giá trên đĩa (NULL: không cache)
+    cache_ttl_seconds INT DEFAULT 3600, -- entry cache cũ hơn TTL bị bỏ qua
+    cache_max_mb NUMERIC(10,2), -- dung lượng cache tối đa, vượt thì xóa LRU (NULL: không giới hạn)
+    replay_only BOOLEAN DEFAULT FALSE, -- TRUE: chỉ đọc từ cache, không gọi Yahoo Finance
     is_active BOOLEAN DEFAULT TRUE,
     note VARCHAR(255),
     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -46,6 +61,20 @@ VALUES (
 );
 
 
+------------------------------------------------------------
+-- TABLE: extract_watermark
+------------------------------------------------------------
+CREATE TABLE extract_watermark (
+    ticker VARCHAR(20) NOT NULL,
+    interval VARCHAR(50) NOT NULL,
+    last_datetime_utc TIMESTAMPTZ, -- bar cuối cùng đã LOAD_STAGING thành công
+    pending_datetime_utc TIMESTAMPTZ, -- bar cuối cùng EXTRACT đã ghi file, chờ LOAD_STAGING
+    pending_content_hash CHAR(64), -- sha256 của file chứa bar pending (khớp inbound_file.content_hash)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ticker, interval)
+);
+
+
 ------------------------------------------------------------
 -- TABLE: config_transform
 ------------------------------------------------------------
@@ -55,9 +84,16 @@ CREATE TABLE config_transform (
     roc_window INT DEFAULT 10,
     bb_window INT DEFAULT 20,
     source_table VARCHAR(100) NOT NULL,
-    procedure_transform VARCHAR(255),
-    dim_path VARCHAR(255),
+    procedure_transform VARCHAR(255), -- tên procedure SQL (sp_transform_market_prices | sp_transform_market_prices_incremental | sp_transform_market_prices_single_pass) hoặc engine NumPy 'python_vectorized' | 'python_incremental'
+    extra_indicators VARCHAR(100), -- 'ema,macd,atr' (chỉ sp_transform_market_prices_single_pass), NULL: không tính
+    ema_window INT DEFAULT 20,
+    atr_window INT DEFAULT 14,
+    macd_fast INT DEFAULT 12,
+    macd_slow INT DEFAULT 26,
+    macd_signal INT DEFAULT 9,
+    dim_path VARCHAR(255), -- đuôi .gz: export nén gzip
     fact_path VARCHAR(255),
+    export_mode VARCHAR(20) DEFAULT 'delta', -- delta: fact chỉ gồm dòng mới từ lần export trước (export_watermark) | full: toàn bộ bảng
     is_active BOOLEAN DEFAULT TRUE,
     note VARCHAR(255),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -88,10 +124,12 @@ CREATE TABLE config_load_staging (
     id SERIAL PRIMARY KEY,
     source_path VARCHAR(255) NOT NULL,
     target_table VARCHAR(100) NOT NULL,
-    file_type VARCHAR(50) DEFAULT 'csv',
+    file_type VARCHAR(50) DEFAULT 'csv', -- csv | parquet | manifest (các part của EXTRACT partition)
     has_header BOOLEAN DEFAULT TRUE,
+    column_names TEXT, -- has_header = FALSE: tên cột theo thứ tự trong file, phân tách bằng dấu phẩy (NULL: theo thứ tự cột của target_table)
     delimiter VARCHAR(10) DEFAULT ',',
-    load_mode VARCHAR(20) DEFAULT 'append',
+    load_mode VARCHAR(20) DEFAULT 'append', -- append/truncate: truncate rồi load | swap: load vào bảng shadow UNLOGGED rồi đổi tên vào chỗ | batch: không truncate, chỉ thêm batch mới
+    copy_mode VARCHAR(20) DEFAULT 'csv', -- csv | binary: định dạng COPY vào staging (stream theo khối)
     retry_count INT DEFAULT 0,
     is_active BOOLEAN DEFAULT TRUE,
     note VARCHAR(255),
@@ -123,6 +161,31 @@ VALUES (
 );
 
 
+------------------------------------------------------------
+-- TABLE: inbound_file (danh mục file nguồn của LOAD_STAGING)
+------------------------------------------------------------
+CREATE TABLE inbound_file (
+    id SERIAL PRIMARY KEY,
+    config_id INT NOT NULL REFERENCES config_load_staging (id) ON DELETE CASCADE,
+    file_path VARCHAR(500) NOT NULL,
+    file_size BIGINT NOT NULL,
+    file_mtime DOUBLE PRECISION NOT NULL, -- os.stat().st_mtime (giây từ epoch)
+    content_hash CHAR(64) NOT NULL, -- sha256 của nội dung file
+    status VARCHAR(20) CHECK (
+        status IN ('PENDING','LOADED','FAILED','DUPLICATE','MISSING')
+    ) DEFAULT 'PENDING',
+    row_count BIGINT,
+    error_message VARCHAR(255),
+    discovered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    loaded_at TIMESTAMP,
+    UNIQUE (config_id, file_path)
+);
+
+CREATE INDEX idx_inbound_file_mtime ON inbound_file (config_id, file_mtime);
+CREATE INDEX idx_inbound_file_hash ON inbound_file (config_id, content_hash);
+CREATE INDEX idx_inbound_file_pending ON inbound_file (config_id, file_mtime)
+    WHERE status IN ('PENDING','FAILED');
+
 ------------------------------------------------------------
 -- TABLE: log (không có emails)
 ------------------------------------------------------------
@@ -152,7 +215,11 @@ CREATE TABLE config_load_datawarehouse (
     id SERIAL PRIMARY KEY,
     dim_path VARCHAR(200) NOT NULL,
     fact_path VARCHAR(200) NOT NULL,
-    procedure VARCHAR(255) NOT NULL,
+    procedure VARCHAR(255) NOT NULL, -- sp_upsert_stock_files_from_tmp (upsert theo khóa tự nhiên) | sp_load_stock_files_from_tmp (chỉ insert dòng mới)
+    transfer_mode VARCHAR(20) DEFAULT 'file', -- file: đọc CSV dim_path/fact_path | stream: COPY thẳng từ staging (chỉ dòng fact chưa chuyển), không qua file
+    chunk_rows INT DEFAULT 0, -- transfer_mode = 'file': > 0 thì đọc/ép kiểu file fact bằng pandas theo từng khối N dòng rồi COPY (bộ nhớ cố định), 0: COPY thẳng file
+    partition_months_ahead INT DEFAULT 3, -- số tháng partition fact được tạo trước (sp_maintain_fact_partitions)
+    partition_retention_months INT, -- partition fact cũ hơn N tháng bị detach sang schema fact_archive (NULL: giữ tất cả)
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -167,7 +234,7 @@ INSERT INTO config_load_datawarehouse (
 VALUES (
     '/home/fragile/PostgresExports/dim_stock.csv',
     '/home/fragile/PostgresExports/fact_stock_indicators.csv',
-    'sp_load_stock_files_from_tmp',
+    'sp_upsert_stock_files_from_tmp',
     TRUE,
     'admin',
     'admin',
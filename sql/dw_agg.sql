@@ -1,137 +1,370 @@
 -- ============================================
--- AGGREGATE MATERIALIZED VIEWS FOR STOCK DW
+-- AGGREGATE SUMMARY TABLES FOR STOCK DW
 -- ============================================
+-- Các aggregate là bảng tổng hợp được cập nhật tăng dần: sau mỗi lần LOAD_DW,
+-- sp_refresh_all_aggregates chỉ tính lại các nhóm (stock, ngày / tháng, ngày) có khóa
+-- nằm trong tmp_fact_touched (do sp_upsert_stock_files_from_tmp ghi), và cộng/trừ phần
+-- thay đổi vào trạng thái chạy của từng stock (agg_stock_state).
+-- Tên và cột giữ như các materialized view cũ để DM (dm_dw.*) không phải đổi.
+
+DROP MATERIALIZED VIEW IF EXISTS agg_daily_stock_summary;
+DROP MATERIALIZED VIEW IF EXISTS agg_monthly_stock_summary;
+DROP MATERIALIZED VIEW IF EXISTS agg_top_volatile_stocks;
+DROP MATERIALIZED VIEW IF EXISTS agg_volume_by_date;
+DROP MATERIALIZED VIEW IF EXISTS agg_stock_performance;
+DROP VIEW IF EXISTS agg_top_volatile_stocks;
+DROP VIEW IF EXISTS agg_stock_performance;
+DROP TABLE IF EXISTS agg_daily_stock_summary;
+DROP TABLE IF EXISTS agg_monthly_stock_summary;
+DROP TABLE IF EXISTS agg_volume_by_date;
+DROP TABLE IF EXISTS agg_stock_state;
 
 -- ===========================
 -- 1. Daily Stock Summary
 -- ===========================
-DROP MATERIALIZED VIEW IF EXISTS agg_daily_stock_summary;
-DROP INDEX IF EXISTS idx_agg_top_volatility;
-CREATE MATERIALIZED VIEW agg_daily_stock_summary AS
-SELECT
-    fs.stock_sk,
-    ds.ticker,
-    d.full_date,
-    AVG(fs.close) AS avg_close,
-    MAX(fs.close) AS max_close,
-    MIN(fs.close) AS min_close,
-    SUM(fs.volume) AS total_volume,
-    AVG(fs.rsi) AS avg_rsi,
-    AVG(fs.roc) AS avg_roc
-FROM fact_stock_indicators fs
-JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
-JOIN dim_date d ON d.date_sk = fs.date_sk
-GROUP BY fs.stock_sk, ds.ticker, d.full_date
-ORDER BY d.full_date, ds.ticker
-WITH DATA;
+CREATE TABLE agg_daily_stock_summary (
+    stock_sk INT NOT NULL,
+    ticker VARCHAR(20) NOT NULL,
+    full_date DATE NOT NULL,
+    avg_close NUMERIC,
+    max_close NUMERIC,
+    min_close NUMERIC,
+    total_volume NUMERIC,
+    avg_rsi NUMERIC,
+    avg_roc NUMERIC,
+    PRIMARY KEY (stock_sk, full_date)
+);
 
 CREATE UNIQUE INDEX idx_agg_daily_ticker_date ON agg_daily_stock_summary(ticker, full_date);
 
 -- ===========================
 -- 2. Monthly Stock Summary
 -- ===========================
-DROP MATERIALIZED VIEW IF EXISTS agg_monthly_stock_summary;
-
-CREATE MATERIALIZED VIEW agg_monthly_stock_summary AS
-SELECT
-    fs.stock_sk,
-    ds.ticker,
-    d.year,
-    d.month,
-    AVG(fs.close) AS avg_close,
-    SUM(fs.volume) AS total_volume,
-    AVG(fs.rsi) AS avg_rsi,
-    AVG(fs.roc) AS avg_roc
-FROM fact_stock_indicators fs
-JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
-JOIN dim_date d ON d.date_sk = fs.date_sk
-GROUP BY fs.stock_sk, ds.ticker, d.year, d.month
-ORDER BY d.year, d.month, ds.ticker
-WITH DATA;
+CREATE TABLE agg_monthly_stock_summary (
+    stock_sk INT NOT NULL,
+    ticker VARCHAR(20) NOT NULL,
+    year INT NOT NULL,
+    month INT NOT NULL,
+    avg_close NUMERIC,
+    total_volume NUMERIC,
+    avg_rsi NUMERIC,
+    avg_roc NUMERIC,
+    PRIMARY KEY (stock_sk, year, month)
+);
 
 CREATE UNIQUE INDEX idx_agg_monthly_ticker_month ON agg_monthly_stock_summary(ticker, year, month);
 
 -- ===========================
--- 3. Top Volatile Stocks
+-- Trạng thái chạy của từng stock (toàn bộ lịch sử): tổng, số đếm, min, max.
+-- Nạp thêm/sửa dòng fact chỉ cộng/trừ phần chênh lệch, không quét lại lịch sử
+-- (trừ khi dòng bị sửa đang là min/max của stock).
 -- ===========================
-DROP MATERIALIZED VIEW IF EXISTS agg_top_volatile_stocks;
+CREATE TABLE agg_stock_state (
+    stock_sk INT PRIMARY KEY,
+    min_close NUMERIC(12,4),
+    max_close NUMERIC(12,4),
+    rsi_sum NUMERIC NOT NULL DEFAULT 0,
+    rsi_count BIGINT NOT NULL DEFAULT 0,
+    roc_sum NUMERIC NOT NULL DEFAULT 0,
+    abs_roc_sum NUMERIC NOT NULL DEFAULT 0,
+    roc_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
-CREATE MATERIALIZED VIEW agg_top_volatile_stocks AS
+-- ===========================
+-- 3. Top Volatile Stocks
+-- ===========================
+CREATE VIEW agg_top_volatile_stocks AS
 SELECT
-    fs.stock_sk,
+    s.stock_sk,
     ds.ticker,
-    AVG(ABS(fs.roc)) AS avg_volatility
-FROM fact_stock_indicators fs
-JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
-GROUP BY fs.stock_sk, ds.ticker
-ORDER BY avg_volatility DESC
-WITH DATA;
-
--- Không thể tạo UNIQUE INDEX trên (avg_volatility DESC), nên bỏ DESC
-CREATE UNIQUE INDEX idx_agg_top_vol_stock_sk ON agg_top_volatile_stocks(stock_sk);
+    s.abs_roc_sum / NULLIF(s.roc_count, 0) AS avg_volatility
+FROM agg_stock_state s
+JOIN dim_stock ds ON ds.stock_sk = s.stock_sk
+ORDER BY avg_volatility DESC;
 
 -- ===========================
 -- 4. Volume by Date
 -- ===========================
-DROP MATERIALIZED VIEW IF EXISTS agg_volume_by_date;
-
-CREATE MATERIALIZED VIEW agg_volume_by_date AS
-SELECT
-    d.full_date,
-    SUM(fs.volume) AS total_volume,
-    COUNT(*) AS num_records
-FROM fact_stock_indicators fs
-JOIN dim_date d ON d.date_sk = fs.date_sk
-GROUP BY d.full_date
-ORDER BY d.full_date
-WITH DATA;
-
-CREATE UNIQUE INDEX idx_agg_volume_date ON agg_volume_by_date(full_date);
+CREATE TABLE agg_volume_by_date (
+    full_date DATE PRIMARY KEY,
+    total_volume NUMERIC,
+    num_records BIGINT
+);
 
 -- ===========================
 -- 5. Stock Performance Summary
 -- ===========================
-DROP MATERIALIZED VIEW IF EXISTS agg_stock_performance;
-
-CREATE MATERIALIZED VIEW agg_stock_performance AS
+CREATE VIEW agg_stock_performance AS
 SELECT
-    fs.stock_sk,
+    s.stock_sk,
     ds.ticker,
-    MIN(fs.close) AS min_close,
-    MAX(fs.close) AS max_close,
-    (MAX(fs.close) - MIN(fs.close)) AS price_change,
-    AVG(fs.rsi) AS avg_rsi,
-    AVG(fs.roc) AS avg_roc
-FROM fact_stock_indicators fs
-JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
-GROUP BY fs.stock_sk, ds.ticker
-ORDER BY price_change DESC
-WITH DATA;
-
-CREATE UNIQUE INDEX idx_agg_stock_perf ON agg_stock_performance(stock_sk, ticker);
+    s.min_close,
+    s.max_close,
+    (s.max_close - s.min_close) AS price_change,
+    s.rsi_sum / NULLIF(s.rsi_count, 0) AS avg_rsi,
+    s.roc_sum / NULLIF(s.roc_count, 0) AS avg_roc
+FROM agg_stock_state s
+JOIN dim_stock ds ON ds.stock_sk = s.stock_sk
+ORDER BY price_change DESC;
 
 -- ============================================
--- REFRESH ALL AGGREGATES PROCEDURE
+-- REBUILD ALL AGGREGATES PROCEDURE
 -- ============================================
-CREATE OR REPLACE PROCEDURE sp_refresh_all_aggregates()
+-- Tính lại toàn bộ từ fact (lần đầu, sau khi archive partition - sp_maintain_fact_partitions
+-- tự gọi khi có partition bị detach - hoặc khi loader không ghi tmp_fact_touched)
+CREATE OR REPLACE PROCEDURE sp_rebuild_all_aggregates()
 LANGUAGE plpgsql
 AS $$
 BEGIN
-    RAISE NOTICE 'Refreshing agg_daily_stock_summary...';
-    REFRESH MATERIALIZED VIEW CONCURRENTLY agg_daily_stock_summary;
+    TRUNCATE agg_daily_stock_summary, agg_monthly_stock_summary,
+        agg_volume_by_date, agg_stock_state;
 
-    RAISE NOTICE 'Refreshing agg_monthly_stock_summary...';
-    REFRESH MATERIALIZED VIEW CONCURRENTLY agg_monthly_stock_summary;
+    RAISE NOTICE 'Rebuilding agg_daily_stock_summary...';
+    INSERT INTO agg_daily_stock_summary
+    SELECT
+        fs.stock_sk,
+        ds.ticker,
+        d.full_date,
+        AVG(fs.close),
+        MAX(fs.close),
+        MIN(fs.close),
+        SUM(fs.volume),
+        AVG(fs.rsi),
+        AVG(fs.roc)
+    FROM fact_stock_indicators fs
+    JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    GROUP BY fs.stock_sk, ds.ticker, d.full_date;
 
-    RAISE NOTICE 'Refreshing agg_top_volatile_stocks...';
-    REFRESH MATERIALIZED VIEW CONCURRENTLY agg_top_volatile_stocks;
+    RAISE NOTICE 'Rebuilding agg_monthly_stock_summary...';
+    INSERT INTO agg_monthly_stock_summary
+    SELECT
+        fs.stock_sk,
+        ds.ticker,
+        d.year,
+        d.month,
+        AVG(fs.close),
+        SUM(fs.volume),
+        AVG(fs.rsi),
+        AVG(fs.roc)
+    FROM fact_stock_indicators fs
+    JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    GROUP BY fs.stock_sk, ds.ticker, d.year, d.month;
 
-    RAISE NOTICE 'Refreshing agg_volume_by_date...';
-    REFRESH MATERIALIZED VIEW CONCURRENTLY agg_volume_by_date;
+    RAISE NOTICE 'Rebuilding agg_volume_by_date...';
+    INSERT INTO agg_volume_by_date
+    SELECT d.full_date, SUM(fs.volume), COUNT(*)
+    FROM fact_stock_indicators fs
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    GROUP BY d.full_date;
 
-    RAISE NOTICE 'Refreshing agg_stock_performance...';
-    REFRESH MATERIALIZED VIEW CONCURRENTLY agg_stock_performance;
+    RAISE NOTICE 'Rebuilding agg_stock_state...';
+    INSERT INTO agg_stock_state (
+        stock_sk, min_close, max_close,
+        rsi_sum, rsi_count, roc_sum, abs_roc_sum, roc_count
+    )
+    SELECT
+        stock_sk,
+        MIN(close),
+        MAX(close),
+        COALESCE(SUM(rsi), 0),
+        COUNT(rsi),
+        COALESCE(SUM(roc), 0),
+        COALESCE(SUM(ABS(roc)), 0),
+        COUNT(roc)
+    FROM fact_stock_indicators
+    GROUP BY stock_sk;
 
-    RAISE NOTICE 'All aggregates refreshed successfully.';
+    RAISE NOTICE 'All aggregates rebuilt successfully.';
 END;
 $$;
+
+-- ============================================
+-- INCREMENTAL AGGREGATES PROCEDURE
+-- ============================================
+-- Đầu vào (temp table của cùng transaction, do sp_upsert_stock_files_from_tmp tạo):
+--   tmp_fact_touched (stock_sk, date_sk, is_insert): các dòng fact vừa insert/cập nhật
+--   tmp_fact_touched_old (stock_sk, date_sk, close, rsi, roc): giá trị trước khi cập nhật
+-- Chỉ các nhóm chứa khóa đã đụng được tính lại; điều kiện date_sk theo khoảng của batch
+-- để chỉ quét các partition tháng liên quan.
+CREATE OR REPLACE PROCEDURE sp_refresh_aggregates_incremental()
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_min_sk INT;
+    v_max_sk INT;
+    v_month_lo INT;
+    v_month_hi INT;
+BEGIN
+    SELECT MIN(date_sk), MAX(date_sk) INTO v_min_sk, v_max_sk FROM tmp_fact_touched;
+    IF v_min_sk IS NULL THEN
+        RAISE NOTICE 'Không có dòng fact nào thay đổi, bỏ qua cập nhật aggregate.';
+        RETURN;
+    END IF;
+
+    -- Khoảng date_sk phủ trọn các tháng của batch (cho aggregate theo tháng)
+    SELECT
+        fn_date_sk_lower_bound(date_trunc('month', MIN(full_date))::DATE),
+        fn_date_sk_lower_bound((date_trunc('month', MAX(full_date)) + INTERVAL '1 month')::DATE)
+    INTO v_month_lo, v_month_hi
+    FROM dim_date
+    WHERE date_sk BETWEEN v_min_sk AND v_max_sk;
+
+    -- ===========================
+    -- 1. Daily: các cặp (stock, ngày) đã đụng
+    -- ===========================
+    RAISE NOTICE 'Updating agg_daily_stock_summary...';
+    INSERT INTO agg_daily_stock_summary AS a
+    SELECT
+        fs.stock_sk,
+        ds.ticker,
+        d.full_date,
+        AVG(fs.close),
+        MAX(fs.close),
+        MIN(fs.close),
+        SUM(fs.volume),
+        AVG(fs.rsi),
+        AVG(fs.roc)
+    FROM fact_stock_indicators fs
+    JOIN (SELECT DISTINCT stock_sk, date_sk FROM tmp_fact_touched) t
+        ON t.stock_sk = fs.stock_sk AND t.date_sk = fs.date_sk
+    JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    WHERE fs.date_sk BETWEEN v_min_sk AND v_max_sk
+    GROUP BY fs.stock_sk, ds.ticker, d.full_date
+    ON CONFLICT (stock_sk, full_date) DO UPDATE
+    SET ticker = EXCLUDED.ticker,
+        avg_close = EXCLUDED.avg_close,
+        max_close = EXCLUDED.max_close,
+        min_close = EXCLUDED.min_close,
+        total_volume = EXCLUDED.total_volume,
+        avg_rsi = EXCLUDED.avg_rsi,
+        avg_roc = EXCLUDED.avg_roc;
+
+    -- ===========================
+    -- 2. Monthly: các cặp (stock, tháng) đã đụng
+    -- ===========================
+    RAISE NOTICE 'Updating agg_monthly_stock_summary...';
+    INSERT INTO agg_monthly_stock_summary AS a
+    SELECT
+        fs.stock_sk,
+        ds.ticker,
+        d.year,
+        d.month,
+        AVG(fs.close),
+        SUM(fs.volume),
+        AVG(fs.rsi),
+        AVG(fs.roc)
+    FROM fact_stock_indicators fs
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    JOIN (
+        SELECT DISTINCT t.stock_sk, td.year, td.month
+        FROM tmp_fact_touched t
+        JOIN dim_date td ON td.date_sk = t.date_sk
+    ) t ON t.stock_sk = fs.stock_sk AND t.year = d.year AND t.month = d.month
+    JOIN dim_stock ds ON ds.stock_sk = fs.stock_sk
+    WHERE fs.date_sk >= v_month_lo AND fs.date_sk < v_month_hi
+    GROUP BY fs.stock_sk, ds.ticker, d.year, d.month
+    ON CONFLICT (stock_sk, year, month) DO UPDATE
+    SET ticker = EXCLUDED.ticker,
+        avg_close = EXCLUDED.avg_close,
+        total_volume = EXCLUDED.total_volume,
+        avg_rsi = EXCLUDED.avg_rsi,
+        avg_roc = EXCLUDED.avg_roc;
+
+    -- ===========================
+    -- 3. Volume by date: các ngày đã đụng (mọi stock)
+    -- ===========================
+    RAISE NOTICE 'Updating agg_volume_by_date...';
+    INSERT INTO agg_volume_by_date AS a
+    SELECT d.full_date, SUM(fs.volume), COUNT(*)
+    FROM fact_stock_indicators fs
+    JOIN dim_date d ON d.date_sk = fs.date_sk
+    WHERE fs.date_sk IN (SELECT date_sk FROM tmp_fact_touched)
+      AND fs.date_sk BETWEEN v_min_sk AND v_max_sk
+    GROUP BY d.full_date
+    ON CONFLICT (full_date) DO UPDATE
+    SET total_volume = EXCLUDED.total_volume,
+        num_records = EXCLUDED.num_records;
+
+    -- ===========================
+    -- 4. Trạng thái từng stock: + giá trị mới của dòng đã đụng, - giá trị cũ của dòng bị sửa
+    -- ===========================
+    RAISE NOTICE 'Updating agg_stock_state...';
+    INSERT INTO agg_stock_state AS s (
+        stock_sk, min_close, max_close,
+        rsi_sum, rsi_count, roc_sum, abs_roc_sum, roc_count
+    )
+    SELECT
+        stock_sk,
+        MIN(close) FILTER (WHERE sign = 1),
+        MAX(close) FILTER (WHERE sign = 1),
+        COALESCE(SUM(sign * rsi), 0),
+        COALESCE(SUM(sign) FILTER (WHERE rsi IS NOT NULL), 0),
+        COALESCE(SUM(sign * roc), 0),
+        COALESCE(SUM(sign * ABS(roc)), 0),
+        COALESCE(SUM(sign) FILTER (WHERE roc IS NOT NULL), 0)
+    FROM (
+        SELECT fs.stock_sk, fs.close, fs.rsi, fs.roc, 1 AS sign
+        FROM fact_stock_indicators fs
+        JOIN tmp_fact_touched t
+            ON t.stock_sk = fs.stock_sk AND t.date_sk = fs.date_sk
+        WHERE fs.date_sk BETWEEN v_min_sk AND v_max_sk
+        UNION ALL
+        SELECT stock_sk, close, rsi, roc, -1
+        FROM tmp_fact_touched_old
+    ) delta
+    GROUP BY stock_sk
+    ON CONFLICT (stock_sk) DO UPDATE
+    SET min_close = LEAST(s.min_close, EXCLUDED.min_close),
+        max_close = GREATEST(s.max_close, EXCLUDED.max_close),
+        rsi_sum = s.rsi_sum + EXCLUDED.rsi_sum,
+        rsi_count = s.rsi_count + EXCLUDED.rsi_count,
+        roc_sum = s.roc_sum + EXCLUDED.roc_sum,
+        abs_roc_sum = s.abs_roc_sum + EXCLUDED.abs_roc_sum,
+        roc_count = s.roc_count + EXCLUDED.roc_count,
+        updated_at = CURRENT_TIMESTAMP;
+
+    -- min/max không trừ được: stock có dòng bị sửa đúng bằng min/max hiện tại thì quét lại
+    UPDATE agg_stock_state s
+    SET min_close = m.min_close,
+        max_close = m.max_close
+    FROM (
+        SELECT fs.stock_sk, MIN(fs.close) AS min_close, MAX(fs.close) AS max_close
+        FROM fact_stock_indicators fs
+        WHERE fs.stock_sk IN (
+            SELECT o.stock_sk
+            FROM tmp_fact_touched_old o
+            JOIN agg_stock_state cur ON cur.stock_sk = o.stock_sk
+            WHERE o.close <= cur.min_close OR o.close >= cur.max_close
+        )
+        GROUP BY fs.stock_sk
+    ) m
+    WHERE s.stock_sk = m.stock_sk;
+
+    RAISE NOTICE 'All aggregates updated incrementally.';
+END;
+$$;
+
+-- ============================================
+-- REFRESH ALL AGGREGATES PROCEDURE
+-- ============================================
+-- LOAD_DW gọi sau procedure nạp fact, trong cùng transaction
+CREATE OR REPLACE PROCEDURE sp_refresh_all_aggregates()
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF to_regclass('pg_temp.tmp_fact_touched') IS NULL
+       OR to_regclass('pg_temp.tmp_fact_touched_old') IS NULL THEN
+        RAISE NOTICE 'Loader không ghi tmp_fact_touched, tính lại toàn bộ aggregate...';
+        CALL sp_rebuild_all_aggregates();
+        RETURN;
+    END IF;
+
+    CALL sp_refresh_aggregates_incremental();
+END;
+$$;
+
+CALL sp_rebuild_all_aggregates();
@@ -58,8 +58,10 @@ END $$;
 -- ===================================
 -- FACT: STOCK INDICATORS
 -- ===================================
+-- Partition theo tháng trên date_sk (RANGE): dim_date được sinh tuần tự theo ngày nên
+-- date_sk tăng cùng full_date. Partition tạo bởi sp_create_fact_partitions / sp_maintain_fact_partitions
 CREATE TABLE fact_stock_indicators (
-    record_sk SERIAL PRIMARY KEY,
+    record_sk SERIAL,
     stock_sk INT NOT NULL REFERENCES dim_stock(stock_sk) ON DELETE CASCADE,
     date_sk INT NOT NULL REFERENCES dim_date(date_sk) ON DELETE CASCADE,
     close NUMERIC(12,4),
@@ -70,14 +72,22 @@ CREATE TABLE fact_stock_indicators (
     roc NUMERIC(8,4),
     bb_upper NUMERIC(12,4),
     bb_lower NUMERIC(12,4),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    row_hash UUID, -- fn_fact_row_hash của các measure, để upsert chỉ cập nhật dòng thực sự đổi
+    PRIMARY KEY (record_sk, date_sk)
+) PARTITION BY RANGE (date_sk);
 
 -- ===================================
 -- INDEXES
 -- ===================================
-CREATE INDEX IF NOT EXISTS idx_fact_stock_sk ON fact_stock_indicators(stock_sk);
-CREATE INDEX IF NOT EXISTS idx_fact_date_sk ON fact_stock_indicators(date_sk);
+-- Khóa tự nhiên (một dòng / stock / ngày): ON CONFLICT của sp_upsert_stock_files_from_tmp,
+-- đồng thời thay cho index riêng trên stock_sk (cột đầu của khóa)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_fact_stock_date ON fact_stock_indicators(stock_sk, date_sk);
+-- Dữ liệu trong mỗi partition được nạp theo thứ tự thời gian: BRIN nhỏ hơn B-tree rất nhiều
+CREATE INDEX IF NOT EXISTS brin_fact_date_sk ON fact_stock_indicators USING BRIN (date_sk);
+
+-- Partition đã detach (sp_maintain_fact_partitions với p_retention_months) được chuyển vào đây
+CREATE SCHEMA IF NOT EXISTS fact_archive;
 -- ===================================
 -- DROP TABLES (nếu đã tồn tại)
 -- ===================================
@@ -138,8 +148,10 @@ END $$;
 -- ===================================
 -- FACT: STOCK INDICATORS
 -- ===================================
+-- Partition theo tháng trên date_sk (RANGE): dim_date được sinh tuần tự theo ngày nên
+-- date_sk tăng cùng full_date. Partition tạo bởi sp_create_fact_partitions / sp_maintain_fact_partitions
 CREATE TABLE fact_stock_indicators (
-    record_sk SERIAL PRIMARY KEY,
+    record_sk SERIAL,
     stock_sk INT NOT NULL REFERENCES dim_stock(stock_sk) ON DELETE CASCADE,
     date_sk INT NOT NULL REFERENCES dim_date(date_sk) ON DELETE CASCADE,
     close NUMERIC(12,4),
@@ -150,14 +162,22 @@ CREATE TABLE fact_stock_indicators (
     roc NUMERIC(8,4),
     bb_upper NUMERIC(12,4),
     bb_lower NUMERIC(12,4),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    row_hash UUID, -- fn_fact_row_hash của các measure, để upsert chỉ cập nhật dòng thực sự đổi
+    PRIMARY KEY (record_sk, date_sk)
+) PARTITION BY RANGE (date_sk);
 
 -- ===================================
 -- INDEXES
 -- ===================================
-CREATE INDEX IF NOT EXISTS idx_fact_stock_sk ON fact_stock_indicators(stock_sk);
-CREATE INDEX IF NOT EXISTS idx_fact_date_sk ON fact_stock_indicators(date_sk);
+-- Khóa tự nhiên (một dòng / stock / ngày): ON CONFLICT của sp_upsert_stock_files_from_tmp,
+-- đồng thời thay cho index riêng trên stock_sk (cột đầu của khóa)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_fact_stock_date ON fact_stock_indicators(stock_sk, date_sk);
+-- Dữ liệu trong mỗi partition được nạp theo thứ tự thời gian: BRIN nhỏ hơn B-tree rất nhiều
+CREATE INDEX IF NOT EXISTS brin_fact_date_sk ON fact_stock_indicators USING BRIN (date_sk);
+
+-- Partition đã detach (sp_maintain_fact_partitions với p_retention_months) được chuyển vào đây
+CREATE SCHEMA IF NOT EXISTS fact_archive;
 CREATE OR REPLACE PROCEDURE sp_load_stock_files_from_tmp()
 LANGUAGE plpgsql
 AS $$
@@ -205,7 +225,12 @@ BEGIN
         f.bb_upper,
         f.bb_lower,
         f.created_at
-    FROM tmp_fact_stock f
+    FROM (
+        -- Mỗi stock/ngày chỉ một dòng (bar cuối ngày), khớp khóa uq_fact_stock_date
+        SELECT DISTINCT ON (stock_sk, datetime_utc::DATE) *
+        FROM tmp_fact_stock
+        ORDER BY stock_sk, datetime_utc::DATE, datetime_utc DESC
+    ) f
     JOIN dim_date d ON d.full_date = f.datetime_utc::DATE
     LEFT JOIN fact_stock_indicators fi
         ON fi.stock_sk = f.stock_sk AND fi.date_sk = d.date_sk
@@ -216,3 +241,264 @@ BEGIN
 
 END;
 $$;
+
+-- ===================================
+-- HASH CÁC MEASURE CỦA MỘT DÒNG FACT
+-- ===================================
+CREATE OR REPLACE FUNCTION fn_fact_row_hash(
+    p_close NUMERIC,
+    p_volume BIGINT,
+    p_diff NUMERIC,
+    p_percent_change_close NUMERIC,
+    p_rsi NUMERIC,
+    p_roc NUMERIC,
+    p_bb_upper NUMERIC,
+    p_bb_lower NUMERIC
+)
+RETURNS UUID
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT md5(ROW(
+        p_close, p_volume, p_diff, p_percent_change_close,
+        p_rsi, p_roc, p_bb_upper, p_bb_lower
+    )::TEXT)::UUID;
+$$;
+
+-- ===================================
+-- UPSERT FACT THEO KHÓA TỰ NHIÊN (stock_sk, date_sk)
+-- ===================================
+-- Thay cho anti-join của sp_load_stock_files_from_tmp: INSERT ... ON CONFLICT dò thẳng
+-- uq_fact_stock_date. Bar bị sửa (cùng stock/ngày, measure khác) cập nhật dòng cũ; dòng có
+-- row_hash không đổi được bỏ qua nên không sinh bản ghi/WAL thừa.
+CREATE OR REPLACE PROCEDURE sp_upsert_stock_files_from_tmp()
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted_dim INT := 0;
+    inserted_fact INT := 0;
+    updated_fact INT := 0;
+BEGIN
+    -- ============================
+    -- 1. Load dim_stock từ tmp_dim_stock
+    -- ============================
+    INSERT INTO dim_stock(ticker)
+    SELECT DISTINCT ticker
+    FROM tmp_dim_stock
+    ON CONFLICT (ticker) DO NOTHING;
+
+    GET DIAGNOSTICS inserted_dim = ROW_COUNT;
+    RAISE NOTICE 'Dim_stock: % bản ghi mới insert', inserted_dim;
+
+    -- ============================
+    -- 2. Dòng vào: bar cuối ngày của mỗi stock, kèm date_sk và row_hash
+    -- ============================
+    -- ON CONFLICT không cho một lệnh đụng cùng khóa hai lần nên mỗi stock/ngày chỉ một dòng
+    DROP TABLE IF EXISTS tmp_fact_incoming;
+    CREATE TEMP TABLE tmp_fact_incoming ON COMMIT DROP AS
+    SELECT
+        f.stock_sk,
+        d.date_sk,
+        f.close,
+        f.volume,
+        f.diff,
+        f.percent_change_close,
+        f.rsi,
+        f.roc,
+        f.bb_upper,
+        f.bb_lower,
+        f.created_at,
+        fn_fact_row_hash(
+            f.close, f.volume, f.diff, f.percent_change_close,
+            f.rsi, f.roc, f.bb_upper, f.bb_lower
+        ) AS row_hash
+    FROM (
+        SELECT DISTINCT ON (stock_sk, datetime_utc::DATE) *
+        FROM tmp_fact_stock
+        ORDER BY stock_sk, datetime_utc::DATE, datetime_utc DESC
+    ) f
+    JOIN dim_date d ON d.full_date = f.datetime_utc::DATE;
+    ANALYZE tmp_fact_incoming;
+
+    -- ============================
+    -- 3. Giá trị cũ của các dòng sắp bị cập nhật (sp_refresh_all_aggregates trừ khỏi
+    --    trạng thái chạy của từng stock)
+    -- ============================
+    DROP TABLE IF EXISTS tmp_fact_touched_old;
+    CREATE TEMP TABLE tmp_fact_touched_old ON COMMIT DROP AS
+    SELECT fi.stock_sk, fi.date_sk, fi.close, fi.rsi, fi.roc
+    FROM tmp_fact_incoming n
+    JOIN fact_stock_indicators fi
+        ON fi.stock_sk = n.stock_sk AND fi.date_sk = n.date_sk
+    WHERE fi.row_hash IS DISTINCT FROM n.row_hash;
+
+    -- ============================
+    -- 4. Upsert fact_stock_indicators, khóa (stock_sk, date_sk) đã insert/cập nhật
+    --    được ghi vào tmp_fact_touched cho aggregate tăng dần
+    -- ============================
+    DROP TABLE IF EXISTS tmp_fact_touched;
+    CREATE TEMP TABLE tmp_fact_touched (
+        stock_sk INT,
+        date_sk INT,
+        is_insert BOOLEAN
+    ) ON COMMIT DROP;
+
+    WITH upserted AS (
+        INSERT INTO fact_stock_indicators AS fi (
+            stock_sk,
+            date_sk,
+            close,
+            volume,
+            diff,
+            percent_change_close,
+            rsi,
+            roc,
+            bb_upper,
+            bb_lower,
+            created_at,
+            row_hash
+        )
+        SELECT
+            stock_sk,
+            date_sk,
+            close,
+            volume,
+            diff,
+            percent_change_close,
+            rsi,
+            roc,
+            bb_upper,
+            bb_lower,
+            created_at,
+            row_hash
+        FROM tmp_fact_incoming
+        ON CONFLICT (stock_sk, date_sk) DO UPDATE
+        SET close = EXCLUDED.close,
+            volume = EXCLUDED.volume,
+            diff = EXCLUDED.diff,
+            percent_change_close = EXCLUDED.percent_change_close,
+            rsi = EXCLUDED.rsi,
+            roc = EXCLUDED.roc,
+            bb_upper = EXCLUDED.bb_upper,
+            bb_lower = EXCLUDED.bb_lower,
+            created_at = EXCLUDED.created_at,
+            row_hash = EXCLUDED.row_hash
+        WHERE fi.row_hash IS DISTINCT FROM EXCLUDED.row_hash
+        RETURNING fi.stock_sk, fi.date_sk, (fi.xmax = 0) AS is_insert
+    )
+    INSERT INTO tmp_fact_touched
+    SELECT stock_sk, date_sk, is_insert FROM upserted;
+
+    SELECT COUNT(*) FILTER (WHERE is_insert), COUNT(*) FILTER (WHERE NOT is_insert)
+    INTO inserted_fact, updated_fact
+    FROM tmp_fact_touched;
+
+    RAISE NOTICE 'Fact_stock_indicators: % bản ghi mới insert, % bản ghi cập nhật',
+        inserted_fact, updated_fact;
+
+END;
+$$;
+
+-- ===================================
+-- QUẢN LÝ PARTITION CỦA fact_stock_indicators
+-- ===================================
+-- date_sk nhỏ nhất có full_date >= p_date (ngoài khoảng dim_date: MAX + 1),
+-- dùng làm cận của partition tháng
+CREATE OR REPLACE FUNCTION fn_date_sk_lower_bound(p_date DATE)
+RETURNS INT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(
+        (SELECT MIN(date_sk) FROM dim_date WHERE full_date >= p_date),
+        (SELECT MAX(date_sk) + 1 FROM dim_date)
+    );
+$$;
+
+-- Tạo các partition tháng fact_stock_indicators_YYYYMM phủ [p_from, p_to] (bỏ qua tháng đã có).
+-- Index của bảng cha (uq_fact_stock_date, BRIN date_sk) tự được tạo trên partition mới.
+CREATE OR REPLACE PROCEDURE sp_create_fact_partitions(p_from DATE, p_to DATE)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::DATE;
+    v_next DATE;
+    v_name TEXT;
+    v_lower INT;
+    v_upper INT;
+BEGIN
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::DATE;
+        v_name := 'fact_stock_indicators_' || to_char(v_month, 'YYYYMM');
+        v_lower := fn_date_sk_lower_bound(v_month);
+        v_upper := fn_date_sk_lower_bound(v_next);
+        IF to_regclass(v_name) IS NULL AND v_lower < v_upper THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF fact_stock_indicators FOR VALUES FROM (%s) TO (%s)',
+                v_name, v_lower, v_upper
+            );
+            RAISE NOTICE 'Đã tạo partition %', v_name;
+        END IF;
+        v_month := v_next;
+    END LOOP;
+END;
+$$;
+
+-- Bảo trì partition, LOAD_DW gọi trước khi nạp fact:
+-- 1. Tạo trước partition từ tháng hiện tại tới p_months_ahead tháng sau
+-- 2. Tạo partition cho các ngày của batch đang nạp (tmp_fact_stock, nếu có)
+-- 3. p_retention_months: detach các partition cũ hơn số tháng này và chuyển sang schema
+--    fact_archive (còn nguyên dữ liệu để dump/xóa sau, không còn nằm trong các truy vấn fact)
+CREATE OR REPLACE PROCEDURE sp_maintain_fact_partitions(
+    p_months_ahead INT DEFAULT 3,
+    p_retention_months INT DEFAULT NULL
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_min DATE;
+    v_max DATE;
+    v_cutoff DATE;
+    v_partition TEXT;
+    v_detached INT := 0;
+BEGIN
+    CALL sp_create_fact_partitions(
+        CURRENT_DATE,
+        (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::DATE
+    );
+
+    IF to_regclass('pg_temp.tmp_fact_stock') IS NOT NULL THEN
+        EXECUTE 'SELECT MIN(datetime_utc)::DATE, MAX(datetime_utc)::DATE FROM tmp_fact_stock'
+        INTO v_min, v_max;
+        IF v_min IS NOT NULL THEN
+            CALL sp_create_fact_partitions(v_min, v_max);
+        END IF;
+    END IF;
+
+    IF p_retention_months IS NOT NULL THEN
+        v_cutoff := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_retention_months))::DATE;
+        FOR v_partition IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'fact_stock_indicators'::REGCLASS
+              AND c.relname ~ '^fact_stock_indicators_[0-9]{6}$'
+              AND to_date(right(c.relname, 6), 'YYYYMM') < v_cutoff
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('ALTER TABLE fact_stock_indicators DETACH PARTITION %I', v_partition);
+            EXECUTE format('ALTER TABLE %I SET SCHEMA fact_archive', v_partition);
+            RAISE NOTICE 'Đã detach partition % sang fact_archive', v_partition;
+            v_detached := v_detached + 1;
+        END LOOP;
+    END IF;
+
+    -- Aggregate được duy trì tăng dần (dw_agg.sql) vẫn còn tính các dòng vừa archive:
+    -- tính lại từ fact hiện tại (trước khi nạp batch mới, phần tăng dần áp dụng sau đó)
+    IF v_detached > 0 AND to_regproc('sp_rebuild_all_aggregates') IS NOT NULL THEN
+        CALL sp_rebuild_all_aggregates();
+    END IF;
+END;
+$$;
+
+CALL sp_maintain_fact_partitions();
@@ -1,7 +1,11 @@
+-- Bỏ bản 3 tham số cũ để CALL 3 tham số không bị nhập nhằng với bản có p_batch_id
+DROP PROCEDURE IF EXISTS sp_transform_market_prices(INT, INT, INT);
+
 CREATE OR REPLACE PROCEDURE sp_transform_market_prices(
     p_rsi_window INT,
     p_roc_window INT,
-    p_bb_window INT
+    p_bb_window INT,
+    p_batch_id BIGINT DEFAULT NULL -- NULL: toàn bộ bảng staging (hành vi cũ)
 )
 LANGUAGE plpgsql
 AS $$
@@ -10,6 +14,7 @@ BEGIN
     INSERT INTO dim_stock (ticker)
     SELECT DISTINCT ticker
     FROM stg_market_prices
+    WHERE p_batch_id IS NULL OR batch_id = p_batch_id
     ON CONFLICT (ticker) DO NOTHING;
 
     -- CTE: join stock, tính toán ROC, RSI, BB
@@ -18,6 +23,7 @@ BEGIN
                ds.stock_sk
         FROM stg_market_prices s
         JOIN dim_stock ds ON ds.ticker = s.ticker
+        WHERE p_batch_id IS NULL OR s.batch_id = p_batch_id
     ),
     roc_calc AS (
         SELECT *, LAG(close, p_roc_window) OVER (PARTITION BY ticker ORDER BY datetime_utc) AS close_n
@@ -61,8 +67,363 @@ BEGIN
           AND bb_upper IS NOT NULL AND bb_lower IS NOT NULL;
 
 
-    -- Xóa dữ liệu staging
-    TRUNCATE TABLE stg_market_prices;
+    -- Xóa dữ liệu staging (chỉ batch vừa transform, các batch khác giữ nguyên)
+    IF p_batch_id IS NULL THEN
+        TRUNCATE TABLE stg_market_prices;
+    ELSE
+        DELETE FROM stg_market_prices WHERE batch_id = p_batch_id;
+    END IF;
+
+END;
+$$;
+
+
+-- Bản incremental: cửa sổ LAG/rolling của mỗi ticker được nối tiếp từ v_lookback bar gần
+-- nhất đã có trong fact_stock_indicators, nên bar đầu batch không bị loại bởi điều kiện
+-- IS NOT NULL. Chỉ bar mới (sau bar cuối trong fact) được tính và ghi: O(số dòng mới).
+CREATE OR REPLACE PROCEDURE sp_transform_market_prices_incremental(
+    p_rsi_window INT,
+    p_roc_window INT,
+    p_bb_window INT,
+    p_batch_id BIGINT DEFAULT NULL
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_lookback INT := GREATEST(p_rsi_window, p_roc_window, p_bb_window);
+BEGIN
+    -- Cập nhật dim_stock
+    INSERT INTO dim_stock (ticker)
+    SELECT DISTINCT ticker
+    FROM stg_market_prices
+    WHERE p_batch_id IS NULL OR batch_id = p_batch_id
+    ON CONFLICT (ticker) DO NOTHING;
+
+    WITH batch AS (
+        SELECT s.ticker, ds.stock_sk, s.datetime_utc, s.close, s.volume,
+               s.diff, s.percent_change_close
+        FROM stg_market_prices s
+        JOIN dim_stock ds ON ds.ticker = s.ticker
+        WHERE p_batch_id IS NULL OR s.batch_id = p_batch_id
+    ),
+    stocks AS (
+        SELECT DISTINCT ticker, stock_sk FROM batch
+    ),
+    -- v_lookback bar gần nhất trong fact của mỗi ticker (index (stock_sk, datetime_utc))
+    history AS (
+        SELECT st.ticker, st.stock_sk, h.datetime_utc, h.close, h.volume::NUMERIC AS volume,
+               h.diff, h.percent_change_close, FALSE AS is_new
+        FROM stocks st
+        CROSS JOIN LATERAL (
+            SELECT f.datetime_utc, f.close, f.volume, f.diff, f.percent_change_close
+            FROM fact_stock_indicators f
+            WHERE f.stock_sk = st.stock_sk
+            ORDER BY f.datetime_utc DESC
+            LIMIT v_lookback
+        ) h
+    ),
+    last_fact AS (
+        SELECT stock_sk, MAX(datetime_utc) AS last_dt FROM history GROUP BY stock_sk
+    ),
+    -- Bar mới: sau bar cuối trong fact (bỏ bar tải lại do overlap), không trùng trong batch
+    new_rows AS (
+        SELECT DISTINCT ON (b.stock_sk, b.datetime_utc)
+               b.ticker, b.stock_sk, b.datetime_utc, b.close, b.volume,
+               b.diff, b.percent_change_close, TRUE AS is_new
+        FROM batch b
+        LEFT JOIN last_fact lf ON lf.stock_sk = b.stock_sk
+        WHERE lf.last_dt IS NULL OR b.datetime_utc > lf.last_dt
+        ORDER BY b.stock_sk, b.datetime_utc
+    ),
+    sp AS (
+        SELECT * FROM history
+        UNION ALL
+        SELECT * FROM new_rows
+    ),
+    roc_calc AS (
+        SELECT *, LAG(close, p_roc_window) OVER (PARTITION BY ticker ORDER BY datetime_utc) AS close_n
+        FROM sp
+    ),
+    bb_calc AS (
+        SELECT *,
+               AVG(close) OVER (PARTITION BY ticker ORDER BY datetime_utc ROWS BETWEEN p_bb_window-1 PRECEDING AND CURRENT ROW) AS ma,
+               STDDEV(close) OVER (PARTITION BY ticker ORDER BY datetime_utc ROWS BETWEEN p_bb_window-1 PRECEDING AND CURRENT ROW) AS std
+        FROM roc_calc
+    ),
+    rsi_calc AS (
+        SELECT *, SUM(CASE WHEN change>0 THEN change ELSE 0 END) OVER w AS gain_sum,
+                  SUM(CASE WHEN change<0 THEN -change ELSE 0 END) OVER w AS loss_sum
+        FROM (
+            SELECT *, close - LAG(close) OVER (PARTITION BY ticker ORDER BY datetime_utc) AS change
+            FROM bb_calc
+        ) t
+        WINDOW w AS (PARTITION BY ticker ORDER BY datetime_utc ROWS BETWEEN p_rsi_window-1 PRECEDING AND CURRENT ROW)
+    ),
+    final_calc AS (
+        SELECT *,
+            CASE WHEN gain_sum IS NULL OR loss_sum IS NULL THEN NULL
+                 WHEN loss_sum=0 THEN 100
+                 ELSE 100 - (100 / (1 + gain_sum/loss_sum))
+            END AS rsi,
+            CASE WHEN close_n IS NULL THEN NULL ELSE ((close - close_n)/close_n)*100 END AS roc,
+            CASE WHEN ma IS NOT NULL AND std IS NOT NULL THEN ma + 2*std ELSE NULL END AS bb_upper,
+            CASE WHEN ma IS NOT NULL AND std IS NOT NULL THEN ma - 2*std ELSE NULL END AS bb_lower
+        FROM rsi_calc
+    )
+    INSERT INTO fact_stock_indicators (
+        stock_sk, close, volume, diff, percent_change_close,
+        rsi, roc, bb_upper, bb_lower, created_at, datetime_utc
+    )
+    SELECT stock_sk, close, volume::BIGINT, diff, percent_change_close,
+           rsi, roc, bb_upper, bb_lower, CURRENT_TIMESTAMP, datetime_utc
+    FROM final_calc
+    WHERE is_new
+          AND close IS NOT NULL AND volume IS NOT NULL
+          AND rsi IS NOT NULL AND roc IS NOT NULL
+          AND bb_upper IS NOT NULL AND bb_lower IS NOT NULL;
+
+    -- Xóa dữ liệu staging (chỉ batch vừa transform)
+    IF p_batch_id IS NULL THEN
+        TRUNCATE TABLE stg_market_prices;
+    ELSE
+        DELETE FROM stg_market_prices WHERE batch_id = p_batch_id;
+    END IF;
+
+END;
+$$;
+
+
+------------------------------------------------------------
+-- Aggregate chạy (running) cho các chỉ báo mở rộng. Dùng như window aggregate với khung
+-- ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW: PostgreSQL cập nhật state từng dòng
+-- theo thứ tự của cửa sổ, nên cả EMA/MACD/ATR chỉ tốn một lượt O(n) trên cùng lần sort.
+-- Tham số window NULL -> chỉ báo bị tắt (state giữ NULL, gần như không tốn chi phí).
+------------------------------------------------------------
+DROP AGGREGATE IF EXISTS ema(NUMERIC, INT);
+DROP AGGREGATE IF EXISTS macd(NUMERIC, INT, INT, INT);
+DROP AGGREGATE IF EXISTS atr_close(NUMERIC, INT);
+
+-- state EMA: {ema}; alpha = 2 / (window + 1), bar đầu tiên là giá trị khởi tạo
+CREATE OR REPLACE FUNCTION ema_step(state FLOAT8[], value NUMERIC, p_window INT)
+RETURNS FLOAT8[]
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+BEGIN
+    IF p_window IS NULL OR value IS NULL THEN
+        RETURN state;
+    END IF;
+    IF state IS NULL THEN
+        RETURN ARRAY[value::FLOAT8];
+    END IF;
+    RETURN ARRAY[state[1] + 2.0 / (p_window + 1) * (value::FLOAT8 - state[1])];
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION ema_final(state FLOAT8[])
+RETURNS FLOAT8
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT state[1];
+$$;
+
+CREATE AGGREGATE ema(NUMERIC, INT) (
+    SFUNC = ema_step,
+    STYPE = FLOAT8[],
+    FINALFUNC = ema_final
+);
+
+-- state MACD: {ema nhanh, ema chậm, signal}; kết quả {macd, signal}
+CREATE OR REPLACE FUNCTION macd_step(
+    state FLOAT8[], value NUMERIC, p_fast INT, p_slow INT, p_signal INT
+)
+RETURNS FLOAT8[]
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+DECLARE
+    v FLOAT8;
+    ema_fast FLOAT8;
+    ema_slow FLOAT8;
+BEGIN
+    IF p_fast IS NULL OR value IS NULL THEN
+        RETURN state;
+    END IF;
+    v := value::FLOAT8;
+    IF state IS NULL THEN
+        RETURN ARRAY[v, v, 0];
+    END IF;
+    ema_fast := state[1] + 2.0 / (p_fast + 1) * (v - state[1]);
+    ema_slow := state[2] + 2.0 / (p_slow + 1) * (v - state[2]);
+    RETURN ARRAY[
+        ema_fast,
+        ema_slow,
+        state[3] + 2.0 / (p_signal + 1) * ((ema_fast - ema_slow) - state[3])
+    ];
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION macd_final(state FLOAT8[])
+RETURNS FLOAT8[]
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT CASE WHEN state IS NULL THEN NULL ELSE ARRAY[state[1] - state[2], state[3]] END;
+$$;
+
+CREATE AGGREGATE macd(NUMERIC, INT, INT, INT) (
+    SFUNC = macd_step,
+    STYPE = FLOAT8[],
+    FINALFUNC = macd_final
+);
+
+-- ATR theo giá đóng cửa (staging chỉ có close): true range = |close - close trước|,
+-- làm mượt Wilder. state: {close trước, tổng/ATR, số true range}
+CREATE OR REPLACE FUNCTION atr_close_step(state FLOAT8[], value NUMERIC, p_window INT)
+RETURNS FLOAT8[]
+LANGUAGE plpgsql IMMUTABLE
+AS $$
+DECLARE
+    v FLOAT8;
+    tr FLOAT8;
+BEGIN
+    IF p_window IS NULL OR value IS NULL THEN
+        RETURN state;
+    END IF;
+    v := value::FLOAT8;
+    IF state IS NULL THEN
+        RETURN ARRAY[v, 0, 0];
+    END IF;
+    tr := ABS(v - state[1]);
+    IF state[3] < p_window THEN
+        -- Chưa đủ window true range: cộng dồn, đủ thì lấy trung bình làm ATR đầu tiên
+        IF state[3] + 1 = p_window THEN
+            RETURN ARRAY[v, (state[2] + tr) / p_window, state[3] + 1];
+        END IF;
+        RETURN ARRAY[v, state[2] + tr, state[3] + 1];
+    END IF;
+    RETURN ARRAY[v, (state[2] * (p_window - 1) + tr) / p_window, state[3] + 1];
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION atr_close_final(state FLOAT8[])
+RETURNS FLOAT8
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT state[2];
+$$;
+
+CREATE AGGREGATE atr_close(NUMERIC, INT) (
+    SFUNC = atr_close_step,
+    STYPE = FLOAT8[],
+    FINALFUNC = atr_close_final
+);
+
+
+-- Bản một lượt của sp_transform_market_prices: mọi cửa sổ dùng chung
+-- PARTITION BY ticker ORDER BY datetime_utc (named window), dữ liệu được đọc theo thứ tự
+-- của index (batch_id, ticker, datetime_utc) nên không cần sort; dim_stock chỉ được join
+-- sau khi tính xong. p_extra: danh sách chỉ báo mở rộng 'ema,macd,atr' (NULL: không tính),
+-- ghi vào fact_stock_extra_indicators cho cùng các dòng của fact_stock_indicators.
+CREATE OR REPLACE PROCEDURE sp_transform_market_prices_single_pass(
+    p_rsi_window INT,
+    p_roc_window INT,
+    p_bb_window INT,
+    p_batch_id BIGINT DEFAULT NULL,
+    p_extra TEXT DEFAULT NULL,
+    p_ema_window INT DEFAULT 20,
+    p_atr_window INT DEFAULT 14,
+    p_macd_fast INT DEFAULT 12,
+    p_macd_slow INT DEFAULT 26,
+    p_macd_signal INT DEFAULT 9
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_extra TEXT[] := string_to_array(lower(replace(COALESCE(p_extra, ''), ' ', '')), ',');
+    v_ema_window INT;
+    v_atr_window INT;
+    v_macd_fast INT;
+BEGIN
+    IF 'ema' = ANY(v_extra) THEN v_ema_window := p_ema_window; END IF;
+    IF 'atr' = ANY(v_extra) THEN v_atr_window := p_atr_window; END IF;
+    IF 'macd' = ANY(v_extra) THEN v_macd_fast := p_macd_fast; END IF;
+
+    -- Cập nhật dim_stock
+    INSERT INTO dim_stock (ticker)
+    SELECT DISTINCT ticker
+    FROM stg_market_prices
+    WHERE p_batch_id IS NULL OR batch_id = p_batch_id
+    ON CONFLICT (ticker) DO NOTHING;
+
+    WITH base AS (
+        -- Lượt 1: mọi chỉ báo chỉ cần close theo thứ tự thời gian
+        SELECT s.ticker, s.datetime_utc, s.close, s.volume, s.diff, s.percent_change_close,
+               s.close - LAG(s.close) OVER w AS change,
+               LAG(s.close, p_roc_window) OVER w AS close_n,
+               AVG(s.close) OVER w_bb AS ma,
+               STDDEV(s.close) OVER w_bb AS std,
+               ema(s.close, v_ema_window) OVER w_run AS ema,
+               macd(s.close, v_macd_fast, p_macd_slow, p_macd_signal) OVER w_run AS macd,
+               atr_close(s.close, v_atr_window) OVER w_run AS atr
+        FROM stg_market_prices s
+        WHERE p_batch_id IS NULL OR s.batch_id = p_batch_id
+        WINDOW w AS (PARTITION BY s.ticker ORDER BY s.datetime_utc),
+               w_bb AS (w ROWS BETWEEN p_bb_window-1 PRECEDING AND CURRENT ROW),
+               w_run AS (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    ),
+    calc AS (
+        -- RSI cần change (LAG) của lượt 1; cùng PARTITION/ORDER nên không sort lại
+        SELECT ds.stock_sk, b.*,
+               CASE WHEN loss_sum = 0 THEN 100
+                    ELSE 100 - (100 / (1 + gain_sum / loss_sum))
+               END AS rsi,
+               CASE WHEN close_n IS NULL THEN NULL ELSE ((close - close_n) / close_n) * 100 END AS roc,
+               ma + 2 * std AS bb_upper,
+               ma - 2 * std AS bb_lower
+        FROM (
+            SELECT base.*,
+                   SUM(GREATEST(change, 0)) OVER w_rsi AS gain_sum,
+                   SUM(GREATEST(-change, 0)) OVER w_rsi AS loss_sum
+            FROM base
+            WINDOW w_rsi AS (
+                PARTITION BY ticker ORDER BY datetime_utc
+                ROWS BETWEEN p_rsi_window-1 PRECEDING AND CURRENT ROW
+            )
+        ) b
+        JOIN dim_stock ds ON ds.ticker = b.ticker
+        WHERE b.close IS NOT NULL AND b.volume IS NOT NULL
+    ),
+    kept AS (
+        SELECT * FROM calc
+        WHERE rsi IS NOT NULL AND roc IS NOT NULL
+              AND bb_upper IS NOT NULL AND bb_lower IS NOT NULL
+    ),
+    fact_rows AS (
+        INSERT INTO fact_stock_indicators (
+            stock_sk, close, volume, diff, percent_change_close,
+            rsi, roc, bb_upper, bb_lower, created_at, datetime_utc
+        )
+        SELECT stock_sk, close, volume::BIGINT, diff, percent_change_close,
+               rsi, roc, bb_upper, bb_lower, CURRENT_TIMESTAMP, datetime_utc
+        FROM kept
+    )
+    INSERT INTO fact_stock_extra_indicators (
+        stock_sk, datetime_utc, ema, macd, macd_signal, atr, created_at
+    )
+    SELECT stock_sk, datetime_utc, ema, macd[1], macd[2], atr, CURRENT_TIMESTAMP
+    FROM kept
+    WHERE cardinality(v_extra) > 0
+    ON CONFLICT (stock_sk, datetime_utc) DO UPDATE
+    SET ema = EXCLUDED.ema,
+        macd = EXCLUDED.macd,
+        macd_signal = EXCLUDED.macd_signal,
+        atr = EXCLUDED.atr,
+        created_at = EXCLUDED.created_at;
+
+    -- Xóa dữ liệu staging (chỉ batch vừa transform)
+    IF p_batch_id IS NULL THEN
+        TRUNCATE TABLE stg_market_prices;
+    ELSE
+        DELETE FROM stg_market_prices WHERE batch_id = p_batch_id;
+    END IF;
 
 END;
 $$;
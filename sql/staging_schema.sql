@@ -1,5 +1,7 @@
 DROP TABLE IF EXISTS stg_market_prices CASCADE;
 
+DROP TABLE IF EXISTS stg_batch CASCADE;
+
 DROP TABLE IF EXISTS stg_transform_market_prices CASCADE;
 
 DROP TABLE IF EXISTS dim_stock CASCADE;
@@ -10,6 +12,10 @@ DROP TABLE IF EXISTS dim_date CASCADE;
 
 DROP TABLE IF EXISTS fact_stock_indicators CASCADE;
 
+DROP TABLE IF EXISTS fact_stock_extra_indicators CASCADE;
+
+DROP TABLE IF EXISTS export_watermark CASCADE;
+
 CREATE EXTENSION IF NOT EXISTS dblink;
 
 CREATE TABLE
@@ -21,7 +27,25 @@ CREATE TABLE
         volume NUMERIC(18, 4),
         diff NUMERIC(18, 4),
         percent_change_close NUMERIC(10, 4),
-        extracted_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        extracted_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        -- Batch của lần LOAD_STAGING đã nạp dòng này. COPY thẳng từ file không có cột này
+        -- nên lấy từ biến phiên etl.batch_id (set_config trong transaction COPY)
+        batch_id BIGINT DEFAULT NULLIF(current_setting('etl.batch_id', true), '')::BIGINT
+    );
+
+CREATE INDEX idx_stg_market_prices_batch ON stg_market_prices (batch_id, ticker, datetime_utc);
+
+-- Mỗi lần LOAD_STAGING là một batch: LOADING -> LOADED -> TRANSFORMING -> DONE (hoặc FAILED).
+-- TRANSFORM chỉ đọc/xóa dòng của batch mình nhận, nhiều batch có thể chạy song song.
+-- DELETED: dòng của batch đã bị bỏ khi LOAD_STAGING truncate/swap bảng staging.
+CREATE TABLE
+    stg_batch (
+        batch_id BIGSERIAL PRIMARY KEY,
+        status VARCHAR(20) NOT NULL DEFAULT 'LOADING' CHECK (
+            status IN ('LOADING', 'LOADED', 'TRANSFORMING', 'DONE', 'FAILED', 'DELETED')
+        ),
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
     );
 
 CREATE TABLE
@@ -44,4 +68,42 @@ CREATE TABLE
         bb_upper NUMERIC(12, 4),
         bb_lower NUMERIC(12, 4),
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
\ No newline at end of file
+    );
+
+-- Lookback cho transform incremental: N bar gần nhất của một stock (LATERAL ... ORDER BY datetime_utc DESC LIMIT N)
+CREATE INDEX idx_fact_stock_indicators_stock_dt ON fact_stock_indicators (stock_sk, datetime_utc);
+
+-- Thứ tự đọc của transform một lượt khi chạy cả bảng (không theo batch):
+-- PARTITION BY ticker ORDER BY datetime_utc không cần sort
+CREATE INDEX idx_stg_market_prices_ticker_dt ON stg_market_prices (ticker, datetime_utc);
+
+-- Chỉ báo mở rộng (config_transform.extra_indicators) của sp_transform_market_prices_single_pass,
+-- tách khỏi fact_stock_indicators để file export/LOAD_DW giữ nguyên cột
+CREATE TABLE
+    fact_stock_extra_indicators (
+        stock_sk INT NOT NULL REFERENCES dim_stock (stock_sk) ON DELETE CASCADE,
+        datetime_utc TIMESTAMPTZ NOT NULL,
+        ema NUMERIC(12, 4),
+        macd NUMERIC(12, 4),
+        macd_signal NUMERIC(12, 4),
+        atr NUMERIC(12, 4), -- ATR theo giá đóng cửa (|close - close trước|, làm mượt Wilder)
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (stock_sk, datetime_utc)
+    );
+
+-- Mốc export delta của TRANSFORM (config_transform.export_mode = 'delta'):
+-- lần export sau lấy các dòng có created_at >= last_created_at (mốc LOAD_DW đã xác nhận),
+-- nên file luôn chứa mọi dòng LOAD_DW chưa nạp. pending_created_at: mốc trên của file
+-- export gần nhất, chỉ thành last_created_at khi LOAD_DW nạp file đó và commit.
+CREATE TABLE
+    export_watermark (
+        table_name VARCHAR(100) PRIMARY KEY,
+        last_created_at TIMESTAMP, -- NULL: LOAD_DW chưa xác nhận lần nào
+        pending_created_at TIMESTAMP,
+        row_count BIGINT, -- số dòng của lần export gần nhất
+        file_path VARCHAR(255),
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+    );
+
+-- Export delta lọc theo created_at
+CREATE INDEX idx_fact_stock_indicators_created_at ON fact_stock_indicators (created_at);
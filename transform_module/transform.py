@@ -1,14 +1,23 @@
-import csv
 import os
 from dotenv import load_dotenv
 from db.staging_db import StagingDatabase
 from db.config_transform_db import ConfigTransformDatabase
 from db.log_db import LogDatabase
 from email_service.email_service import EmailService
+from utils.indicator_util import (
+    FACT_INDICATOR_COLUMNS,
+    INCREMENTAL_ENGINE,
+    PYTHON_ENGINE,
+    build_fact_indicators,
+    lookback_bars,
+)
 from utils.logger_util import log_message
 
 load_dotenv()
 
+# Procedure duy nhất nhận tham số chỉ báo mở rộng (p_extra, p_ema_window, ...)
+SINGLE_PASS_PROCEDURE = "sp_transform_market_prices_single_pass"
+
 # 2. Gọi hàm init_services()
 # - Tự động load cấu hình trong file .env, cụ thể thể load các biến môi trường:  DB_HOST, DB_USER, DB_PASSWORD, DB_PORT, 
 # DB_NAME_CONFIG, DB_NAME_STAGING, DB_NAME_DW, EMAIL_USERNAME, EMAIL_PASSWORD, EMAIL_SIMULATE, EMAIL_ADMIN, DEFAULT_RETRY
@@ -47,6 +56,58 @@ def init_services():
     print("Đã khởi tạo các service TRANSFORM.")
     return config_db, staging_db, log_db, email_service
 
+def run_python_transform(
+    staging_db,
+    source_table,
+    rsi_window,
+    roc_window,
+    bb_window,
+    batch_id=None,
+    incremental=False,
+):
+    """
+    Engine Python (procedure_transform = 'python_vectorized') thay cho sp_transform_market_prices:
+    cùng các bước (cập nhật dim_stock, tính RSI/ROC/BB, ghi fact, xóa staging)
+    trong một transaction, chỉ báo được tính vector hóa bằng NumPy.
+    batch_id: chỉ xử lý và xóa dòng của batch đó (None: toàn bộ bảng, truncate).
+    incremental ('python_incremental'): cửa sổ nối tiếp từ các bar gần nhất trong fact,
+    chỉ ghi bar mới -> không mất bar đầu batch, không ghi trùng bar đã có.
+    """
+    batch_filter = "" if batch_id is None else f"WHERE batch_id = {int(batch_id)}"
+    with staging_db.transaction() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO dim_stock (ticker)
+            SELECT DISTINCT ticker FROM {source_table} {batch_filter}
+            ON CONFLICT (ticker) DO NOTHING;
+            """
+        )
+        prices = staging_db.read_prices_for_transform(cursor, source_table, batch_id)
+        history = None
+        if incremental:
+            history = staging_db.read_indicator_history(
+                cursor,
+                source_table,
+                lookback_bars(rsi_window, roc_window, bb_window),
+                batch_id,
+            )
+        fact = build_fact_indicators(
+            prices,
+            rsi_window,
+            roc_window,
+            bb_window,
+            history=history,
+        )
+        staging_db.copy_dataframe(
+            cursor, fact, "fact_stock_indicators", FACT_INDICATOR_COLUMNS
+        )
+        if batch_id is None:
+            cursor.execute(f"TRUNCATE TABLE {source_table}")
+        else:
+            cursor.execute(f"DELETE FROM {source_table} {batch_filter}")
+    return len(fact)
+
+
 # 3. Gọi hàm run_transform_procedure()
 # Bắt đầu thực hiện xử lý logic cho toàn bộ TRANSFORM
 def run_transform_procedure(
@@ -66,7 +127,15 @@ def run_transform_procedure(
         bb_window = config["bb_window"]
         dim_path = config["dim_path"]
         fact_path = config["fact_path"]
-        procedure = config.get("procedure_transform", "sp_transform_market_prices")
+        procedure = config.get("procedure_transform") or "sp_transform_market_prices"
+        source_table = config.get("source_table") or "stg_market_prices"
+        export_delta = (config.get("export_mode") or "delta") == "delta"
+# 3.1.1. extra_indicators chỉ được hỗ trợ bởi SINGLE_PASS_PROCEDURE -> báo lỗi cấu hình
+        if config.get("extra_indicators") and procedure != SINGLE_PASS_PROCEDURE:
+            raise ValueError(
+                f"extra_indicators ({config['extra_indicators']}) chỉ dùng được với "
+                f"{SINGLE_PASS_PROCEDURE}, không dùng được với {procedure}."
+            )
 # 3.1.1 (YES) 3.2. Khởi tạo latest_load_log = log_db.get_latest_log("LOAD_STAGING", None)
 # Nhằm lấy trạng thái LOAD_STAGING mới nhất
         latest_load_log = log_db.get_latest_log("LOAD_STAGING", None)
@@ -91,40 +160,111 @@ def run_transform_procedure(
             "READY",
             message="Bắt đầu chạy procedure transform.",
         )
-        # 3.4. Bắt đầu chạy procedure transform
-        with staging_db.conn.cursor() as cursor:
+        # 3.4. Bắt đầu chạy procedure transform, lần lượt cho từng batch staging đã LOADED
+        # (claim_batch dùng SKIP LOCKED nên nhiều tiến trình TRANSFORM có thể chạy song song)
+        batch_count = 0
+        while True:
+            batch_id = staging_db.claim_batch()
+            if batch_id is None:
+                break
             # 3.4.1. Ghi log: "TRANSFORM – PROCESSING – Đang chạy {procedure}..."
             log_message(
                 log_db,
                 "TRANSFORM",
                 None,
                 "PROCESSING",
-                message=f"Đang chạy {procedure}...",
+                message=f"Đang chạy {procedure} cho batch {batch_id}...",
             )
-# 3.4.2. Thực thi CALL {procedure}(rsi_window, roc_window, bb_window)
-# Nhằm gọi procedure bên sql để thực hiện:
+            try:
+# 3.4.2. Thực thi CALL {procedure}(rsi_window, roc_window, bb_window, batch_id)
+# Nhằm gọi procedure bên sql để thực hiện (chỉ trên các dòng của batch):
 # Cập nhập dim_stock
 # Tính ROC, RSI, BB
 # Chèn dữ liệu sau khi xử lý vào bảng fact_stock_indicators
-# Truncate bảng stg_market_prices
-            cursor.execute(
-                f"CALL {procedure}(%s, %s, %s);", (rsi_window, roc_window, bb_window)
+# Xóa các dòng của batch khỏi stg_market_prices
+# procedure = 'python_vectorized' / 'python_incremental': chạy các bước trên bằng engine NumPy thay cho CALL
+                if procedure in (PYTHON_ENGINE, INCREMENTAL_ENGINE):
+                    row_count = run_python_transform(
+                        staging_db,
+                        source_table,
+                        rsi_window,
+                        roc_window,
+                        bb_window,
+                        batch_id,
+                        incremental=procedure == INCREMENTAL_ENGINE,
+                    )
+                    log_message(
+                        log_db,
+                        "TRANSFORM",
+                        None,
+                        "PROCESSING",
+                        message=f"Engine {procedure} đã ghi {row_count} bản ghi vào fact_stock_indicators (batch {batch_id}).",
+                    )
+                elif procedure == SINGLE_PASS_PROCEDURE and config.get("extra_indicators"):
+                    # Chỉ báo mở rộng (EMA/MACD/ATR) đi cùng lượt tính của procedure một lượt
+                    with staging_db.transaction() as cursor:
+                        cursor.execute(
+                            f"""
+                            CALL {procedure}(
+                                %s, %s, %s, %s,
+                                p_extra => %s,
+                                p_ema_window => %s,
+                                p_atr_window => %s,
+                                p_macd_fast => %s,
+                                p_macd_slow => %s,
+                                p_macd_signal => %s
+                            );
+                            """,
+                            (
+                                rsi_window,
+                                roc_window,
+                                bb_window,
+                                batch_id,
+                                config["extra_indicators"],
+                                config.get("ema_window") or 20,
+                                config.get("atr_window") or 14,
+                                config.get("macd_fast") or 12,
+                                config.get("macd_slow") or 26,
+                                config.get("macd_signal") or 9,
+                            ),
+                        )
+                else:
+                    with staging_db.transaction() as cursor:
+                        cursor.execute(
+                            f"CALL {procedure}(%s, %s, %s, %s);",
+                            (rsi_window, roc_window, bb_window, batch_id),
+                        )
+            except Exception:
+                # Trả batch về LOADED để lần chạy sau transform lại
+                staging_db.set_batch_status(batch_id, "LOADED")
+                raise
+            # 3.4.3. Đánh dấu batch đã transform xong
+            staging_db.set_batch_status(batch_id, "DONE")
+            batch_count += 1
+        if batch_count == 0:
+            log_message(
+                log_db,
+                "TRANSFORM",
+                None,
+                "WARNING",
+                message="Không có batch staging nào chờ TRANSFORM.",
             )
-            # 3.4.3. Thực hiện commit dữ liệu DB staging
-            staging_db.conn.commit()
 # 3.4.4. Ghi log: "TRANSFORM – SUCCESS – Procedure transform hoàn tất"
         log_message(
             log_db,
             "TRANSFORM",
             None,
             "SUCCESS",
-            message="Procedure transform hoàn tất.",
+            message=f"Procedure transform hoàn tất ({batch_count} batch).",
         )
         print("TRANSFORM completed successfully.")
-# 3.5. Gọi hàm export_table_to_csv(staging_db, table_name, file_path)
+# 3.5. Gọi hàm export_table_to_csv(staging_db, table_name, file_path, delta)
 # Thực hiện xuất dữ liệu ra file CSV lần lượt với hai bảng dim_stock và fact_stock_indicators
+# (dim_stock nhỏ nên luôn export đủ, fact theo export_mode)
         export_table_to_csv(staging_db, "dim_stock", dim_path)
-        export_table_to_csv(staging_db, "fact_stock_indicators", fact_path)
+        export_table_to_csv(
+            staging_db, "fact_stock_indicators", fact_path, delta=export_delta
+        )
 
     except Exception as e:
         log_message(
@@ -144,24 +284,24 @@ def run_transform_procedure(
             )
         raise
 
-# 3.5. Gọi hàm export_table_to_csv(staging_db, table_name, file_path)
+# 3.5. Gọi hàm export_table_to_csv(staging_db, table_name, file_path, delta)
 # Thực hiện xuất dữ liệu ra file CSV lần lượt với hai bảng dim_stock và fact_stock_indicators
-def export_table_to_csv(staging_db, table_name, file_path):
-    with staging_db.conn.cursor() as cursor:
-# 3.5.1. Thực hiện truy vấn (SELECT * FROM {table_name})
-# Để lấy toàn bộ dữ liệu từ bảng staging
-        cursor.execute(f"SELECT * FROM {table_name}")
-        # 3.5.2. Ghi tên cột làm header CSV 
-        rows = cursor.fetchall()
-        colnames = [desc[0] for desc in cursor.description]
-
-    with open(file_path, "w", newline="") as f:
-        # 3.5.3. Ghi dữ liệu rows xuống file CSV
-        writer = csv.writer(f)
-        writer.writerow(colnames)
-        writer.writerows(rows)
-        # 3.5.4. Console: "Export {len(rows)} rows from {table_name} to {file_path}"
-    print(f"Export {len(rows)} rows from {table_name} to {file_path}")
+def export_table_to_csv(staging_db, table_name, file_path, delta=False):
+# 3.5.1. delta: chỉ lấy các dòng có created_at trong [mốc LOAD_DW đã xác nhận, mốc hiện tại)
+# (LOAD_DW lỗi/chưa chạy thì lần export sau vẫn chứa các dòng chưa nạp)
+    since = until = None
+    if delta:
+        since = staging_db.get_export_watermark(table_name)
+        until = staging_db.export_upper_bound()
+# 3.5.2. COPY (SELECT * FROM {table_name} ...) TO STDOUT: stream thẳng xuống file kèm header,
+# file_path đuôi .gz thì nén gzip
+    row_count = staging_db.export_table(table_name, file_path, since, until)
+# 3.5.3. Ghi mốc chờ của file vừa export; LOAD_DW tiến watermark sau khi nạp và commit
+    if delta:
+        staging_db.set_export_pending(table_name, until, row_count, file_path)
+# 3.5.4. Console: "Export {row_count} rows from {table_name} to {file_path}"
+    print(f"Export {row_count} rows from {table_name} to {file_path}")
+    return row_count
 
 # 1. Gọi hàm main(), để bắt đầu khởi động quá trình TRANSFORM
 # In ra màn hình: "=== Bắt đầu quá trình TRANSFORM ==="
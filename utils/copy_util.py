@@ -0,0 +1,208 @@
+import io
+import os
+import struct
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+
+COPY_MODES = ("csv", "binary")
+
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+# Mốc thời gian của PostgreSQL (2000-01-01) tính bằng micro giây từ Unix epoch
+_PG_EPOCH_US = 946_684_800_000_000
+_PG_EPOCH_DAYS = 10_957
+_NUMERIC_NAN = struct.pack(">hhHH", 0, 0, 0xC000, 0)
+
+
+class _ChunkStream(io.RawIOBase):
+    """File-like chỉ đọc, lấy dữ liệu từ generator theo từng khối (cho copy_expert)"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._current = b""
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._pos >= len(self._current):
+                self._current = next(self._chunks, None)
+                self._pos = 0
+                if self._current is None:
+                    self._current = b""
+                    break
+            end = len(self._current) if size < 0 else self._pos + remaining
+            part = self._current[self._pos : end]
+            self._pos += len(part)
+            parts.append(part)
+            remaining -= len(part)
+        return b"".join(parts)
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _row_slices(n: int, chunk_rows: int):
+    for lo in range(0, n, chunk_rows):
+        yield lo, min(n, lo + chunk_rows)
+
+
+def csv_stream(df: pd.DataFrame, columns, chunk_rows: int = 50_000):
+    """Stream CSV (không header) của df[columns], mỗi lần render chunk_rows dòng"""
+
+    def chunks():
+        frame = df[columns]
+        for lo, hi in _row_slices(len(frame), chunk_rows):
+            yield frame.iloc[lo:hi].to_csv(index=False, header=False).encode("utf-8")
+
+    return _ChunkStream(chunks())
+
+
+def _numeric_bytes(value, scale):
+    """
+    Mã hóa một giá trị sang định dạng binary của NUMERIC (chữ số hệ 10000).
+    ±inf (ví dụ phép chia cho 0 trong chỉ báo) trả về None -> NULL: cột NUMERIC(p, s)
+    không chứa được Infinity, giống NULLIF(mẫu, 0) của procedure SQL.
+    """
+    d = value if isinstance(value, Decimal) else Decimal(str(value))
+    if d.is_nan():
+        return _NUMERIC_NAN
+    if d.is_infinite():
+        return None
+    if scale is not None:
+        d = d.quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+    sign, digits, exp = d.as_tuple()
+    dscale = max(0, -exp)
+    intval = int("".join(map(str, digits))) if digits else 0
+    if exp >= 0:
+        intval *= 10**exp
+        exp = 0
+    else:
+        # Đưa số chữ số thập phân về bội của 4 để tách nhóm hệ 10000
+        pad = -(-exp) % 4
+        intval *= 10**pad
+        exp -= pad
+    groups = []
+    while intval:
+        intval, group = divmod(intval, 10000)
+        groups.append(group)
+    groups.reverse()
+    weight = len(groups) - 1 + exp // 4 if groups else 0
+    while groups and groups[-1] == 0:
+        groups.pop()
+    return struct.pack(
+        f">hhHH{len(groups)}H",
+        len(groups),
+        weight,
+        0x4000 if sign else 0x0000,
+        dscale,
+        *groups,
+    )
+
+
+def _encode_column(series: pd.Series, typname: str, scale):
+    """Trả về list bytes (None = NULL) của một cột theo kiểu PostgreSQL typname"""
+    if typname in ("timestamptz", "timestamp"):
+        # timestamptz: quy về UTC; timestamp: giữ giá trị naive (có tz thì quy về UTC)
+        ts = pd.to_datetime(series, utc=typname == "timestamptz")
+        if ts.dt.tz is not None:
+            ts = ts.dt.tz_convert(None)
+        isnull = ts.isna().to_numpy()
+        micros = ts.to_numpy(dtype="datetime64[us]").astype(np.int64) - _PG_EPOCH_US
+        return [
+            None if n else struct.pack(">q", v) for v, n in zip(micros.tolist(), isnull)
+        ]
+    if typname == "date":
+        days = pd.to_datetime(series).to_numpy(dtype="datetime64[D]").astype(np.int64)
+        isnull = series.isna().to_numpy()
+        return [
+            None if n else struct.pack(">i", v - _PG_EPOCH_DAYS)
+            for v, n in zip(days.tolist(), isnull)
+        ]
+
+    values = series.tolist()
+    isnull = series.isna().tolist()
+    if typname == "numeric":
+        encode = lambda v: _numeric_bytes(v, scale)
+    elif typname in ("int8", "int4", "int2"):
+        fmt = {"int8": ">q", "int4": ">i", "int2": ">h"}[typname]
+        encode = lambda v: struct.pack(fmt, int(round(v)))
+    elif typname in ("float8", "float4"):
+        fmt = ">d" if typname == "float8" else ">f"
+        encode = lambda v: struct.pack(fmt, float(v))
+    elif typname == "bool":
+        encode = lambda v: struct.pack(">?", bool(v))
+    elif typname in ("varchar", "text", "bpchar"):
+        encode = lambda v: str(v).encode("utf-8")
+    else:
+        raise ValueError(f"COPY binary chưa hỗ trợ kiểu {typname}")
+    return [None if n else encode(v) for v, n in zip(values, isnull)]
+
+
+def binary_stream(df: pd.DataFrame, columns, column_types, chunk_rows: int = 50_000):
+    """
+    Stream COPY ... WITH (FORMAT binary) của df[columns].
+    column_types: {tên cột: (typname, scale)} lấy từ catalog của bảng đích.
+    Giá trị được mã hóa thẳng sang định dạng binary của kiểu cột (không qua text).
+    """
+
+    def chunks():
+        yield _PGCOPY_HEADER
+        field_count = struct.pack(">h", len(columns))
+        for lo, hi in _row_slices(len(df), chunk_rows):
+            block = df.iloc[lo:hi]
+            encoded = [
+                _encode_column(block[col], *column_types[col]) for col in columns
+            ]
+            out = bytearray()
+            for row in zip(*encoded):
+                out += field_count
+                for value in row:
+                    if value is None:
+                        out += b"\xff\xff\xff\xff"
+                    else:
+                        out += struct.pack(">i", len(value))
+                        out += value
+            yield bytes(out)
+        yield _PGCOPY_TRAILER
+
+    return _ChunkStream(chunks())
+
+
+def pipe_copy(source_cursor, copy_out_sql, target_cursor, copy_in_sql, size=1 << 20):
+    """
+    Chuyển dữ liệu giữa hai kết nối PostgreSQL không qua file: source_cursor chạy
+    COPY ... TO STDOUT ghi vào một pipe (thread riêng), target_cursor chạy
+    COPY ... FROM STDIN đọc từ đầu kia. Bộ nhớ chỉ giữ buffer của pipe.
+    Lỗi ở phía nguồn được raise lại sau khi COPY đích kết thúc (transaction đích
+    phải rollback). Trả về số dòng đã COPY vào đích.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, "wb") as writer:
+                source_cursor.copy_expert(copy_out_sql, writer, size=size)
+        except Exception as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, name="pipe-copy-out", daemon=True)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, "rb") as reader:
+            target_cursor.copy_expert(copy_in_sql, reader, size=size)
+            row_count = target_cursor.rowcount
+    finally:
+        # Đầu đọc đã đóng: nếu COPY đích lỗi giữa chừng, phía nguồn nhận BrokenPipe và dừng
+        producer.join()
+    if errors:
+        raise errors[0]
+    return row_count
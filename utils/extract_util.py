@@ -1,8 +1,15 @@
 import logging
+import re
+import threading
+
 import pandas as pd
 import yfinance as yf
 from datetime import datetime, timezone
 
+# yf.download dùng state toàn cục (yfinance.shared) nên không an toàn khi gọi song song
+# từ nhiều thread; các batch download được tuần tự hóa, bên trong yfinance vẫn tải đa luồng.
+_DOWNLOAD_LOCK = threading.Lock()
+
 
 def parse_tickers(tickers_str_or_list):
     if isinstance(tickers_str_or_list, str):
@@ -16,20 +23,110 @@ def parse_tickers(tickers_str_or_list):
     return tickers
 
 
-def fetch_yfinance_data(ticker: str, period: str, interval: str) -> pd.DataFrame:
-    logging.info(f"Fetching data for {ticker} ({period}, {interval}) ...")
-    data = yf.download(
-        ticker,
-        period=period,
-        interval=interval,
-        auto_adjust=True,
-        progress=False,
+_INTERVAL_PATTERN = re.compile(r"^(\d+)(m|h|d|wk|mo)$")
+_INTERVAL_UNITS = {
+    "m": pd.Timedelta(minutes=1),
+    "h": pd.Timedelta(hours=1),
+    "d": pd.Timedelta(days=1),
+    "wk": pd.Timedelta(weeks=1),
+    "mo": pd.Timedelta(days=31),
+}
+
+
+def interval_to_timedelta(interval: str) -> pd.Timedelta:
+    """Đổi interval của yfinance (5m, 1h, 1d, 1wk, 1mo...) sang Timedelta"""
+    match = _INTERVAL_PATTERN.match(interval.strip().lower())
+    if not match:
+        raise ValueError(f"Interval không hợp lệ: {interval}")
+    return int(match.group(1)) * _INTERVAL_UNITS[match.group(2)]
+
+
+def incremental_start(watermark, interval: str, overlap_bars: int):
+    """Thời điểm bắt đầu tải ở chế độ incremental: watermark lùi lại overlap_bars bar"""
+    return pd.Timestamp(watermark) - max(overlap_bars, 0) * interval_to_timedelta(
+        interval
+    )
+
+
+def trim_to_watermark(df: pd.DataFrame, watermark) -> pd.DataFrame:
+    """
+    Bỏ các bar overlap chỉ dùng để tính Diff/PercentChangeClose (trước watermark).
+    Bar tại watermark được giữ lại vì có thể chưa đóng ở lần extract trước.
+    """
+    if watermark is None:
+        return df
+    return df[df.index >= pd.Timestamp(watermark)]
+
+
+def fetch_yfinance_data(
+    ticker: str, period: str, interval: str, start=None
+) -> pd.DataFrame:
+    logging.info(
+        f"Fetching data for {ticker} ({start or period}, {interval}) ..."
     )
+    # Ticker.history không dùng state toàn cục -> gọi được từ nhiều worker cùng lúc
+    # start != None (incremental): chỉ tải các bar từ start, bỏ qua period
+    if start is not None:
+        data = yf.Ticker(ticker).history(
+            start=start,
+            interval=interval,
+            auto_adjust=True,
+        )
+    else:
+        data = yf.Ticker(ticker).history(
+            period=period,
+            interval=interval,
+            auto_adjust=True,
+        )
 
     if data.empty:
         logging.warning(f"Không có dữ liệu cho {ticker}")
         return pd.DataFrame()
 
+    # Đưa về cùng layout cột (Price, Ticker) như yf.download
+    data = data[["Close", "Volume"]]
+    data.columns = pd.MultiIndex.from_product(
+        [data.columns, [ticker]], names=["Price", "Ticker"]
+    )
+
+    if data.index.tz is None:
+        data.index = data.index.tz_localize("UTC")
+    else:
+        data = data.tz_convert("UTC")
+
+    return data
+
+
+def chunk_tickers(tickers, chunk_size):
+    """Chia danh sách tickers thành các nhóm tối đa chunk_size mã (<= 0: một nhóm duy nhất)"""
+    if not chunk_size or chunk_size <= 0:
+        return [list(tickers)]
+    return [tickers[i : i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+
+
+def fetch_yfinance_batch(
+    tickers, period: str, interval: str, start=None
+) -> pd.DataFrame:
+    """Tải dữ liệu nhiều ticker trong một lần gọi yf.download (cột MultiIndex: Price x Ticker)"""
+    logging.info(
+        f"Fetching batch data for {len(tickers)} tickers ({start or period}, {interval}) ..."
+    )
+    # start != None (incremental): chỉ tải các bar từ start, bỏ qua period
+    window = {"start": start} if start is not None else {"period": period}
+    with _DOWNLOAD_LOCK:
+        data = yf.download(
+            list(tickers),
+            interval=interval,
+            auto_adjust=True,
+            group_by="column",
+            progress=False,
+            **window,
+        )
+
+    if data.empty:
+        logging.warning(f"Không có dữ liệu cho batch {', '.join(tickers)}")
+        return pd.DataFrame()
+
     if data.index.tz is None:
         data.index = data.index.tz_localize("UTC")
     else:
@@ -39,9 +136,14 @@ def fetch_yfinance_data(ticker: str, period: str, interval: str) -> pd.DataFrame
 
 
 def compute_stock_indicators(data: pd.DataFrame, ticker: str) -> pd.DataFrame:
+    if ticker not in data["Close"].columns:
+        raise ValueError(f"Không có dữ liệu trả về cho {ticker} trong batch.")
+
     result = pd.DataFrame()
     result["Close"] = data["Close"][ticker]
     result["Volume"] = data["Volume"][ticker]
+    # Frame của batch dùng chung index cho mọi ticker -> bỏ các bar không thuộc ticker này
+    result = result.dropna(subset=["Close"])
     result["Diff"] = result["Close"].diff()
     result["PercentChangeClose"] = result["Close"].pct_change() * 100
     return result
@@ -62,3 +164,25 @@ def build_records_from_df(ticker: str, df: pd.DataFrame):
             }
         )
     return records
+
+
+def build_frame_from_df(
+    ticker: str, df: pd.DataFrame, extracted_at=None
+) -> pd.DataFrame:
+    """
+    Bản columnar của build_records_from_df: cùng schema cột nhưng không lặp từng dòng,
+    extracted_at được lấy một lần cho cả frame.
+    """
+    if extracted_at is None:
+        extracted_at = datetime.now(timezone.utc)
+    return pd.DataFrame(
+        {
+            "ticker": ticker,
+            "datetime_utc": df.index,
+            "close": df["Close"].to_numpy(),
+            "volume": df["Volume"].to_numpy(),
+            "diff": df["Diff"].to_numpy(),
+            "percent_change_close": df["PercentChangeClose"].to_numpy(),
+            "extracted_at": extracted_at,
+        }
+    )
@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import pandas as pd
+
+MANIFEST_NAME = "_manifest.json"
+OUTPUT_FORMATS = ("csv", "parquet")
+
+
+def write_frame(df: pd.DataFrame, file_path: str, output_format: str):
+    """Ghi DataFrame ra file csv hoặc parquet (snappy)"""
+    if output_format == "parquet":
+        df.to_parquet(file_path, index=False, compression="snappy")
+    else:
+        df.to_csv(file_path, index=False)
+
+
+class ExtractWriter(ABC):
+    """
+    Nơi nhận DataFrame của từng ticker trong lúc EXTRACT chạy.
+    Theo dõi số bản ghi và datetime_utc lớn nhất theo ticker (dùng cho watermark).
+    write() an toàn khi gọi từ nhiều worker.
+    """
+
+    def __init__(self, output_path: str, config_id, output_format: str = "csv"):
+        output_format = (output_format or "csv").lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format không được hỗ trợ: {output_format}")
+        self.output_path = output_path
+        self.config_id = config_id
+        self.output_format = output_format
+        self.row_count = 0
+        self.max_datetimes = {}
+        self._lock = threading.Lock()
+        self._run_name = f"{config_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        os.makedirs(output_path, exist_ok=True)
+
+    def write(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        frame = frame.round(4)
+        with self._lock:
+            self.row_count += len(frame)
+            for ticker, dt in frame.groupby("ticker")["datetime_utc"].max().items():
+                current = self.max_datetimes.get(ticker)
+                self.max_datetimes[ticker] = dt if current is None else max(current, dt)
+            self._write(frame)
+
+    @abstractmethod
+    def _write(self, frame: pd.DataFrame):
+        """Ghi một frame (đã giữ lock của write())"""
+
+    @abstractmethod
+    def close(self) -> str:
+        """Hoàn tất ghi, trả về đường dẫn kết quả"""
+
+    def abort(self):
+        """Bỏ kết quả của lần chạy lỗi"""
+
+
+class BufferedExtractWriter(ExtractWriter):
+    """Gom toàn bộ frame trong bộ nhớ và ghi một file duy nhất khi close() (hành vi cũ)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._frames = []
+
+    def _write(self, frame: pd.DataFrame):
+        self._frames.append(frame)
+
+    def close(self) -> str:
+        file_path = os.path.join(
+            self.output_path, f"{self._run_name}.{self.output_format}"
+        )
+        df = pd.concat(self._frames, ignore_index=True)
+        # Ghi ra tên tạm rồi đổi tên: LOAD_STAGING không bao giờ thấy file ghi dở
+        tmp_path = f"{file_path}.tmp"
+        try:
+            write_frame(df, tmp_path, self.output_format)
+            os.replace(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._frames = []
+        return file_path
+
+    def abort(self):
+        self._frames = []
+
+
+class PartitionedExtractWriter(ExtractWriter):
+    """
+    Ghi từng phần (part) xuống đĩa ngay khi dữ liệu tới, bộ nhớ chỉ giữ tối đa một part.
+    - rows_per_part None/0: mỗi lần write() (một ticker) là một part.
+    - rows_per_part N: gom đủ N dòng rồi ghi một part.
+    Các part nằm trong {output_path}/{config_id}_{timestamp}/, kèm _manifest.json
+    liệt kê các part đã ghi xong; "complete": true chỉ được đặt khi close().
+    """
+
+    def __init__(self, *args, rows_per_part=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows_per_part = rows_per_part or 0
+        self.run_dir = os.path.join(self.output_path, self._run_name)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._parts = []
+        self._pending = []
+        self._pending_rows = 0
+        self._write_manifest(complete=False)
+
+    def _write(self, frame: pd.DataFrame):
+        if not self.rows_per_part:
+            self._flush_part(frame)
+            return
+        self._pending.append(frame)
+        self._pending_rows += len(frame)
+        while self._pending_rows >= self.rows_per_part:
+            buffered = pd.concat(self._pending, ignore_index=True)
+            self._flush_part(buffered.iloc[: self.rows_per_part])
+            rest = buffered.iloc[self.rows_per_part :]
+            self._pending = [rest] if not rest.empty else []
+            self._pending_rows = len(rest)
+
+    def _flush_part(self, df: pd.DataFrame):
+        file_name = f"part-{len(self._parts):05d}.{self.output_format}"
+        write_frame(df, os.path.join(self.run_dir, file_name), self.output_format)
+        self._parts.append(
+            {
+                "file": file_name,
+                "rows": len(df),
+                "tickers": sorted(df["ticker"].unique().tolist()),
+            }
+        )
+        self._write_manifest(complete=False)
+        logging.info(f"Đã ghi part {file_name} ({len(df)} dòng).")
+
+    def _write_manifest(self, complete: bool):
+        manifest = {
+            "config_id": self.config_id,
+            # Tên lần chạy: manifest của các lần chạy khác nhau không bao giờ trùng sha256
+            "run": self._run_name,
+            "format": self.output_format,
+            "complete": complete,
+            "row_count": sum(part["rows"] for part in self._parts),
+            "parts": self._parts,
+        }
+        manifest_path = os.path.join(self.run_dir, MANIFEST_NAME)
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest_path
+
+    def close(self) -> str:
+        with self._lock:
+            if self._pending:
+                self._flush_part(pd.concat(self._pending, ignore_index=True))
+                self._pending = []
+                self._pending_rows = 0
+            return self._write_manifest(complete=True)
+
+    def abort(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def open_extract_writer(config, config_id) -> ExtractWriter:
+    """
+    Chọn writer theo config_extract.partition_mode:
+    - none (mặc định): một file duy nhất như trước
+    - ticker: mỗi ticker một part
+    - rows: mỗi part tối đa rows_per_part dòng
+    """
+    output_path = os.path.join(config["output_path"], "")
+    output_format = config.get("output_format") or "csv"
+    partition_mode = (config.get("partition_mode") or "none").lower()
+    if partition_mode == "none":
+        return BufferedExtractWriter(output_path, config_id, output_format)
+    if partition_mode == "ticker":
+        return PartitionedExtractWriter(output_path, config_id, output_format)
+    if partition_mode == "rows":
+        rows_per_part = config.get("rows_per_part")
+        if not rows_per_part or rows_per_part <= 0:
+            raise ValueError("partition_mode 'rows' cần rows_per_part > 0.")
+        return PartitionedExtractWriter(
+            output_path, config_id, output_format, rows_per_part=rows_per_part
+        )
+    raise ValueError(f"partition_mode không được hỗ trợ: {partition_mode}")
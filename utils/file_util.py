@@ -1,10 +1,28 @@
+import csv
+import gzip
+import hashlib
+import json
 import os
 import pandas as pd
+from utils.extract_writer import MANIFEST_NAME
 from utils.logger_util import log_message
 
 
+# file_type của config_load_staging -> phần mở rộng file do EXTRACT ghi
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+
+
 def get_latest_csv_file(source_path: str, log_db=None, config_id=None):
-    try:      
+    return get_latest_file(source_path, "csv", log_db, config_id)
+
+
+def get_latest_file(
+    source_path: str, file_type: str = "csv", log_db=None, config_id=None
+):
+    try:
+        extension = FILE_EXTENSIONS.get((file_type or "csv").lower())
+        if extension is None:
+            raise ValueError(f"file_type không được hỗ trợ: {file_type}")
 # 7.2.1. Kiểm tra thư mục nguồn source_path tồn tại không ?
         if not os.path.exists(source_path):
             #7.2.1 (NO) Ghi log: "Thu mục nguồn {source_path} không tồn tại." 
@@ -17,7 +35,7 @@ def get_latest_csv_file(source_path: str, log_db=None, config_id=None):
             [
                 os.path.join(source_path, f)
                 for f in os.listdir(source_path)
-                if f.endswith(".csv")
+                if f.endswith(extension)
             ],
             key=os.path.getmtime,
             reverse=True,
@@ -25,7 +43,9 @@ def get_latest_csv_file(source_path: str, log_db=None, config_id=None):
 # 7.2.2.1. Có file CSV nào không?
         if not csv_files:
 #7.2.2.1 (NO) Ghi log: "Không có file CSV nào trong {source_path}"
-            raise FileNotFoundError(f"Không có file CSV nào trong {source_path}")
+            raise FileNotFoundError(
+                f"Không có file {extension} nào trong {source_path}"
+            )
 #7.2.2.1 (YES) 7.2.3. Lấy file CSV mới nhất lastest_file = cvs_files[0]
         latest_file = csv_files[0]
         if log_db:
@@ -35,7 +55,7 @@ def get_latest_csv_file(source_path: str, log_db=None, config_id=None):
                 "LOAD_STAGING",
                 config_id,
                 "SUCCESS",
-                message=f"Tìm thấy file CSV mới nhất: {latest_file}",
+                message=f"Tìm thấy file mới nhất: {latest_file}",
             )
 # 7.2.5. return latest_file
         return latest_file
@@ -47,11 +67,71 @@ def get_latest_csv_file(source_path: str, log_db=None, config_id=None):
                 "LOAD_STAGING",
                 config_id,
                 "FAILURE",
-                error_message=f"Lỗi khi lấy file CSV mới nhất: {e}",
+                error_message=f"Lỗi khi lấy file mới nhất: {e}",
             )
         raise
 
 
+def scan_inbound_files(source_path: str, file_type: str = "csv", since_mtime=None):
+    """
+    Quét thư mục nguồn bằng os.scandir, trả về [(path, size, mtime)] của các file đúng
+    phần mở rộng có mtime >= since_mtime (None: toàn bộ), sắp theo mtime.
+    Chỉ các file mới (sau mốc quét trước) được sắp xếp, không sort cả thư mục.
+    """
+    if (file_type or "csv").lower() == "manifest":
+        return scan_inbound_manifests(source_path, since_mtime)
+    extension = FILE_EXTENSIONS.get((file_type or "csv").lower())
+    if extension is None:
+        raise ValueError(f"file_type không được hỗ trợ: {file_type}")
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(f"Thư mục nguồn {source_path} không tồn tại.")
+    found = []
+    with os.scandir(source_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(extension) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if since_mtime is None or stat.st_mtime >= since_mtime:
+                found.append((entry.path, stat.st_size, stat.st_mtime))
+    return sorted(found, key=lambda item: item[2])
+
+
+def scan_inbound_manifests(source_path: str, since_mtime=None):
+    """
+    Như scan_inbound_files cho file_type = 'manifest': trả về [(path, size, mtime)] của các
+    _manifest.json đã hoàn tất (complete = true) trong thư mục con của source_path.
+    Manifest đang ghi dở bị bỏ qua, lần quét sau (mtime mới hơn) sẽ thấy.
+    """
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(f"Thư mục nguồn {source_path} không tồn tại.")
+    found = []
+    with os.scandir(source_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            try:
+                stat = os.stat(manifest_path)
+                if since_mtime is not None and stat.st_mtime < since_mtime:
+                    continue
+                with open(manifest_path, encoding="utf-8") as f:
+                    complete = json.load(f).get("complete")
+            except FileNotFoundError:
+                continue
+            if complete:
+                found.append((manifest_path, stat.st_size, stat.st_mtime))
+    return sorted(found, key=lambda item: item[2])
+
+
+def file_checksum(file_path: str, block_size: int = 1 << 20) -> str:
+    """sha256 của nội dung file, đọc theo khối"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def read_csv_file(
     file_path: str,
     delimiter: str = ",",
@@ -91,4 +171,93 @@ def read_csv_file(
                 "FAILURE",
                 error_message=f"Lỗi khi đọc file CSV {file_path}: {e}",
             )
-        raise
\ No newline at end of file
+        raise
+
+
+def read_csv_header(file_path: str, delimiter: str = ","):
+    """Đọc dòng header của file CSV (không đọc phần dữ liệu), file .gz được giải nén"""
+    opener = gzip.open if file_path.endswith(".gz") else open
+    with opener(file_path, "rt", newline="", encoding="utf-8") as f:
+        return next(csv.reader(f, delimiter=delimiter), [])
+
+
+def read_parquet_file(file_path: str, log_db=None, config_id=None):
+    """Đọc file Parquet do EXTRACT ghi (giữ nguyên kiểu cột, không qua text)"""
+    try:
+        df = pd.read_parquet(file_path)
+        if df.empty:
+            raise ValueError(f"File Parquet '{file_path}' rỗng, không có dữ liệu.")
+
+        if log_db:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "SUCCESS",
+                message=f"Đọc thành công {len(df)} dòng từ file {file_path}",
+            )
+        return df
+    except Exception as e:
+        if log_db:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "FAILURE",
+                error_message=f"Lỗi khi đọc file Parquet {file_path}: {e}",
+            )
+        raise
+
+
+def get_latest_manifest(source_path: str, log_db=None, config_id=None):
+    """Tìm _manifest.json hoàn tất (complete = true) mới nhất trong các thư mục con của source_path"""
+    try:
+        if not os.path.exists(source_path):
+            raise FileNotFoundError(f"Thư mục nguồn {source_path} không tồn tại.")
+
+        manifests = sorted(
+            [
+                os.path.join(source_path, d, MANIFEST_NAME)
+                for d in os.listdir(source_path)
+                if os.path.isfile(os.path.join(source_path, d, MANIFEST_NAME))
+            ],
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for manifest_path in manifests:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("complete"):
+                if log_db:
+                    log_message(
+                        log_db,
+                        "LOAD_STAGING",
+                        config_id,
+                        "SUCCESS",
+                        message=f"Tìm thấy manifest mới nhất: {manifest_path}",
+                    )
+                return manifest_path
+        raise FileNotFoundError(f"Không có manifest hoàn tất nào trong {source_path}")
+
+    except Exception as e:
+        if log_db:
+            log_message(
+                log_db,
+                "LOAD_STAGING",
+                config_id,
+                "FAILURE",
+                error_message=f"Lỗi khi lấy manifest mới nhất: {e}",
+            )
+        raise
+
+
+def read_manifest_parts(manifest_path: str):
+    """Trả về danh sách (đường dẫn part, định dạng) theo thứ tự trong manifest"""
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(manifest_path)
+    file_format = manifest.get("format", "csv")
+    return [
+        (os.path.join(base_dir, part["file"]), file_format)
+        for part in manifest.get("parts", [])
+    ]
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+# Giá trị config_transform.procedure_transform để chọn engine Python thay cho procedure SQL
+PYTHON_ENGINE = "python_vectorized"
+# Như PYTHON_ENGINE nhưng cửa sổ được nối tiếp từ các bar gần nhất đã có trong fact
+INCREMENTAL_ENGINE = "python_incremental"
+
+PRICE_COLUMNS = [
+    "ticker",
+    "stock_sk",
+    "datetime_utc",
+    "close",
+    "volume",
+    "diff",
+    "percent_change_close",
+]
+
+# Không có created_at: cột này lấy DEFAULT CURRENT_TIMESTAMP của server (thời điểm bắt đầu
+# transaction ghi fact), cùng mốc với procedure SQL và với mốc trên của export delta
+FACT_INDICATOR_COLUMNS = [
+    "stock_sk",
+    "close",
+    "volume",
+    "diff",
+    "percent_change_close",
+    "rsi",
+    "roc",
+    "bb_upper",
+    "bb_lower",
+    "datetime_utc",
+]
+
+
+def segment_starts(keys: np.ndarray) -> np.ndarray:
+    """Với mảng keys đã sắp xếp, trả về vị trí bắt đầu đoạn (ticker) của từng phần tử"""
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    is_start = np.empty(n, dtype=bool)
+    is_start[0] = True
+    is_start[1:] = keys[1:] != keys[:-1]
+    return np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+
+def _rolling_windows(values: np.ndarray, starts: np.ndarray, window: int, chunk_rows: int):
+    """
+    Duyệt các cửa sổ ROWS BETWEEN window-1 PRECEDING AND CURRENT ROW theo từng khối
+    chunk_rows dòng (bộ nhớ tối đa chunk_rows x window). Phần tử thuộc ticker trước
+    (vượt đầu đoạn) được gán NaN. Trả về (lo, hi, block[hi-lo, window]).
+    """
+    n = len(values)
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    view = np.lib.stride_tricks.sliding_window_view(padded, window)
+    # Vị trí k trong cửa sổ của dòng i hợp lệ khi i - (window-1) + k >= starts[i]
+    first_valid = starts - np.arange(n) + window - 1
+    offsets = np.arange(window)
+    for lo in range(0, n, chunk_rows):
+        hi = min(n, lo + chunk_rows)
+        block = view[lo:hi].copy()
+        block[offsets[None, :] < first_valid[lo:hi, None]] = np.nan
+        yield lo, hi, block
+
+
+def rolling_sum(values: np.ndarray, starts: np.ndarray, window: int, chunk_rows=65536):
+    """
+    Tổng trượt theo từng đoạn, tương đương SUM(...) OVER (PARTITION BY ticker
+    ROWS BETWEEN window-1 PRECEDING AND CURRENT ROW): đầu đoạn dùng cửa sổ ngắn hơn.
+    """
+    total = np.empty(len(values))
+    for lo, hi, block in _rolling_windows(values, starts, window, chunk_rows):
+        total[lo:hi] = np.nansum(block, axis=1)
+    return total
+
+
+def rolling_mean_std(
+    values: np.ndarray, starts: np.ndarray, window: int, chunk_rows=65536
+):
+    """
+    AVG và STDDEV (mẫu) trượt theo từng đoạn. Phương sai tính hai lượt trên từng
+    cửa sổ (không dùng tổng bình phương tích lũy) để cửa sổ giá đi ngang cho std = 0.
+    STDDEV là NaN khi cửa sổ chỉ có một dòng.
+    """
+    mean = np.empty(len(values))
+    std = np.empty(len(values))
+    for lo, hi, block in _rolling_windows(values, starts, window, chunk_rows):
+        count = np.sum(~np.isnan(block), axis=1)
+        block_mean = np.nansum(block, axis=1) / count
+        sq_dev = np.nansum((block - block_mean[:, None]) ** 2, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std[lo:hi] = np.where(count > 1, np.sqrt(sq_dev / (count - 1)), np.nan)
+        mean[lo:hi] = block_mean
+    return mean, std
+
+
+def lag(values: np.ndarray, starts: np.ndarray, n: int) -> np.ndarray:
+    """LAG(values, n) OVER (PARTITION BY ticker ...): NaN khi vượt đầu đoạn"""
+    idx = np.arange(len(values))
+    src = idx - n
+    valid = src >= starts
+    result = np.full(len(values), np.nan)
+    result[valid] = values[src[valid]]
+    return result
+
+
+def compute_indicators(
+    tickers: np.ndarray,
+    close: np.ndarray,
+    rsi_window: int,
+    roc_window: int,
+    bb_window: int,
+):
+    """
+    Tính RSI, ROC, Bollinger Bands cho mảng đã sắp theo (ticker, datetime_utc),
+    cùng ngữ nghĩa với sp_transform_market_prices nhưng trên mảng liên tục,
+    không sắp xếp lại dữ liệu cho từng chỉ báo.
+    Trả về dict các mảng rsi, roc, bb_upper, bb_lower (NaN tương ứng NULL).
+    """
+    close = np.asarray(close, dtype=np.float64)
+    starts = segment_starts(np.asarray(tickers))
+
+    # ROC: (close - close_n) / close_n * 100, close_n = LAG(close, roc_window)
+    close_n = lag(close, starts, roc_window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        roc = np.where(close_n != 0, (close - close_n) / close_n * 100, np.nan)
+
+    # BB: AVG/STDDEV (mẫu) trên cửa sổ bb_window
+    ma, std = rolling_mean_std(close, starts, bb_window)
+    bb_upper = ma + 2 * std
+    bb_lower = ma - 2 * std
+
+    # RSI: change = close - LAG(close); dòng đầu đoạn (change NULL) tính là 0 như CASE trong SQL
+    change = close - lag(close, starts, 1)
+    change = np.nan_to_num(change, nan=0.0)
+    gain_sum = rolling_sum(np.where(change > 0, change, 0.0), starts, rsi_window)
+    loss_sum = rolling_sum(np.where(change < 0, -change, 0.0), starts, rsi_window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(loss_sum == 0, 100.0, 100 - 100 / (1 + gain_sum / loss_sum))
+
+    return {"rsi": rsi, "roc": roc, "bb_upper": bb_upper, "bb_lower": bb_lower}
+
+
+def lookback_bars(rsi_window: int, roc_window: int, bb_window: int) -> int:
+    """Số bar lịch sử mỗi ticker cần để bar mới đầu tiên có đủ cửa sổ cho cả 3 chỉ báo"""
+    return max(rsi_window, roc_window, bb_window)
+
+
+def merge_history(prices: pd.DataFrame, history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Nối các bar lịch sử (đã có trong fact) trước các bar mới của batch, cột is_new đánh dấu
+    bar cần tính. Bar mới không sau bar lịch sử cuối của ticker (tải trùng do overlap)
+    và bar trùng datetime trong batch bị bỏ.
+    """
+    prices = prices[PRICE_COLUMNS].drop_duplicates(["ticker", "datetime_utc"])
+    last_dt = history.groupby("ticker")["datetime_utc"].max()
+    cutoff = prices["ticker"].map(last_dt)
+    prices = prices[cutoff.isna() | (prices["datetime_utc"] > cutoff)]
+    return pd.concat(
+        [
+            history[PRICE_COLUMNS].assign(is_new=False),
+            prices.assign(is_new=True),
+        ],
+        ignore_index=True,
+    )
+
+
+def build_fact_indicators(
+    prices: pd.DataFrame,
+    rsi_window: int,
+    roc_window: int,
+    bb_window: int,
+    history: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    prices: các cột ticker, stock_sk, datetime_utc, close, volume, diff, percent_change_close.
+    history: (tùy chọn) lookback_bars() bar gần nhất của mỗi ticker lấy từ fact, cùng cột;
+    cửa sổ được nối tiếp từ lịch sử và chỉ các bar mới được trả về.
+    Trả về DataFrame theo cột của fact_stock_indicators, bỏ các dòng có chỉ báo NULL
+    (giống điều kiện WHERE của procedure).
+    """
+    if history is not None:
+        prices = merge_history(prices, history)
+    prices = prices.sort_values(["ticker", "datetime_utc"], kind="mergesort")
+    prices = prices[prices["close"].notna()].reset_index(drop=True)
+    indicators = compute_indicators(
+        prices["ticker"].to_numpy(),
+        prices["close"].to_numpy(dtype=np.float64),
+        rsi_window,
+        roc_window,
+        bb_window,
+    )
+    fact = pd.DataFrame(
+        {
+            "stock_sk": prices["stock_sk"].to_numpy(),
+            "close": prices["close"].to_numpy(dtype=np.float64),
+            "volume": prices["volume"].to_numpy(dtype=np.float64),
+            "diff": prices["diff"].to_numpy(dtype=np.float64),
+            "percent_change_close": prices["percent_change_close"].to_numpy(
+                dtype=np.float64
+            ),
+            **indicators,
+            "datetime_utc": prices["datetime_utc"],
+        }
+    )
+    required = ["close", "volume", "rsi", "roc", "bb_upper", "bb_lower"]
+    keep = np.isfinite(fact[required]).all(axis=1)
+    if "is_new" in prices:
+        keep &= prices["is_new"].to_numpy(dtype=bool)
+    fact = fact[keep]
+    fact["volume"] = fact["volume"].round().astype(np.int64)
+    return fact[FACT_INDICATOR_COLUMNS].reset_index(drop=True)
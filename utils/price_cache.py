@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+
+
+class CacheMissError(LookupError):
+    """Replay-only mà không có dữ liệu trong cache"""
+
+
+class PriceCache:
+    """
+    Cache trên đĩa cho dữ liệu giá tải từ Yahoo Finance.
+    - Khóa: (ticker, cửa sổ tải, interval, as-of bucket); as-of bucket là thời điểm
+      hiện tại làm tròn xuống theo bucket_seconds nên cache tự xoay vòng theo thời gian.
+    - ttl_seconds: entry cũ hơn TTL bị bỏ qua (coi như miss).
+    - max_bytes: vượt ngưỡng thì xóa các entry ít được dùng nhất (LRU theo atime).
+    - mtime của file là lúc ghi (dùng cho TTL), atime là lần dùng cuối (dùng cho LRU).
+    - replay_only: chỉ đọc cache (bỏ qua TTL/bucket), không gọi nguồn dữ liệu.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl_seconds: float = 3600,
+        max_bytes: Optional[int] = None,
+        bucket_seconds: Optional[float] = None,
+        replay_only: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = max_bytes
+        self.bucket_seconds = float(bucket_seconds or ttl_seconds or 3600)
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _prefix(ticker, window, interval) -> str:
+        digest = hashlib.sha1(f"{ticker}|{window}|{interval}".encode()).hexdigest()
+        # Batch dùng khóa "AAPL,MSFT,..." -> cắt ngắn phần đọc được, digest giữ tính duy nhất
+        return f"{str(ticker).replace(',', '_')[:40]}_{interval}_{digest[:12]}"
+
+    def _path(self, prefix: str, bucket: int) -> str:
+        return os.path.join(self.cache_dir, f"{prefix}_{bucket}.pkl")
+
+    def _current_bucket(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+
+    def _find(self, prefix: str) -> Optional[str]:
+        if self.replay_only:
+            # Replay: lấy entry mới nhất của khóa, không quan tâm bucket/TTL
+            candidates = [
+                os.path.join(self.cache_dir, f)
+                for f in os.listdir(self.cache_dir)
+                if f.startswith(f"{prefix}_") and f.endswith(".pkl")
+            ]
+            return max(candidates, default=None, key=os.path.getmtime)
+
+        path = self._path(prefix, self._current_bucket())
+        if not os.path.exists(path):
+            return None
+        if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+            return None
+        return path
+
+    def get(self, ticker, window, interval) -> Optional[pd.DataFrame]:
+        """Trả về DataFrame đã cache hoặc None (miss)"""
+        prefix = self._prefix(ticker, window, interval)
+        with self._lock:
+            path = self._find(prefix)
+            if path is None:
+                self.misses += 1
+                return None
+            try:
+                data = pd.read_pickle(path)
+            except Exception as e:
+                logging.warning(f"Entry cache hỏng {path}: {e}")
+                os.remove(path)
+                self.misses += 1
+                return None
+            # Cập nhật atime (giữ nguyên mtime) để LRU biết entry vừa được dùng
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            self.hits += 1
+            return data
+
+    def put(self, ticker, window, interval, data: pd.DataFrame):
+        """Ghi DataFrame vào cache (bỏ qua DataFrame rỗng) rồi dọn theo max_bytes"""
+        if data is None or data.empty:
+            return
+        path = self._path(self._prefix(ticker, window, interval), self._current_bucket())
+        with self._lock:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            data.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def fetch(self, ticker, window, interval, loader: Callable[[], pd.DataFrame]):
+        """Đọc từ cache, miss thì gọi loader() và ghi kết quả vào cache"""
+        data = self.get(ticker, window, interval)
+        if data is not None:
+            return data
+        if self.replay_only:
+            raise CacheMissError(
+                f"Replay-only: không có dữ liệu cache cho {ticker} ({window}, {interval})."
+            )
+        data = loader()
+        self.put(ticker, window, interval, data)
+        return data
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        entries = []
+        for f in os.listdir(self.cache_dir):
+            if f.endswith(".pkl"):
+                path = os.path.join(self.cache_dir, f)
+                stat = os.stat(path)
+                entries.append((stat.st_atime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            logging.info(f"Đã xóa entry cache (LRU): {path}")
+
+    def stats_message(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"Cache: {self.hits} hit, {self.misses} miss ({rate:.1f}% hit)."
@@ -0,0 +1,34 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket dùng chung giữa các worker để giữ số request tới nguồn dữ liệu
+    dưới quota cho phép (rate token/giây, tích lũy tối đa capacity token).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate của TokenBucket phải > 0.")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Chờ (block) cho tới khi lấy được đủ token"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,58 @@
+import random
+import socket
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+
+class EmptyBatchError(ValueError):
+    """
+    yf.download của cả một batch trả về rỗng: thường là lỗi tạm thời phía Yahoo Finance
+    (không phải mọi mã đều hủy niêm yết) -> luôn TRANSIENT, retry từng ticker của batch.
+    """
+
+# Dấu hiệu lỗi tạm thời (mạng, timeout, bị giới hạn tần suất) -> đáng để retry
+_TRANSIENT_MARKERS = (
+    "timed out",
+    "timeout",
+    "too many requests",
+    "rate limit",
+    "429",
+    "connection",
+    "temporarily unavailable",
+    "502",
+    "503",
+    "504",
+)
+# Dấu hiệu lỗi vĩnh viễn (mã không tồn tại / đã hủy niêm yết) -> retry cũng vô ích
+_PERMANENT_MARKERS = (
+    "delisted",
+    "no timezone found",
+    "symbol may be",
+    "not found",
+    "404",
+    "không có dữ liệu",
+)
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Phân loại lỗi extract một ticker: TRANSIENT hoặc PERMANENT (mặc định TRANSIENT).
+    PERMANENT chỉ dành cho phản hồi "không có dữ liệu / hủy niêm yết" của riêng ticker đó.
+    """
+    if isinstance(error, (EmptyBatchError, TimeoutError, socket.timeout, ConnectionError)):
+        return TRANSIENT
+    name = type(error).__name__.lower()
+    if "ratelimit" in name or "timeout" in name:
+        return TRANSIENT
+    text = str(error).lower()
+    if any(marker in text for marker in _TRANSIENT_MARKERS):
+        return TRANSIENT
+    if any(marker in text for marker in _PERMANENT_MARKERS):
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff với full jitter: ngẫu nhiên trong [0, min(cap, base * 2^(attempt-1))]"""
+    return random.uniform(0, min(cap, base * (2 ** max(attempt - 1, 0))))
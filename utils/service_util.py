@@ -60,6 +60,16 @@ def init_services(services_to_init):
         class_ = getattr(module, 'ConfigLoadStagingDatabase')
         initialized_services['config_load_staging_db'] = class_(**db_params)
         
+    if 'watermark_db' in services_to_init:
+        module = importlib.import_module('db.watermark_db')
+        class_ = getattr(module, 'WatermarkDatabase')
+        initialized_services['watermark_db'] = class_(**db_params)
+
+    if 'file_catalog_db' in services_to_init:
+        module = importlib.import_module('db.file_catalog_db')
+        class_ = getattr(module, 'FileCatalogDatabase')
+        initialized_services['file_catalog_db'] = class_(**db_params)
+
     if 'config_transform_db' in services_to_init:
         module = importlib.import_module('db.config_transform_db')
         class_ = getattr(module, 'ConfigTransformDatabase')